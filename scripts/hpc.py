@@ -51,7 +51,25 @@ def main(args):
     queue = QueueManager(sample_dir=sample_path,
                          N_CPUs=args.N_cpus,
                          N_batch=args.N_batch,
-                         verbose=True)
+                         verbose=True,
+                         parse_on_completion=args.parse,
+                         executor=args.executor,
+                         runtime_history=args.runtime_history,
+                         watchdog=args.watchdog,
+                         watchdog_strict=args.watchdog_strict,
+                         stall_timeout=args.stall_timeout,
+                         adaptive_timeout=args.adaptive_timeout,
+                         timeout_quantile=args.timeout_quantile,
+                         journal=args.journal,
+                         distributed=args.distributed,
+                         shard_index=args.shard_index,
+                         shard_count=args.shard_count,
+                         result_cache=args.result_cache,
+                         scratch_dir=args.scratch_dir,
+                         compress=args.compress)
+
+    if args.requeue_dnf:
+        queue.requeue_dnf()
 
     queue.manager_run()
 
@@ -69,6 +87,66 @@ if __name__ == "__main__":
     parser.add_argument("--N_batch", required=False, type=int,
                         help="Number of models to run (default: all)")
 
+    parser.add_argument("--parse", action="store_true",
+                        help="Parse the outputs of each model as soon as it finishes (default: parse separately)")
+
+    parser.add_argument("--executor", required=False, type=str, default="process",
+                        choices=["process", "thread", "asyncio"],
+                        help="Run the models from worker processes, threads or an asyncio event loop "
+                             "(default: process)")
+
+    parser.add_argument("--runtime_history", required=False, nargs="+", type=str,
+                        help="Parsed sample directories whose run times are used to run the models "
+                             "longest predicted first (default: directory order)")
+
+    parser.add_argument("--watchdog", action="store_true",
+                        help="Stop the models as soon as their output shows that they failed")
+
+    parser.add_argument("--watchdog_strict", action="store_true",
+                        help="With --watchdog, also stop the models as soon as they print a warning they may "
+                             "still recover from (negative populations, convergence problems)")
+
+    parser.add_argument("--stall_timeout", required=False, type=float,
+                        help="With --watchdog, also stop the models whose output did not grow for this "
+                             "many seconds (default: no stall detection)")
+
+    parser.add_argument("--adaptive_timeout", action="store_true",
+                        help="Give each model a time out predicted from --runtime_history "
+                             "(default: CLOUDY_RUN_TIMEOUT for all models)")
+
+    parser.add_argument("--timeout_quantile", required=False, type=float, default=0.99,
+                        help="Fraction of similar past models that finished within the adaptive time out "
+                             "(default: 0.99)")
+
+    parser.add_argument("--journal", action="store_true",
+                        help="Record the state of every model in a crash-safe journal, and resume from it")
+
+    parser.add_argument("--distributed", action="store_true",
+                        help="Share the sample with the managers of other nodes, each one claiming models "
+                             "until none are left (the sample must be created before starting the nodes)")
+
+    parser.add_argument("--shard_index", required=False, type=int,
+                        help="Index of the shard of the sample run by this job, e.g. the task id of a job array "
+                             "(default: run all models)")
+
+    parser.add_argument("--shard_count", required=False, type=int,
+                        help="Number of shards the sample is split in, e.g. the size of the job array")
+
+    parser.add_argument("--result_cache", action="store_true",
+                        help="Take the outputs of models identical to ones that already ran from the result cache "
+                             "(RESULT_CACHE_DIR), instead of running Cloudy")
+
+    parser.add_argument("--scratch_dir", required=False, type=str,
+                        help="Node-local scratch directory or tmpfs, e.g. $TMPDIR or /dev/shm, where Cloudy runs "
+                             "before its outputs are copied back to the sample (default: run in the sample)")
+
+    parser.add_argument("--compress", action="store_true",
+                        help="Compress the outputs of every model with gzip right after the run")
+
+    parser.add_argument("--requeue_dnf", action="store_true",
+                        help="Run again, with a longer time out, the models that did not finish within "
+                             "their adaptive time out")
+
     my_args = parser.parse_args()
 
     my_args.sample_parent_dir = '../data/samples/'
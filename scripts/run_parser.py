@@ -8,7 +8,7 @@ import pathlib
 sys.path.append('..')
 sys.path.append('../src/')
 
-from src.parser import OutputParser
+from src.parser import OutputParser, load_table
 
 
 # -----------------------------------------------------------------
@@ -16,8 +16,7 @@ from src.parser import OutputParser
 # -----------------------------------------------------------------
 def plot_run_times(path: pathlib.PosixPath, N_sample: int):
 
-    status_file_path = path.joinpath("status.pkl")
-    df = pd.read_pickle(status_file_path)
+    df = load_table(path.joinpath("status"), columns=["status", "time"])
 
     # find run times for successful runs
     run_times_filtered = df['time'][df['status'] == 0]
@@ -35,7 +34,8 @@ def plot_run_times(path: pathlib.PosixPath, N_sample: int):
 # -----------------------------------------------------------------
 #  Parsing of a given run
 # -----------------------------------------------------------------
-def parse_run(N_sample, make_plots=False):
+def parse_run(N_sample, make_plots=False, N_workers=1, hash_mode="fast", cont_format="pickle", cont_dtype="float64",
+              incremental=False, output_format="pickle", max_memory_mb=None, structure=False):
 
     # find run directory for the sample
     run_dir_path = pathlib.Path(F'../data/samples/sample_N{N_sample}/')
@@ -46,8 +46,9 @@ def parse_run(N_sample, make_plots=False):
         exit(1)
 
     # create parser instance and run it
-    output_parser = OutputParser()
-    output_parser.parse(path=run_dir_path_abs)
+    output_parser = OutputParser(cont_format=cont_format, cont_dtype=cont_dtype, output_format=output_format)
+    output_parser.parse(path=run_dir_path_abs, n_workers=N_workers, hash_mode=hash_mode, incremental=incremental,
+                        max_memory_mb=max_memory_mb, structure=structure)
 
     # assuming the parser produced the desired output, we can make a plot
     if make_plots:
@@ -61,7 +62,29 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--N_sample", required=True, type=int, help="Number of models in the sample. ")
+    parser.add_argument("--N_workers", required=False, type=int, default=1,
+                        help="Number of processes used to parse the models (default: 1)")
+    parser.add_argument("--hash_mode", required=False, type=str, default="fast", choices=["fast", "compat"],
+                        help="How the model ids are computed, use 'compat' to reproduce the ids of "
+                             "previously parsed samples (default: fast)")
+    parser.add_argument("--cont_format", required=False, type=str, default="pickle", choices=["pickle", "cube"],
+                        help="How the continuum is saved, 'cube' writes a dense memory-mappable array "
+                             "(default: pickle)")
+    parser.add_argument("--cont_dtype", required=False, type=str, default="float64", choices=["float64", "float32"],
+                        help="dtype of the continuum cube (default: float64)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only parse the models added or changed since the last parse")
+    parser.add_argument("--output_format", required=False, type=str, default="pickle", choices=["pickle", "npy"],
+                        help="How the parsed tables are saved, 'npy' writes one file per column so single columns "
+                             "can be read on their own (default: pickle)")
+    parser.add_argument("--max_memory_mb", required=False, type=float,
+                        help="Stream the parsed results to disk in blocks of this many megabytes, "
+                             "requires --output_format npy (default: keep all results in memory)")
+    parser.add_argument("--structure", action="store_true",
+                        help="Also parse the overview, heating, cooling and optical depth files")
     args = parser.parse_args()
 
-    parse_run(args.N_sample, make_plots=True)
+    parse_run(args.N_sample, make_plots=True, N_workers=args.N_workers, hash_mode=args.hash_mode,
+              cont_format=args.cont_format, cont_dtype=args.cont_dtype, incremental=args.incremental,
+              output_format=args.output_format, max_memory_mb=args.max_memory_mb, structure=args.structure)
 
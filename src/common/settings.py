@@ -6,9 +6,76 @@ SAMPLE_DIR_BASE = 'sample_N'
 SAMPLE_SUBDIR_TODO = 'todo'
 SAMPLE_SUBDIR_DONE = 'done'
 
+# directory, within the sample directory, of the models claimed by a distributed manager while they run
+SAMPLE_SUBDIR_RUNNING = 'running'
+
 PARAMETER_FILE_BASE = 'parameters_N'
 CLOUDY_IN_FILE = 'model.in'
 
+# directory, within the sample directory, of the dense continuum cube written by the parser
+CONT_CUBE_DIR = 'cont_cube'
+
+# directory, within the sample directory, of the dense optical depth cube written by the parser
+OPD_CUBE_DIR = 'opd_cube'
+
+# directory, within the sample directory, of the cache of the dataset loader
+DATASET_CACHE_DIR = 'dataset_cache'
+
+# file, within the sample directory, recording which models were already parsed
+PARSE_MANIFEST_FILE = 'parse_manifest.pkl'
+
+# file, within the sample directory, where the manager workers append the models they parsed
+RESULT_STORE_FILE = 'result_store.pkl'
+
+# file, within the sample directory, with the time out the manager gave to each model
+RUN_TIMEOUTS_FILE = 'timeouts.pkl'
+
+# file, within the sample directory, where the manager records the resources used by every model
+RUN_LEDGER_FILE = 'run_ledger.csv'
+
+# file, within the sample directory, of the journal of the state of every model run by the manager
+RUN_JOURNAL_FILE = 'run_journal.sqlite'
+
+# file, within a claimed model directory, with the host and process id of the manager running the model
+RUN_CLAIM_FILE = 'model.claim'
+
+# file, within the result cache directory, with the total size of the cached results in bytes
+RESULT_CACHE_SIZE_FILE = 'cache_size'
+
+# seconds between two renewals of the lease of a claimed model, by touching its RUN_CLAIM_FILE
+CLAIM_LEASE_INTERVAL = 60
+
+# seconds after which a claim whose lease was not renewed is expired, and its model can be claimed again by any
+# manager, e.g. when the node running it died (much longer than CLAIM_LEASE_INTERVAL, to tolerate clock skews)
+CLAIM_LEASE_TIMEOUT = 600
+
+# seconds between two checks of the models claimed by other managers, by a distributed manager waiting for them
+CLAIM_POLL_INTERVAL = 5
+
+# directory, within the sample directory, created by the distributed manager that assembles the parsed tables
+PARSE_LOCK_DIR = 'parse.lock'
+
+# file, within the sample directory, with the state of the done directory when the parsed tables were last assembled
+# by a distributed manager, so the managers finishing later do not assemble them again
+PARSE_DONE_FILE = 'parse.done'
+
+# terminal markers of model.out, printed when a Cloudy run has failed (see OutputParser.status_to_int),
+# the manager watchdog stops the run as soon as one of them is printed
+WATCHDOG_ABORT_PATTERNS = ['ABORT', 'something went wrong']
+
+# markers of model.out that Cloudy may still recover from during the run, the manager watchdog only stops
+# the run on them with watchdog_strict
+WATCHDOG_STRICT_PATTERNS = ['negative population', 'did not converge']
+
+# seconds between two checks of the output of the running models by the manager watchdog
+WATCHDOG_INTERVAL = 2
+
+# suffix of the Cloudy output files compressed by the manager, read transparently by the parser
+COMPRESSED_SUFFIX = '.gz'
+
+# gzip compression level of the Cloudy output files (1: fastest, 9: smallest)
+COMPRESSION_LEVEL = 6
+
 INPUT_PARAMETER_NAMES = ["gas_density",
                          "gas_phase_metallicity",
                          "redshift",
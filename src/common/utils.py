@@ -1,11 +1,18 @@
 import glob
+import gzip
 import os.path
 import re
+import shutil
+import collections
 from datetime import datetime
 
 import sys; sys.path.append('..')
 from common.settings import *
 
+# patterns used to read the exit status of a model from the tail of its 'model.out' file
+TAIL_CLEANUP_PATTERN = re.compile(r'[\n]|\[|\]')
+EXEC_TIME_PATTERN = re.compile(r'ExecTime\(s\)\s+(\S+)')
+
 
 def utils_scale_parameters(limits, parameters):
     """
@@ -151,9 +158,160 @@ def utils_get_model_folders(target_dir):
     return folders
 
 
+def utils_get_parameter_file(sample_dir):
+    """
+    Get the .npy file with the input parameters of a sample, see sampling_create_parameters()
+    Args:
+        sample_dir: A string containing the sample directory, e.g "sample_N100/"
+    Returns:
+        Path of the parameter file, None if the sample has none
+    """
+    files = sorted(glob.glob(os.path.join(sample_dir, f'{PARAMETER_FILE_BASE}*.npy')))
+
+    return files[0] if files else None
+
+
+def utils_pid_alive(pid):
+    """
+    Check whether a process of this host is still running, without signalling it
+    Args:
+        pid: Process id
+    Returns:
+        True if the process exists
+    """
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the process exists but belongs to another user
+        return True
+
+    return True
+
+
+def utils_peak_rss_mb(pid):
+    """
+    Reads the peak resident memory (VmHWM) of a running process from /proc. Unlike ru_maxrss, it
+    does not include the memory of the parent process the child was forked from before exec
+    Args:
+        pid: Process id
+    Returns:
+        Peak resident memory in MB, None if unavailable (no /proc, or the process already exited)
+    """
+
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024     # in kB
+    except OSError:
+        pass
+
+    return None
+
+
+def utils_read_file_tail(file_path, n_lines=5, block_size=4096):
+    """
+    Reads the last 'n_lines' lines of a file, like 'tail', by seeking to the end of the file
+    and reading it backwards in blocks, so only a small part of the file is read.
+    If only the compressed version of the file exists (see utils_compress_file), it is
+    decompressed as a stream, keeping only the last lines in memory
+    Args:
+        file_path: A string or path of the file to read
+        n_lines: Number of tail lines to read in
+        block_size: Number of bytes read at a time
+    Returns:
+        A string with the last 'n_lines' lines of the file
+    Raises:
+        FileNotFoundError: if the file does not exist
+    """
+
+    try:
+        f = open(file_path, 'rb')
+    except FileNotFoundError:
+        # gzip streams can not be read backwards
+        with gzip.open(f'{file_path}{COMPRESSED_SUFFIX}', 'rb') as f:
+            tail = collections.deque(f, maxlen=n_lines)
+        return b''.join(tail).decode('utf-8', errors='replace')
+
+    with f:
+        position = f.seek(0, os.SEEK_END)
+        data = b''
+
+        # one more newline than lines requested is needed to be sure the first line is complete
+        while position > 0 and data.count(b'\n') <= n_lines:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+
+    tail = data.splitlines(keepends=True)[-n_lines:]
+
+    return b''.join(tail).decode('utf-8', errors='replace')
+
+
+def utils_open_output(file_path):
+    """
+    Opens a Cloudy output file for reading as text. If only its compressed version exists
+    (see utils_compress_file), it is decompressed on the fly while it is read, not on disk
+    Args:
+        file_path: A string or path of the output file, e.g 'done/42/model.emis'
+    Returns:
+        A text file object
+    Raises:
+        FileNotFoundError: if neither the file nor its compressed version exist
+    """
+
+    try:
+        return open(file_path, 'r')
+    except FileNotFoundError:
+        return gzip.open(f'{file_path}{COMPRESSED_SUFFIX}', 'rt')
+
+
+def utils_output_exists(file_path, files=None):
+    """
+    Checks whether a Cloudy output file exists, as is or compressed
+    Args:
+        file_path: A string or path of the output file, e.g 'done/42/model.emis'
+        files: Optional set of the names of the files of the model directory, to avoid stat calls
+    Returns:
+        True if the file or its compressed version exists
+    """
+
+    if files is None:
+        return os.path.exists(file_path) or os.path.exists(f'{file_path}{COMPRESSED_SUFFIX}')
+
+    name = os.path.basename(file_path)
+    return name in files or f'{name}{COMPRESSED_SUFFIX}' in files
+
+
+def utils_compress_file(file_path, level=COMPRESSION_LEVEL):
+    """
+    Compresses a file with gzip into the same directory (COMPRESSED_SUFFIX) and removes the
+    original. The compressed file is written under a temporary name and renamed into place,
+    so readers never see a partial file
+    Args:
+        file_path: A string or path of the file to compress
+        level: gzip compression level, from 1 (fastest) to 9 (smallest)
+    """
+
+    compressed_path = f'{file_path}{COMPRESSED_SUFFIX}'
+
+    with open(file_path, 'rb') as f_in, open(f'{compressed_path}.tmp', 'wb') as f_raw:
+        # mtime=0 so identical outputs give identical compressed files
+        with gzip.GzipFile(filename=os.path.basename(file_path), mode='wb', compresslevel=level,
+                           fileobj=f_raw, mtime=0) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+
+    os.replace(f'{compressed_path}.tmp', compressed_path)
+    os.remove(file_path)
+
+
 def utils_read_model_output_tail(folder_name, tail_len=5):
     """
-    Reads in the tail strings of 'model.out' inside 'folder_name'
+    Reads in the tail strings of 'model.out' inside 'folder_name', or of its compressed version
     Args:
         folder_name: A string containing a sample directory with cloudy outputs
         tail_len: Number of tail strings to read in
@@ -162,12 +320,10 @@ def utils_read_model_output_tail(folder_name, tail_len=5):
     """
 
     try:
-        with open(F'{folder_name}/model.out', 'r') as f:
-            tail = f.readlines()[-tail_len:]
+        tail = utils_read_file_tail(F'{folder_name}/model.out', n_lines=tail_len)
 
-        tail = ''.join(tail)
         # Remove all newline (\n) and square brackets
-        tail = re.sub(r'[\n]|\[|\]', '', tail)
+        tail = TAIL_CLEANUP_PATTERN.sub('', tail)
     except FileNotFoundError:
         tail = 0
 
@@ -0,0 +1,243 @@
+import os
+import pathlib
+import numpy as np
+import pandas as pd
+
+from common.settings import PARAMETER_FILE_BASE, EXIT_STATUSES, CONT_CUBE_DIR, DATASET_CACHE_DIR
+from common.utils import utils_get_parameter_file
+from src.parser import load_table, table_exists, load_cont_cube
+
+
+class SampleDataset(object):
+    """
+    Random-access dataset over the outputs of OutputParser, to stream (input parameters,
+    emission lines, continuum) triplets of the successful models of a sample from disk, e.g. to
+    train a machine learning model, without loading the sample in memory.
+
+    The first time a sample is opened, the successful models (status column of the status table)
+    are matched across the parsed tables and the emission lines are written as a dense row-major
+    matrix into DATASET_CACHE_DIR, together with the per-feature normalization statistics. Later
+    instances reuse the cache for as long as the parsed tables do not change. The input parameters,
+    the cached emission lines and the continuum cube (OutputParser(cont_format="cube")) are
+    memory-mapped, so only the rows of the requested models are read from disk.
+
+    :param str path: path to the sample directory, e.g "sample_N100/"
+    :param bool cont: if True, serve the continuum from the continuum cube. Defaults to True if
+                      the cube exists, and raises a ValueError if requested but not found.
+    :param str dtype: dtype of the served arrays. Defaults to "float32".
+    """
+
+    def __init__(self, path: str, cont: bool = None, dtype: str = "float32"):
+
+        self.path = pathlib.Path(path)
+        self.dtype = np.dtype(dtype)
+        self.cache_dir = self.path.joinpath(DATASET_CACHE_DIR)
+
+        cube_exists = self.path.joinpath(CONT_CUBE_DIR, "continuum.npy").exists()
+        if cont and not cube_exists:
+            raise ValueError(f"No continuum cube found in {self.path}, parse the sample with "
+                             f"OutputParser(cont_format='cube') to serve the continuum.")
+        self.use_cont = cube_exists if cont is None else cont
+
+        if not self.load_cache():
+            self.build_cache()
+
+        # memory-mapped arrays, rows are read from disk only when indexed
+        self.parameters = np.load(self.parameters_file(), mmap_mode="r")
+        self.emis = np.load(self.cache_dir.joinpath("emis.npy"), mmap_mode="r")
+        if self.use_cont:
+            self.cont, self.photon_energy, self.cont_components, _ = load_cont_cube(self.path)
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __getitem__(self, positions):
+        return self.get_batch(positions)
+
+    def parameters_file(self):
+        """
+        Find the .npy file with the input parameters of the sample, see sampling_create_parameters().
+
+        :return path: path to the input parameters file
+        :rtype: pathlib.PosixPath
+        """
+        parameters_file = utils_get_parameter_file(self.path)
+        if parameters_file is None:
+            raise ValueError(f"No input parameters file ({PARAMETER_FILE_BASE}*.npy) found in {self.path}.")
+        return pathlib.Path(parameters_file)
+
+    def sources_signature(self):
+        """
+        Signature (size and modification time) of the parsed tables the cache is built from, so a
+        new parse of the sample invalidates the cache.
+
+        :return signature: tuple of (size, mtime_ns) tuples
+        :rtype: tuple
+        """
+        sources = [self.parameters_file()]
+        for name in ["status", "emis", os.path.join(CONT_CUBE_DIR, "models")]:
+            table = self.path.joinpath(name)
+            # tables saved with the "npy" output format are directories replaced as a whole
+            sources.append(table.joinpath("columns.npy") if table.is_dir() else table.parent.joinpath(table.name + ".pkl"))
+
+        signature = []
+        for source in sources:
+            try:
+                stat = os.stat(source)
+                signature.append((stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def load_cache(self):
+        """
+        Load the model indexes and normalization statistics of the cache, if it was built
+        from the current parsed tables.
+
+        :return: True if the cache is valid and was loaded
+        :rtype: bool
+        """
+        meta_file = self.cache_dir.joinpath("meta.pkl")
+        if not meta_file.exists():
+            return False
+
+        meta = pd.read_pickle(meta_file)
+        if meta["sources"] != self.sources_signature() or meta["cont"] != self.use_cont:
+            return False
+
+        self.indexes = np.load(self.cache_dir.joinpath("indexes.npy"))
+        self.cont_rows = np.load(self.cache_dir.joinpath("cont_rows.npy"))
+        self.emis_columns = meta["emis_columns"]
+        self.stats = meta["stats"]
+        return True
+
+    def build_cache(self):
+        """
+        Select the successful models found in all the parsed tables, write their emission lines
+        as a dense matrix and compute the mean and standard deviation of every feature.
+        """
+        print('Dataset: Building the cache of the sample')
+
+        status_df = load_table(self.path.joinpath("status"), columns=["index", "status"])
+        indexes = status_df["index"].astype(int).to_numpy()[status_df["status"].to_numpy() == EXIT_STATUSES["Success"]]
+
+        if not table_exists(self.path.joinpath("emis")):
+            raise ValueError(f"No emission lines table found in {self.path}, parse the sample first.")
+        emis_df = load_table(self.path.joinpath("emis"))
+        # the emission line tables may hold more than one row per model, keep the first one
+        emis_df = emis_df.drop_duplicates(subset="index")
+        emis_positions = pd.Series(np.arange(len(emis_df)), index=emis_df["index"].astype(int).to_numpy())
+        indexes = np.intersect1d(indexes, emis_positions.index)
+
+        if self.use_cont:
+            models = load_table(self.path.joinpath(CONT_CUBE_DIR, "models"), columns=["index"])
+            cont_positions = pd.Series(np.arange(len(models)), index=models["index"].astype(int).to_numpy())
+            indexes = np.intersect1d(indexes, cont_positions.index)
+            cont_rows = cont_positions[indexes].to_numpy()
+        else:
+            cont_rows = np.empty(0, dtype=np.int64)
+
+        self.emis_columns = [column for column in emis_df.columns if column not in ["index", "id"]]
+        emis = emis_df[self.emis_columns].to_numpy(dtype=np.float64)[emis_positions[indexes].to_numpy()]
+
+        self.cache_dir.mkdir(exist_ok=True)
+        np.save(self.cache_dir.joinpath("emis.npy"), emis.astype(self.dtype))
+        np.save(self.cache_dir.joinpath("indexes.npy"), indexes)
+        np.save(self.cache_dir.joinpath("cont_rows.npy"), cont_rows)
+        self.indexes, self.cont_rows = indexes, cont_rows
+
+        parameters = np.load(self.parameters_file(), mmap_mode="r")[indexes]
+        self.stats = {"parameters": self.feature_stats(parameters), "emis": self.feature_stats(emis)}
+        if self.use_cont:
+            self.stats["cont"] = self.cont_stats()
+
+        meta = {"sources": self.sources_signature(), "cont": self.use_cont,
+                "emis_columns": self.emis_columns, "stats": self.stats}
+        pd.to_pickle(meta, self.cache_dir.joinpath("meta.pkl"))
+
+    def feature_stats(self, values: np.ndarray):
+        """
+        Mean and standard deviation of every feature (column) of a 2D array. Features with a zero
+        standard deviation get a standard deviation of one, so normalizing them does not divide by zero.
+
+        :param numpy.ndarray values: 2D array (models x features)
+        :return (mean, std): mean and standard deviation of every feature
+        :rtype: tuple
+        """
+        if len(values) == 0:
+            return np.zeros(values.shape[1:]), np.ones(values.shape[1:])
+
+        mean = values.mean(axis=0, dtype=np.float64)
+        std = values.std(axis=0, dtype=np.float64)
+        std[std == 0] = 1.
+        return mean, std
+
+    def cont_stats(self, chunk_size: int = 256):
+        """
+        Mean and standard deviation of every (photon energy, component) feature of the continuum cube,
+        accumulated over chunks of models so the cube is never loaded in memory as a whole.
+
+        :param int chunk_size: number of models read from the cube at a time. Defaults to 256.
+        :return (mean, std): arrays of shape (photon energy x components)
+        :rtype: tuple
+        """
+        cube = load_cont_cube(self.path)[0]
+        total = np.zeros(cube.shape[1:])
+        total_squared = np.zeros(cube.shape[1:])
+
+        for start in range(0, len(self.cont_rows), chunk_size):
+            chunk = cube[np.sort(self.cont_rows[start:start + chunk_size])].astype(np.float64)
+            total += chunk.sum(axis=0)
+            total_squared += np.square(chunk).sum(axis=0)
+
+        n = max(len(self.cont_rows), 1)
+        mean = total / n
+        std = np.sqrt(np.maximum(total_squared / n - np.square(mean), 0.))
+        std[std == 0] = 1.
+        return mean, std
+
+    def get_batch(self, positions, normalize: bool = False):
+        """
+        Read the input parameters, emission lines and continuum of a set of models of the dataset.
+
+        :param positions: positions of the models in the dataset (0 to len(dataset) - 1), an int, slice or array
+        :param bool normalize: if True, subtract the mean and divide by the standard deviation of every feature
+        :return batch: dictionary with the "index" of the models in the sample, and their "parameters",
+                       "emis" and, if served, "cont" arrays
+        :rtype: dict
+        """
+        positions = np.arange(len(self))[positions]
+        indexes = self.indexes[positions]
+
+        batch = {"index": indexes,
+                 "parameters": np.asarray(self.parameters[indexes], dtype=self.dtype),
+                 "emis": np.asarray(self.emis[positions], dtype=self.dtype)}
+        if self.use_cont:
+            batch["cont"] = np.asarray(self.cont[self.cont_rows[positions]], dtype=self.dtype)
+
+        if normalize:
+            for key, (mean, std) in self.stats.items():
+                batch[key] = ((batch[key] - mean) / std).astype(self.dtype)
+
+        return batch
+
+    def iter_batches(self, batch_size: int = 64, shuffle: bool = True, seed: int = None,
+                     drop_last: bool = False, normalize: bool = False):
+        """
+        Iterate once over the dataset in mini-batches. Within a batch the models are read in
+        on-disk order, so each batch is a sequential pass over the memory-mapped files.
+
+        :param int batch_size: number of models per batch. Defaults to 64.
+        :param bool shuffle: if True (default), draw the models of each batch at random
+        :param int seed: seed of the shuffle. Defaults to None
+        :param bool drop_last: if True, skip the last batch if it has less than batch_size models
+        :param bool normalize: if True, normalize the features, see get_batch()
+        :return: generator of batches, see get_batch()
+        """
+        order = np.random.default_rng(seed).permutation(len(self)) if shuffle else np.arange(len(self))
+
+        for start in range(0, len(order), batch_size):
+            positions = order[start:start + batch_size]
+            if drop_last and len(positions) < batch_size:
+                break
+            yield self.get_batch(np.sort(positions), normalize=normalize)
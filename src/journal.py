@@ -0,0 +1,143 @@
+import time
+import socket
+import sqlite3
+import contextlib
+
+
+class RunJournal(object):
+    """
+    Crash-safe journal of the state of the models of a sample, kept in a SQLite database in WAL mode.
+    Every model goes through the states "queued", "running" and then "done" or "failed", and the time of
+    each transition is recorded, together with the host and process id of the Cloudy run. Each state
+    transition is committed before the manager goes on, so after a crash the journal tells which models
+    are still to run, without scanning the model directories, and which ones were interrupted.
+
+    Every call opens its own short-lived connection, so the journal can be shared by the threads and
+    processes of the manager, and by several managers running on the same sample.
+
+    :param str path: path to the journal database file
+    """
+
+    STATES = ["queued", "running", "done", "failed"]
+
+    def __init__(self, path: str):
+        self.path = str(path)
+
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""CREATE TABLE IF NOT EXISTS models (
+                                      model INTEGER PRIMARY KEY,
+                                      state TEXT NOT NULL,
+                                      attempts INTEGER NOT NULL DEFAULT 0,
+                                      queued_at REAL,
+                                      started_at REAL,
+                                      finished_at REAL,
+                                      host TEXT,
+                                      pid INTEGER,
+                                      exit_code INTEGER)""")
+            connection.execute("CREATE INDEX IF NOT EXISTS models_state ON models (state, model)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        Open a connection to the journal, commit the transaction if no exception is raised and close it.
+        """
+        connection = sqlite3.connect(self.path, timeout=60)
+        try:
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM models").fetchone()[0]
+
+    def add(self, models: list):
+        """
+        Queue models not in the journal yet. Models already in the journal keep their state.
+
+        :param list models: indexes of the models
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany("INSERT OR IGNORE INTO models (model, state, queued_at) VALUES (?, 'queued', ?)",
+                                   [(int(model), now) for model in models])
+
+    def requeue(self, models: list):
+        """
+        Queue models again, whatever their state.
+
+        :param list models: indexes of the models
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany("""INSERT INTO models (model, state, queued_at) VALUES (?, 'queued', ?)
+                                      ON CONFLICT (model) DO UPDATE SET state='queued', queued_at=excluded.queued_at,
+                                      started_at=NULL, finished_at=NULL, host=NULL, pid=NULL, exit_code=NULL""",
+                                   [(int(model), now) for model in models])
+
+    def start(self, model: int, pid: int = None):
+        """
+        Record that a model is running.
+
+        :param int model: index of the model
+        :param int pid: process id of the Cloudy run. Defaults to None
+        """
+        with self._connect() as connection:
+            connection.execute("""UPDATE models SET state='running', attempts=attempts+1, started_at=?,
+                                  finished_at=NULL, host=?, pid=?, exit_code=NULL WHERE model=?""",
+                               (time.time(), socket.gethostname(), pid, int(model)))
+
+    def finish(self, model: int, success: bool, exit_code: int = None):
+        """
+        Record that the run of a model is over, and its output moved to the "done" directory.
+
+        :param int model: index of the model
+        :param bool success: True if Cloudy exited normally ("done"), False otherwise ("failed")
+        :param int exit_code: exit code of the Cloudy run. Defaults to None
+        """
+        with self._connect() as connection:
+            connection.execute("UPDATE models SET state=?, finished_at=?, exit_code=? WHERE model=?",
+                               ("done" if success else "failed", time.time(), exit_code, int(model)))
+
+    def models(self, state: str, limit: int = None):
+        """
+        Indexes of the models in a given state, in increasing order.
+
+        :param str state: one of RunJournal.STATES
+        :param int limit: maximum number of models to return. Defaults to None (all)
+        :return models: list of model indexes
+        :rtype: list
+        """
+        if state not in self.STATES:
+            raise ValueError(f"state must be one of {self.STATES}, got {state}.")
+
+        with self._connect() as connection:
+            rows = connection.execute("SELECT model FROM models WHERE state=? ORDER BY model LIMIT ?",
+                                      (state, -1 if limit is None else int(limit))).fetchall()
+        return [row[0] for row in rows]
+
+    def running(self):
+        """
+        Models in the "running" state, with the host and process id of their Cloudy run.
+
+        :return running: list of (model, host, pid) tuples, in increasing model order
+        :rtype: list
+        """
+        with self._connect() as connection:
+            rows = connection.execute("SELECT model, host, pid FROM models WHERE state='running' ORDER BY model")
+            return [tuple(row) for row in rows.fetchall()]
+
+    def counts(self):
+        """
+        Number of models in each state.
+
+        :return counts: dictionary of the number of models indexed by state
+        :rtype: dict
+        """
+        with self._connect() as connection:
+            rows = connection.execute("SELECT state, COUNT(*) FROM models GROUP BY state").fetchall()
+        return {state: dict(rows).get(state, 0) for state in self.STATES}
+
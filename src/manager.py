@@ -1,14 +1,42 @@
+import io
 import os
+import socket
+import csv
+import time
+import zlib
+import fcntl
+import asyncio
+import concurrent.futures
 import pathlib
 import subprocess
+import shlex
+import shutil
+import tempfile
 import multiprocessing
+import multiprocessing.pool
 import numpy as np
+import pandas as pd
 import traceback
+import contextlib
 
-from common.settings import SAMPLE_SUBDIR_TODO, SAMPLE_SUBDIR_DONE
+from common.settings import SAMPLE_SUBDIR_TODO, SAMPLE_SUBDIR_DONE, SAMPLE_SUBDIR_RUNNING, RESULT_STORE_FILE, \
+    WATCHDOG_ABORT_PATTERNS, WATCHDOG_STRICT_PATTERNS, WATCHDOG_INTERVAL, RUN_TIMEOUTS_FILE, RUN_LEDGER_FILE, \
+    RUN_JOURNAL_FILE, RUN_CLAIM_FILE, CLAIM_LEASE_INTERVAL, CLAIM_LEASE_TIMEOUT, CLAIM_POLL_INTERVAL, PARSE_LOCK_DIR, \
+    PARSE_DONE_FILE, COMPRESSED_SUFFIX
 from common.utils import *
 from cloudy_input import CloudyInput
-from user_settings import CLOUDY_PATH, CLOUDY_RUN_TIMEOUT
+from src.parser import OutputParser
+from runtime_model import RuntimePredictor
+from journal import RunJournal
+from result_cache import ResultCache
+from user_settings import CLOUDY_PATH, CLOUDY_RUN_TIMEOUT, CLOUDY_MIN_RUN_TIMEOUT, RESULT_CACHE_DIR, RESULT_CACHE_MAX_GB
+
+
+# columns of the run ledger: start (unix time) and, in seconds, scheduling wait, time to spawn Cloudy,
+# wall, user and system CPU time of Cloudy and time to compress, copy back from scratch, move (and parse) the
+# model, peak memory of Cloudy, and whether the outputs were taken from the result cache
+LEDGER_COLUMNS = ['index', 'start', 'wait', 'spawn', 'wall', 'user', 'sys', 'max_rss_mb', 'exit_code',
+                  'timed_out', 'watchdog', 'compress', 'copy_back', 'move', 'parse', 'cached']
 
 
 class QueueManager:
@@ -22,8 +50,66 @@ class QueueManager:
     :param int N_batch: int Number of models to run. If not specified or larger than the total number of models, all
                         models will be run.
     :param bool verbose: bool flag used to activate/deactivate the verbosity. Defaults to True (verbose)
+    :param bool parse_on_completion: bool flag, if True each worker parses the outputs of a model right after
+                                     Cloudy exits and appends them to the result store of the sample, and the
+                                     parsed tables are assembled from the store at the end of the run.
+                                     Defaults to False (run the parser separately, see scripts/run_parser.py)
+    :param dict parser_kwargs: keyword arguments of the OutputParser used with parse_on_completion,
+                               e.g. {"output_format": "npy"}. Defaults to None (OutputParser defaults)
+    :param str executor: str "process" to run the models from a pool of persistent worker processes, "thread"
+                         to run them from threads of the manager process, which avoids forking the manager, or
+                         "asyncio" to supervise all Cloudy processes from an event loop, which reports models as
+                         they finish and accepts new models during the run (see enqueue()). Defaults to "process"
+    :param list runtime_history: list of paths to previously run and parsed sample directories. If given, a run time
+                                 predictor is fit on their run times (see RuntimePredictor) and the models are run
+                                 longest predicted first. Defaults to None (models run in directory order)
+    :param bool watchdog: bool flag, if True the model.out file of every running model is followed while Cloudy runs,
+                          and the run is stopped as soon as it prints one of the WATCHDOG_ABORT_PATTERNS failure
+                          markers (see CloudyWatchdog). Defaults to False
+    :param bool watchdog_strict: bool flag, with watchdog, also stop the runs as soon as they print one of the
+                                 WATCHDOG_STRICT_PATTERNS warnings, which Cloudy may still recover from.
+                                 Defaults to False
+    :param float stall_timeout: float, with watchdog, also stop the runs whose model.out did not grow for this
+                                many seconds. Defaults to None (no stall detection)
+    :param bool adaptive_timeout: bool flag, if True every model gets its own time out, predicted from the run times
+                                  of the samples in runtime_history, instead of CLOUDY_RUN_TIMEOUT (see
+                                  _set_timeouts() and requeue_dnf()). Defaults to False
+    :param float timeout_quantile: float fraction of the past models like a given model that finished within its
+                                   adaptive time out. Defaults to 0.99
+    :param bool journal: bool flag, if True the state of every model is recorded in a crash-safe RunJournal in the
+                         sample directory. The models to run are then read from the journal instead of scanning the
+                         SAMPLE_SUBDIR_TODO/ directory, and the models interrupted by a crash are cleaned up and run
+                         again. Defaults to False
+    :param bool distributed: bool flag, if True several managers, e.g. one per node of a cluster, can run the same
+                             sample directory on a shared filesystem. Each model is claimed by atomically moving it
+                             to the SAMPLE_SUBDIR_RUNNING/ directory right before it runs, so every model runs once,
+                             and each manager keeps claiming models until the SAMPLE_SUBDIR_TODO/ directory is
+                             empty. A claim is a lease renewed while the model runs, the models of managers that
+                             died are claimed again by the others once their lease expired (see
+                             _release_stale_claims()). Cannot be used with journal. Defaults to False
+    :param int shard_index: int index, from 0 to shard_count - 1, of the shard of the sample run by this manager, e.g.
+                            the task id of a job array. Every model belongs to exactly one shard, see
+                            _shard_models(). Defaults to None (run all models)
+    :param int shard_count: int number of shards the sample is split in, e.g. the size of the job array.
+                            Defaults to None
+    :param bool result_cache: bool flag, if True the outputs of a model are taken from the ResultCache in
+                              RESULT_CACHE_DIR if an identical model.in already ran, instead of running Cloudy,
+                              and the outputs of the successful models are added to the cache. Defaults to False
+    :param str scratch_dir: str path to a node-local scratch directory or tmpfs, e.g. "$TMPDIR" or "/dev/shm". If
+                            given, Cloudy runs in a temporary directory there, and the outputs are copied back to the
+                            model directory in one go once the run is over, so the shared filesystem of the sample
+                            only sees a few large writes per model. Defaults to None (run in the model directory)
+    :param bool compress: bool flag, if True the output files of every model are compressed with gzip right after
+                          the run (on scratch_dir, if given), see utils_compress_file(). The parser reads them
+                          without decompressing them on disk. Defaults to False
     """
-    def __init__(self, sample_dir: str,  N_CPUs: int = None, N_batch: int = None, verbose: bool = True):
+    def __init__(self, sample_dir: str,  N_CPUs: int = None, N_batch: int = None, verbose: bool = True,
+                 parse_on_completion: bool = False, parser_kwargs: dict = None, executor: str = "process",
+                 runtime_history: list = None, watchdog: bool = False, watchdog_strict: bool = False,
+                 stall_timeout: float = None,
+                 adaptive_timeout: bool = False, timeout_quantile: float = 0.99, journal: bool = False,
+                 distributed: bool = False, shard_index: int = None, shard_count: int = None,
+                 result_cache: bool = False, scratch_dir: str = None, compress: bool = False):
 
         if not N_CPUs:
             # if not specified, use all available CPU cores
@@ -39,23 +125,96 @@ class QueueManager:
         else:
             self.N_batch = None
 
+        self.parse_on_completion = parse_on_completion
+        self.parser_kwargs = parser_kwargs or {}
+
+        if executor not in ["process", "thread", "asyncio"]:
+            raise ValueError(f'executor must be "process", "thread" or "asyncio", got "{executor}".')
+        self.executor = executor
+
+        self.runtime_history = runtime_history
+
+        self.watchdog = watchdog
+        self.watchdog_strict = watchdog_strict
+        self.stall_timeout = stall_timeout
+
+        if adaptive_timeout and not runtime_history:
+            raise ValueError('adaptive_timeout needs the past run times of runtime_history.')
+        self.adaptive_timeout = adaptive_timeout
+        self.timeout_quantile = timeout_quantile
+        self.timeouts = {}
+        self.predicted_times = {}
+
+        if distributed and journal:
+            # SQLite locking is not reliable on the network filesystems shared by several nodes
+            raise ValueError('distributed managers claim the models from the directories, without the journal.')
+        self.journal = RunJournal(os.path.join(sample_dir, RUN_JOURNAL_FILE)) if journal else None
+
+        # with distributed, the models run in SAMPLE_SUBDIR_RUNNING/ once claimed, otherwise in SAMPLE_SUBDIR_TODO/
+        self.distributed = distributed
+        self._run_subdir = SAMPLE_SUBDIR_RUNNING if distributed else SAMPLE_SUBDIR_TODO
+
+        if (shard_index is None) != (shard_count is None):
+            raise ValueError('shard_index and shard_count must be given together.')
+        if shard_count is not None and not 0 <= shard_index < shard_count:
+            raise ValueError(f'shard_index must be between 0 and {shard_count - 1}, got {shard_index}.')
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+
+        # models to run, and event loop and queue of the running asyncio engine
+        self.models_to_run = []
+        self.N_models_to_run = 0
+        self.N_models_done = 0
+        self._loop = None
+        self._wait_executor = None
+        self._queued_at = {}
+        self.run_start = time.time()
+
+        # Cloudy executable and its options, run without a shell
+        self.cloudy_cmd = shlex.split(os.path.expanduser(CLOUDY_PATH))
+
+        self.result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_GB, self.cloudy_cmd) if result_cache else None
+
+        self.scratch_dir = os.path.expanduser(os.path.expandvars(scratch_dir)) if scratch_dir else None
+        if self.scratch_dir and not os.path.isdir(self.scratch_dir):
+            raise ValueError(f'Could not find the scratch directory {self.scratch_dir}.')
+
+        self.compress = compress
+
     def _get_models(self):
         """
         Looks inside the SAMPLE_SUBDIR_TODO/ directory, iterates over all items in the directory
         and appends the model directory to a list of models to run if
             1. they are a subdirectory and not a file and
             2. they contain a model.in file
+        With the journal, the directory is only scanned to fill a new journal. Afterwards the models
+        to run are the ones queued in the journal, after recovering the ones interrupted by a crash.
+        With distributed, the models left claimed by dead managers are queued again first.
         """
         directory = pathlib.Path(self.sample_dir, SAMPLE_SUBDIR_TODO)
         assert directory.exists(), f'Could not find {SAMPLE_SUBDIR_TODO}/ directory in {self.sample_dir}.'
         self.models_to_run = []
 
-        for item in directory.iterdir():
-            if item.is_dir():
-                if CLOUDY_IN_FILE in os.listdir(item):
-                    # save only the model folder name, not the path
-                    p = pathlib.PurePath(item).name
-                    self.models_to_run.append(p)
+        if self.distributed:
+            pathlib.Path(self.sample_dir, SAMPLE_SUBDIR_RUNNING).mkdir(exist_ok=True)
+            self._release_stale_claims()
+
+        if self.journal is not None and len(self.journal):
+            self._recover_interrupted()
+            self.models_to_run = [str(model) for model in self.journal.models('queued')]
+        else:
+            for item in directory.iterdir():
+                if item.is_dir():
+                    if CLOUDY_IN_FILE in os.listdir(item):
+                        # save only the model folder name, not the path
+                        p = pathlib.PurePath(item).name
+                        self.models_to_run.append(p)
+
+            if self.journal is not None:
+                self.journal.add(self.models_to_run)
+
+        if self.shard_count is not None:
+            self._shard_models()
 
         self.N_models_to_run = len(self.models_to_run)
 
@@ -66,60 +225,739 @@ class QueueManager:
         
         self.N_models_to_run = len(self.models_to_run)
 
+        if self.runtime_history:
+            self._sort_models()
+
+        self._set_timeouts()
+
+    def _recover_interrupted(self):
+        """
+        Recovers the models left "running" in the journal by a manager that was killed. Only the runs of
+        this host whose Cloudy process is gone are recovered: the journal may be shared with managers still
+        running models, here or on other hosts. A model already moved to the SAMPLE_SUBDIR_DONE/ directory
+        is recorded as finished. Otherwise the partial outputs of the interrupted run are removed and the
+        model is queued again.
+        """
+        hostname = socket.gethostname()
+        interrupted = [model for model, host, pid in self.journal.running()
+                       if host == hostname and not (pid and utils_pid_alive(pid))]
+        if not interrupted:
+            return
+
+        if self.verbose: print(f'Recovering {len(interrupted)} models interrupted during a previous run')
+
+        parser = OutputParser()
+        for model in interrupted:
+            done_dir = pathlib.Path(self.sample_dir, SAMPLE_SUBDIR_DONE, str(model))
+            todo_dir = pathlib.Path(self.sample_dir, SAMPLE_SUBDIR_TODO, str(model))
+
+            if done_dir.exists() and not todo_dir.exists():
+                status_code = parser.read_status(done_dir.joinpath('model.out'))[0]
+                self.journal.finish(model, status_code == EXIT_STATUSES['Success'])
+            else:
+                self._clean_model_dir(todo_dir)
+                self.journal.requeue([model])
+
+    def _claim_model(self, model_dir: str) -> bool:
+        """
+        Claims a model for this manager by moving it from the SAMPLE_SUBDIR_TODO/ to the SAMPLE_SUBDIR_RUNNING/
+        directory. The rename is atomic, also on a shared filesystem, so when several managers try to
+        claim the same model only one of them succeeds. The host and process id of the claiming manager
+        are written in the RUN_CLAIM_FILE of the model, whose modification time is the lease of the claim,
+        renewed while the model runs, see self._release_stale_claims().
+
+        :param model_dir: string name of the model directory containing the model.in file
+        :return: True if the model was claimed, False if another manager claimed it first
+        """
+        running_dir = pathlib.Path(self.sample_dir, SAMPLE_SUBDIR_RUNNING, model_dir)
+        try:
+            os.rename(pathlib.Path(self.sample_dir, SAMPLE_SUBDIR_TODO, model_dir), running_dir)
+        except FileNotFoundError:
+            return False
+
+        running_dir.joinpath(RUN_CLAIM_FILE).write_text(f'{socket.gethostname()} {os.getpid()}\n')
+        return True
+
+    def _release_stale_claims(self):
+        """
+        Queues again the models of the SAMPLE_SUBDIR_RUNNING/ directory claimed by managers that are no longer
+        running, e.g. killed at the end of their allocation, after removing their partial outputs. The claims
+        of this host are released as soon as their manager is gone. The managers of other hosts cannot be
+        checked from here, their claims are released once their lease expired, i.e. their RUN_CLAIM_FILE
+        was not touched for CLAIM_LEASE_TIMEOUT seconds.
+        """
+        hostname = socket.gethostname()
+        released = []
+
+        for item in pathlib.Path(self.sample_dir, SAMPLE_SUBDIR_RUNNING).iterdir():
+            claim_file = item.joinpath(RUN_CLAIM_FILE)
+            try:
+                host, pid = claim_file.read_text().split()
+                lease = claim_file.stat().st_mtime
+            except (FileNotFoundError, ValueError):
+                # claim file not written yet, or removed before the model moved to SAMPLE_SUBDIR_DONE/: the
+                # lease starts when the directory was renamed, which changes its status time
+                host, pid = None, None
+                try:
+                    lease = item.stat().st_ctime
+                except FileNotFoundError:
+                    continue
+
+            expired = time.time() - lease > CLAIM_LEASE_TIMEOUT
+            if not expired and (host != hostname or utils_pid_alive(int(pid))):
+                continue
+
+            try:
+                self._clean_model_dir(item)
+                os.rename(item, pathlib.Path(self.sample_dir, SAMPLE_SUBDIR_TODO, item.name))
+            except FileNotFoundError:
+                # released meanwhile by another manager
+                continue
+            released.append(item.name)
+
+        if released and self.verbose:
+            print(f'Released {len(released)} models claimed by managers that are no longer running')
+
+    def _wait_for_claims(self) -> bool:
+        """
+        Waits for the models claimed by the other managers, checking every CLAIM_POLL_INTERVAL seconds whether
+        they are over, and releasing the claims of managers that are no longer running (see
+        self._release_stale_claims()).
+
+        :return: True if models are left to run in the SAMPLE_SUBDIR_TODO/ directory, e.g. released or added
+                 meanwhile, False once no model is left running
+        :rtype: bool
+        """
+        todo_dir = pathlib.Path(self.sample_dir, SAMPLE_SUBDIR_TODO)
+        running_dir = pathlib.Path(self.sample_dir, SAMPLE_SUBDIR_RUNNING)
+
+        while any(running_dir.iterdir()):
+            time.sleep(CLAIM_POLL_INTERVAL)
+            self._release_stale_claims()
+            if any(todo_dir.iterdir()):
+                return True
+
+        return False
+
+    def _clean_model_dir(self, model_path: pathlib.PosixPath):
+        """
+        Removes the outputs of a previous run from a model directory, keeping only its model.in file.
+
+        :param model_path: pathlib.PosixPath of the model directory
+        """
+        if model_path.exists():
+            for item in model_path.iterdir():
+                if item.name != CLOUDY_IN_FILE:
+                    os.remove(item)
+
+    def _fit_runtime_predictor(self):
+        """
+        Fits a RuntimePredictor on the samples in runtime_history, once per QueueManager.
+
+        :return: the fitted predictor, None if there are not enough past run times to fit it
+        """
+        if not hasattr(self, 'runtime_predictor'):
+            try:
+                self.runtime_predictor = RuntimePredictor().fit_history(self.runtime_history or [])
+            except ValueError as e:
+                if self.verbose: print(f'Not using the past run times: {e}')
+                self.runtime_predictor = None
+        return self.runtime_predictor
+
+    def _shard_models(self):
+        """
+        Keeps only the models to run of the shard shard_index. The shards are computed from the input parameters
+        file of the sample, not from the models left in the SAMPLE_SUBDIR_TODO/ directory, so every job of an
+        array, started at any time, gets the same disjoint shards, which cover the sample exactly once.
+        Without a parameter file or a run time predictor, a model belongs to the shard given by a stable hash
+        of its index. With a run time predictor (runtime_history), the models are dealt longest predicted
+        first to the shard with the lowest total predicted run time, so the shards finish at about the same
+        time; all the jobs must then be given the same runtime_history.
+        """
+        parameter_file = utils_get_parameter_file(self.sample_dir)
+
+        if parameter_file and self.runtime_history and self._fit_runtime_predictor():
+            predicted = self.runtime_predictor.predict(np.load(parameter_file))
+
+            shards = np.empty(len(predicted), dtype=int)
+            loads = np.zeros(self.shard_count)
+            for index in np.argsort(-predicted, kind="stable"):
+                shards[index] = np.argmin(loads)
+                loads[shards[index]] += predicted[index]
+
+            if self.verbose:
+                print(f'Shard {self.shard_index}/{self.shard_count}: {loads[self.shard_index]:.0f}s '
+                      f'of predicted run time out of {loads.sum():.0f}s')
+
+            shard_of = {model_dir: shards[int(model_dir)] for model_dir in self.models_to_run}
+        else:
+            shard_of = {model_dir: zlib.crc32(model_dir.encode()) % self.shard_count for model_dir in self.models_to_run}
+
+        self.models_to_run = [model_dir for model_dir in self.models_to_run if shard_of[model_dir] == self.shard_index]
+
+    def _sort_models(self):
+        """
+        Sorts the models to run by decreasing predicted run time, so the longest models do not start
+        last and leave a single core busy at the end of the run. The run times are predicted from the
+        input parameters of the models by a RuntimePredictor fit on the samples in runtime_history.
+        If there are not enough past run times to fit the predictor, the order is left unchanged.
+        """
+        parameter_file = utils_get_parameter_file(self.sample_dir)
+        if parameter_file is None or not self.models_to_run or self._fit_runtime_predictor() is None:
+            return
+
+        parameters = np.load(parameter_file)[[int(model_dir) for model_dir in self.models_to_run]]
+        predicted = self.runtime_predictor.predict(parameters)
+
+        order = np.argsort(-predicted, kind="stable")
+        self.models_to_run = [self.models_to_run[i] for i in order]
+        self.predicted_times = dict(zip(self.models_to_run, predicted[order]))
+
+        if self.verbose:
+            print(f'Sorted the models by predicted run time, from {predicted.max():.0f}s to {predicted.min():.0f}s')
+
+    def _set_timeouts(self):
+        """
+        Sets the time out of every model to run. Models re-queued by self.requeue_dnf() keep the
+        longer time out recorded for them. With adaptive_timeout, the other models get the run time
+        within which a fraction timeout_quantile of the past models like them finished (see
+        RuntimePredictor.predict_quantile()), bounded by CLOUDY_MIN_RUN_TIMEOUT and CLOUDY_RUN_TIMEOUT.
+        The time outs are recorded in RUN_TIMEOUTS_FILE, the parser adds them to the status table.
+        Without adaptive_timeout and re-queued models, RUN_TIMEOUTS_FILE is neither read nor written.
+        """
+        self.timeouts = {}
+
+        parameter_file = utils_get_parameter_file(self.sample_dir)
+        if self.adaptive_timeout and parameter_file and self.models_to_run and self._fit_runtime_predictor():
+            parameters = np.load(parameter_file)[[int(model_dir) for model_dir in self.models_to_run]]
+            predicted = self.runtime_predictor.predict_quantile(parameters, self.timeout_quantile)
+            timeouts = np.clip(predicted, CLOUDY_MIN_RUN_TIMEOUT, CLOUDY_RUN_TIMEOUT)
+            self.timeouts = dict(zip(self.models_to_run, timeouts.tolist()))
+
+        if not self.timeouts and not pathlib.Path(self.sample_dir, RUN_TIMEOUTS_FILE).exists():
+            return
+
+        with self._lock_timeouts():
+            recorded = self._load_timeouts()
+            for model_dir in self.models_to_run:
+                if int(model_dir) in recorded:
+                    self.timeouts[model_dir] = recorded[int(model_dir)]
+
+            if self.timeouts:
+                recorded.update({int(model_dir): timeout for model_dir, timeout in self.timeouts.items()})
+                self._save_timeouts(recorded)
+
+        if self.verbose and self.timeouts:
+            print(f'Per-model time outs from {min(self.timeouts.values()):.0f}s to {max(self.timeouts.values()):.0f}s')
+
+    def _get_timeout(self, model_dir: str) -> float:
+        """ Private method that returns the time out of a model, in seconds.
+
+        :param model_dir: string name of the model directory containing the model.in file
+        """
+        return self.timeouts.get(model_dir, CLOUDY_RUN_TIMEOUT)
+
+    @contextlib.contextmanager
+    def _lock_timeouts(self):
+        """ Private context manager that locks RUN_TIMEOUTS_FILE while it is read and updated, since
+        several managers, e.g. distributed ones, can update it at the same time. The file itself is
+        locked, created empty if needed. Since self._save_timeouts() replaces it, the lock is taken
+        again if the file was replaced while waiting for it.
+        """
+        timeouts_path = pathlib.Path(self.sample_dir, RUN_TIMEOUTS_FILE)
+        while True:
+            with open(timeouts_path, 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(f.fileno()).st_ino != os.stat(timeouts_path).st_ino:
+                        continue
+                    yield
+                    return
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load_timeouts(self) -> dict:
+        """ Private method that loads the time outs recorded in RUN_TIMEOUTS_FILE, indexed by model index. """
+        timeouts_path = pathlib.Path(self.sample_dir, RUN_TIMEOUTS_FILE)
+        # created empty by self._lock_timeouts()
+        return pd.read_pickle(timeouts_path) if timeouts_path.exists() and timeouts_path.stat().st_size else {}
+
+    def _save_timeouts(self, timeouts: dict) -> None:
+        """ Private method that saves the time outs, indexed by model index, in RUN_TIMEOUTS_FILE. """
+        timeouts_path = pathlib.Path(self.sample_dir, RUN_TIMEOUTS_FILE)
+        pd.to_pickle(timeouts, f'{timeouts_path}.tmp')
+        os.replace(f'{timeouts_path}.tmp', timeouts_path)
+
+    def requeue_dnf(self, factor: float = 2.) -> list:
+        """
+        Moves the models that did not finish (DNF, or DNR if model.out was not even written) within their
+        recorded time out back to the SAMPLE_SUBDIR_TODO/ directory, with a time out factor times longer
+        (at most CLOUDY_RUN_TIMEOUT), so the next self.manager_run() runs them again. The outputs of their
+        previous run are removed.
+        Models that already had CLOUDY_RUN_TIMEOUT are left in SAMPLE_SUBDIR_DONE/.
+
+        :param float factor: float factor by which the time out of the re-queued models is multiplied. Defaults to 2
+        :return: list of the re-queued model directories
+        :rtype: list
+        """
+        parser = OutputParser()
+        requeued = []
+        if not pathlib.Path(self.sample_dir, RUN_TIMEOUTS_FILE).exists():
+            if self.verbose: print('No time outs recorded, no model to re-queue')
+            return requeued
+
+        with self._lock_timeouts():
+            timeouts = self._load_timeouts()
+            for index, timeout in sorted(timeouts.items()):
+                done_dir = pathlib.Path(self.sample_dir, SAMPLE_SUBDIR_DONE, str(index))
+                if timeout >= CLOUDY_RUN_TIMEOUT or not done_dir.exists():
+                    continue
+                status_code = parser.read_status(done_dir.joinpath('model.out'))[0]
+                if status_code not in [EXIT_STATUSES['DNF'], EXIT_STATUSES['DNR']]:
+                    continue
+
+                self._clean_model_dir(done_dir)
+                os.rename(done_dir, pathlib.Path(self.sample_dir, SAMPLE_SUBDIR_TODO, str(index)))
+
+                timeouts[index] = min(timeout * factor, CLOUDY_RUN_TIMEOUT)
+                requeued.append(str(index))
+
+            self._save_timeouts(timeouts)
+
+        if self.journal is not None:
+            self.journal.requeue(requeued)
+        if self.verbose: print(f'Re-queued {len(requeued)} models that did not finish in time')
+
+        return requeued
+
     def _run_model(self, model_dir: str) -> None:
         """ Private method that will launch a subprocess to run the Cloudy model.
 
-        Since Cloudy doesn't seem to accept paths to the model.in files as an input, we cd to the
-        directory that contains the model.in file is located, i.e. sample_N123/todo/42/ and run
-        Cloudy from there.
+        Since Cloudy doesn't seem to accept paths to the model.in files as an input, Cloudy is run
+        with its working directory set to the directory that contains the model.in file, i.e.
+        sample_N123/todo/42/. Cloudy is executed directly (no shell) and the working directory of the
+        manager is never changed, so several models can be launched from threads of the same process.
+        With distributed, the model is first claimed (see self._claim_model()) and runs in
+        sample_N123/running/42/, it is skipped if another manager claimed it first. With scratch_dir,
+        Cloudy runs in a temporary directory of the scratch directory instead (see self._stage_scratch()).
 
         :param model_dir: string name of the model directory containing the model.in file
         """
 
         try:
-            original_dir = os.getcwd()
             sample_dir = os.path.abspath(self.sample_dir)
 
+            if self.distributed and not self._claim_model(model_dir):
+                if self.verbose: print(f' Model {model_dir} was claimed by another manager')
+                return
+
             if self.verbose: print(f' Running model {model_dir} ...')
 
-            current_run_dir = os.path.join(sample_dir, SAMPLE_SUBDIR_TODO, model_dir)
+            current_run_dir = os.path.join(sample_dir, self._run_subdir, model_dir)
+
+            entry = {'index': int(model_dir), 'start': time.time(), 'wait': time.time() - self.run_start}
+
+            if not self._fetch_cached(model_dir, current_run_dir, entry):
+                cloudy_dir = self._stage_scratch(model_dir, current_run_dir)
+                completed = False
+                try:
+                    spawn_start = time.perf_counter()
+                    process = subprocess.Popen(self.cloudy_cmd + ['model.in'], cwd=cloudy_dir)
+                    entry['spawn'] = time.perf_counter() - spawn_start
+                    if self.journal is not None:
+                        self.journal.start(int(model_dir), process.pid)
+
+                    for delay in self._supervise(process, model_dir, cloudy_dir, entry):
+                        time.sleep(delay)
+                    completed = True
+                finally:
+                    self._unstage_scratch(cloudy_dir, current_run_dir, entry, copy_back=completed)
+
+            self._finish_model(model_dir, entry)
+            self._record(entry)
+
+        # catch all other exceptions
+        # TODO: specify more / different cases here once they arise (see traceback output)
+        except Exception:
+            if self.verbose:
+                print(f' Error: while processing model {model_dir}')
+                traceback.print_exc()
+            if self.journal is not None:
+                self.journal.finish(int(model_dir), False)
+
+    def _get_watchdog(self, run_dir: str):
+        """ Private method that returns the watchdog of a model about to run, None if the watchdog is disabled.
 
-            os.chdir(current_run_dir)
-            cmd_string = f'{CLOUDY_PATH} model.in'
+        :param run_dir: string path of the directory the model runs in
+        """
+        if not self.watchdog:
+            return None
+        patterns = WATCHDOG_ABORT_PATTERNS + (WATCHDOG_STRICT_PATTERNS if self.watchdog_strict else [])
+        return CloudyWatchdog(os.path.join(run_dir, 'model.out'), stall_timeout=self.stall_timeout,
+                              patterns=patterns)
+
+    def _fetch_cached(self, model_dir: str, run_dir: str, entry: dict) -> bool:
+        """ Private method that, with result_cache, links the outputs of an identical model that already ran
+        into the directory of a model about to run, see ResultCache.
+
+        :param model_dir: string name of the model directory containing the model.in file
+        :param run_dir: string path of the directory the model runs in
+        :param entry: dict ledger entry of the model, where the cache key and hit are recorded
+        :return: True if the outputs were found in the cache and Cloudy does not need to run
+        """
+        if self.result_cache is None:
+            return False
+
+        entry['cache_key'] = self.result_cache.key(os.path.join(run_dir, CLOUDY_IN_FILE))
+        entry['cached'] = self.result_cache.fetch(entry['cache_key'], run_dir)
+        if entry['cached'] and self.verbose: print(f' Model {model_dir} found in the result cache')
+
+        return entry['cached']
+
+    def _stage_scratch(self, model_dir: str, run_dir: str) -> str:
+        """ Private method that, with scratch_dir, creates a temporary directory for a model in the scratch
+        directory and copies its model.in file there.
+
+        :param model_dir: string name of the model directory containing the model.in file
+        :param run_dir: string path of the model directory in the sample
+        :return: string path of the directory Cloudy runs in, run_dir itself without scratch_dir
+        """
+        if self.scratch_dir is None:
+            return run_dir
+
+        cloudy_dir = tempfile.mkdtemp(prefix=f'pyNublado_{model_dir}_', dir=self.scratch_dir)
+        shutil.copyfile(os.path.join(run_dir, CLOUDY_IN_FILE), os.path.join(cloudy_dir, CLOUDY_IN_FILE))
+        return cloudy_dir
+
+    def _unstage_scratch(self, cloudy_dir: str, run_dir: str, entry: dict, copy_back: bool = True) -> None:
+        """ Private method that, with scratch_dir, copies the outputs of a model back from the scratch
+        directory to the model directory in the sample, then removes the scratch directory, also when
+        the copy or the run failed.
+
+        :param cloudy_dir: string path of the directory Cloudy ran in, see self._stage_scratch()
+        :param run_dir: string path of the model directory in the sample
+        :param entry: dict ledger entry of the model, where the time spent is recorded
+        :param copy_back: bool flag, if False the outputs are discarded, e.g. when the run was cancelled
+        """
+        if cloudy_dir == run_dir:
+            return
+
+        try:
+            if copy_back:
+                # compress on the scratch directory, so less data is copied back
+                self._compress_outputs(cloudy_dir, entry)
+
+                copy_start = time.perf_counter()
+                for item in os.scandir(cloudy_dir):
+                    if item.name != CLOUDY_IN_FILE:
+                        shutil.copyfile(item.path, os.path.join(run_dir, item.name))
+                entry['copy_back'] = time.perf_counter() - copy_start
+        finally:
+            shutil.rmtree(cloudy_dir, ignore_errors=True)
+
+    def _compress_outputs(self, directory: str, entry: dict) -> None:
+        """ Private method that, with compress, compresses the output files of a model that are not compressed
+        yet, see utils_compress_file(). The model.in file is left as is.
+
+        :param directory: string path of the model directory
+        :param entry: dict ledger entry of the model, where the time spent is recorded
+        """
+        if not self.compress:
+            return
+
+        compress_start = time.perf_counter()
+        for item in os.scandir(directory):
+            if item.name.startswith('model.') and item.name not in [CLOUDY_IN_FILE, RUN_CLAIM_FILE] \
+                    and not item.name.endswith((COMPRESSED_SUFFIX, '.tmp')):
+                utils_compress_file(item.path)
+        entry['compress'] = entry.get('compress', 0) + time.perf_counter() - compress_start
+
+    def _finish_model(self, model_dir: str, entry: dict) -> None:
+        """ Private method that, with compress, compresses the outputs of a model whose Cloudy run is over,
+        moves it to the SAMPLE_SUBDIR_DONE/ directory, adds its outputs to the result cache if it succeeded
+        and, with parse_on_completion, parses its outputs.
+
+        :param model_dir: string name of the model directory containing the model.in file
+        :param entry: dict ledger entry of the model, where the time spent is recorded
+        """
+        sample_dir = os.path.abspath(self.sample_dir)
+
+        # Assuming the process terminated successfully, we are moving the model
+        if self.verbose: print(f' Moving model {model_dir} to {SAMPLE_SUBDIR_DONE} directory')
+
+        self._compress_outputs(os.path.join(sample_dir, self._run_subdir, model_dir), entry)
+
+        move_start = time.perf_counter()
+        if self.distributed:
+            os.remove(os.path.join(sample_dir, self._run_subdir, model_dir, RUN_CLAIM_FILE))
+        os.rename(os.path.join(sample_dir, self._run_subdir, model_dir),
+                  os.path.join(sample_dir, SAMPLE_SUBDIR_DONE, model_dir))
+        entry['move'] = time.perf_counter() - move_start
 
+        done_dir = os.path.join(sample_dir, SAMPLE_SUBDIR_DONE, model_dir)
+        if self.journal is not None or self.result_cache is not None:
+            status_code = OutputParser().read_status(pathlib.Path(done_dir, 'model.out'))[0]
+
+        if self.journal is not None:
+            self.journal.finish(int(model_dir), status_code == EXIT_STATUSES['Success'], entry.get('exit_code'))
+
+        if self.result_cache is not None and not entry['cached'] and status_code == EXIT_STATUSES['Success']:
+            self.result_cache.store(entry['cache_key'], done_dir)
+
+        # parse the outputs while they are still in the page cache
+        if self.parse_on_completion:
+            if self.verbose: print(f' Parsing model {model_dir}')
+            parse_start = time.perf_counter()
+            OutputParser(**self.parser_kwargs).parse_model_to_store(sample_dir, int(model_dir))
+            entry['parse'] = time.perf_counter() - parse_start
+
+    def _supervise(self, process: subprocess.Popen, model_dir: str, run_dir: str, entry: dict, poll: bool = True):
+        """ Private generator that supervises a running Cloudy process. It yields the number of seconds
+        to sleep before the next check, until the process exits, reaches its time out or is stopped by
+        the watchdog. The process is reaped with os.wait4(), to record its wall time, user and system
+        CPU time, exit code and time out flag in the ledger entry of the model. Its peak resident memory
+        is sampled from /proc while it runs, since ru_maxrss also counts the memory of the manager the
+        process was forked from; ru_maxrss is only used where /proc is unavailable. With distributed, the
+        lease of the claim of the model is renewed every CLAIM_LEASE_INTERVAL seconds while it runs.
+
+        :param process: subprocess.Popen of the running Cloudy process
+        :param model_dir: string name of the model directory containing the model.in file
+        :param run_dir: string path of the directory the model runs in
+        :param entry: dict ledger entry of the model, filled when the process is over
+        :param poll: bool flag, if True the delays are short, so the exit of the process is noticed
+                     quickly. If False the caller is woken up when the process exits, and the delays only
+                     lead to the next watchdog check, lease renewal or time out, so the peak memory is only
+                     sampled every WATCHDOG_INTERVAL seconds. Defaults to True
+        """
+        watchdog = self._get_watchdog(run_dir)
+        start = time.monotonic()
+        deadline = start + self._get_timeout(model_dir)
+        next_check = start + WATCHDOG_INTERVAL
+        next_renewal = start + CLAIM_LEASE_INTERVAL
+        claim_file = os.path.join(self.sample_dir, self._run_subdir, model_dir, RUN_CLAIM_FILE)
+
+        pid, status, rusage = 0, 0, None
+        max_rss_mb = None
+        delay = 0.0005
+        entry['timed_out'] = False
+        try:
+            while True:
+                pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+                if pid:
+                    break
+
+                max_rss_mb = utils_peak_rss_mb(process.pid) or max_rss_mb
+
+                now = time.monotonic()
+                if now >= deadline:
+                    # catch time out, then continue and move the model directory
+                    if self.verbose: print(f' Time out reached while processing model {model_dir}')
+                    entry['timed_out'] = True
+                    break
+
+                if now >= next_check:
+                    next_check = now + WATCHDOG_INTERVAL
+                    if watchdog and watchdog.check():
+                        if self.verbose: print(f' Watchdog stopped model {model_dir}: {watchdog.reason}')
+                        break
+
+                if self.distributed and now >= next_renewal:
+                    next_renewal = now + CLAIM_LEASE_INTERVAL
+                    try:
+                        os.utime(claim_file)
+                    except FileNotFoundError:
+                        if self.verbose: print(f' The claim of model {model_dir} was released by another manager')
+
+                if poll:
+                    # poll often at first, so short models are not delayed, then back off
+                    delay = min(delay * 2, 0.05)
+                    yield min(delay, deadline - now)
+                else:
+                    yield min(next_check, next_renewal if self.distributed else deadline, deadline) - now
+        finally:
+            if not pid:
+                process.kill()
+                pid, status, rusage = os.wait4(process.pid, 0)
+                if watchdog and watchdog.reason:
+                    watchdog.record()
+
+            # decode the wait status like subprocess: exit code, or minus the signal that killed the process
+            if os.WIFEXITED(status):
+                process.returncode = os.WEXITSTATUS(status)
+            else:
+                process.returncode = -os.WTERMSIG(status)
+            entry.update({'wall': time.monotonic() - start,
+                          'user': rusage.ru_utime,
+                          'sys': rusage.ru_stime,
+                          'max_rss_mb': max_rss_mb or rusage.ru_maxrss / 1024,     # ru_maxrss is in kB on Linux
+                          'exit_code': process.returncode,
+                          'watchdog': watchdog.reason if watchdog and watchdog.reason else ''})
+
+    def _record(self, entry: dict) -> None:
+        """ Private method that appends the ledger entry of a model to the RUN_LEDGER_FILE of the sample.
+        The file is locked during the write, so the workers of all executors can append to it.
+
+        :param entry: dict ledger entry of the model, see LEDGER_COLUMNS
+        """
+        line = io.StringIO()
+        csv.writer(line).writerow([entry.get(column, '') for column in LEDGER_COLUMNS])
+
+        with open(os.path.join(self.sample_dir, RUN_LEDGER_FILE), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
             try:
-                subprocess.call(cmd_string, shell=True, timeout=CLOUDY_RUN_TIMEOUT)
-            except subprocess.TimeoutExpired:
-                # catch time out, then continue and move the model directory
-                if self.verbose: print(f' Time out reached while processing model {model_dir}')
-                pass
+                f.write(line.getvalue())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    async def _run_model_async(self, model_dir: str) -> None:
+        """ Private method, asyncio version of self._run_model(). Launches Cloudy and waits for it
+        without blocking the event loop. The Cloudy process is not started with
+        asyncio.create_subprocess_exec(), since the asyncio child watcher would reap it and lose its
+        resource usage. Instead a thread of self._wait_executor waits for its exit without reaping it
+        (see _wait_exit()), and the event loop only wakes up when it exits or when self._supervise()
+        has a check, a lease renewal or the time out due. The Cloudy process is killed on time out or
+        if the run is cancelled.
+
+        :param model_dir: string name of the model directory containing the model.in file
+        """
+        try:
+            if self.distributed and not self._claim_model(model_dir):
+                if self.verbose: print(f' Model {model_dir} was claimed by another manager')
+                return
 
-            # Assuming the process terminated successfully, we are moving the model
-            if self.verbose: print(f' Moving model {model_dir} to {SAMPLE_SUBDIR_DONE} directory')
+            if self.verbose: print(f' Running model {model_dir} ...')
 
-            os.chdir(sample_dir)
-            cmd_string = f' mv {SAMPLE_SUBDIR_TODO}/{model_dir} {SAMPLE_SUBDIR_DONE}/'
-            subprocess.call(cmd_string, shell=True)
+            current_run_dir = os.path.join(os.path.abspath(self.sample_dir), self._run_subdir, model_dir)
+            entry = {'index': int(model_dir), 'start': time.time(),
+                     'wait': time.time() - self._queued_at.pop(model_dir, self.run_start)}
 
-            # go back to original dir
-            os.chdir(original_dir)
+            # hashing model.in and linking the cached outputs touch the disk, keep them off the event loop
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(None, self._fetch_cached, model_dir, current_run_dir, entry):
+                cloudy_dir = await loop.run_in_executor(None, self._stage_scratch, model_dir, current_run_dir)
+                completed = False
+                try:
+                    spawn_start = time.perf_counter()
+                    process = subprocess.Popen(self.cloudy_cmd + ['model.in'], cwd=cloudy_dir)
+                    entry['spawn'] = time.perf_counter() - spawn_start
+                    if self.journal is not None:
+                        self.journal.start(int(model_dir), process.pid)
+
+                    exited = loop.run_in_executor(self._wait_executor, _wait_exit, process.pid)
+                    supervisor = self._supervise(process, model_dir, cloudy_dir, entry, poll=False)
+                    try:
+                        for delay in supervisor:
+                            try:
+                                await asyncio.wait_for(asyncio.shield(exited), timeout=delay)
+                            except asyncio.TimeoutError:
+                                pass
+                    finally:
+                        # on cancellation, stops the Cloudy process
+                        supervisor.close()
+                    completed = True
+                finally:
+                    if completed:
+                        await loop.run_in_executor(None, self._unstage_scratch, cloudy_dir, current_run_dir, entry, True)
+                    else:
+                        # failed or cancelled, only remove the scratch directory
+                        self._unstage_scratch(cloudy_dir, current_run_dir, entry, copy_back=False)
+
+            # moving and parsing touch the disk, keep them off the event loop
+            await loop.run_in_executor(None, self._finish_model, model_dir, entry)
+            self._record(entry)
 
         # catch all other exceptions
-        # TODO: specify more / different cases here once they arise (see traceback output)
         except Exception:
             if self.verbose:
                 print(f' Error: while processing model {model_dir}')
                 traceback.print_exc()
+            if self.journal is not None:
+                self.journal.finish(int(model_dir), False)
+
+    async def _run_async(self) -> None:
+        """ Private method called by self._run() with executor="asyncio". Runs the queued models
+        from a single process, with at most N_CPUs Cloudy subprocesses at a time, and reports each
+        model as it finishes. Models can be added with self.enqueue() until the queue is drained.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        # one thread per running Cloudy process, blocked until it exits (see self._run_model_async())
+        self._wait_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.N_CPUs)
+        for model_dir in self.models_to_run:
+            self._queue.put_nowait(model_dir)
+
+        async def worker():
+            while True:
+                model_dir = await self._queue.get()
+                try:
+                    await self._run_model_async(model_dir)
+                    self.N_models_done += 1
+                    if self.verbose:
+                        print(f' Finished model {model_dir} ({self.N_models_done}/{self.N_models_to_run})')
+                finally:
+                    self._queue.task_done()
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.N_CPUs)]
+        try:
+            await self._queue.join()
+        finally:
+            # cancelling the workers kills the Cloudy processes still running
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._wait_executor.shutdown()
+            self._wait_executor = None
+            self._loop = None
+        self._queued_at = {}
+        self.run_start = time.time()
+
+    def enqueue(self, model_dir: str) -> None:
+        """ Add a model of the SAMPLE_SUBDIR_TODO/ directory to the queue of models to run. With
+        executor="asyncio" this can be called while the models are running, from any thread,
+        and the model is started as soon as a CPU is free.
+
+        :param model_dir: string name of the model directory containing the model.in file
+        """
+        self.N_models_to_run += 1
+        self._queued_at[model_dir] = time.time()
+        if self.journal is not None:
+            self.journal.add([model_dir])
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, model_dir)
+        else:
+            self.models_to_run.append(model_dir)
 
     def _run(self) -> None:
         """ Private method called by the public method self.manager_run().
         When called it runs all created models using Cloudy on as may CPUs as defined,
-        user-defined maximum or system maximum.
+        user-defined maximum or system maximum. The models are run by a pool of N_CPUs
+        persistent worker processes, or threads (executor="thread"), which each wait for
+        their Cloudy subprocess, or by the asyncio engine (executor="asyncio", see self._run_async()).
+        The resources used by every model are recorded in the RUN_LEDGER_FILE of the sample.
         """
 
         if self.N_models_to_run:
-            if self.verbose: print('Initialising {} threads'.format(self.N_CPUs))
-            pool = multiprocessing.Pool(processes=self.N_CPUs, maxtasksperchild=1)
+            try:
+                # exclusive creation, several distributed managers can start at the same time
+                with open(os.path.join(self.sample_dir, RUN_LEDGER_FILE), 'x') as f:
+                    csv.writer(f).writerow(LEDGER_COLUMNS)
+            except FileExistsError:
+                pass
+
+            # scheduling wait of each model is measured from here
+            self.run_start = time.time()
+
+            if self.executor == "asyncio":
+                if self.verbose: print('Running up to {} models at a time'.format(self.N_CPUs))
+                asyncio.run(self._run_async())
+                return
+
+            if self.verbose: print('Initialising {} {}'.format(self.N_CPUs, 'threads' if self.executor == 'thread' else 'processes'))
+
+            if self.executor == "thread":
+                pool = multiprocessing.pool.ThreadPool(processes=self.N_CPUs)
+            else:
+                pool = multiprocessing.Pool(processes=self.N_CPUs)
 
             pool.map(func=self._run_model, iterable=self.models_to_run, chunksize=1)
 
@@ -172,12 +1010,163 @@ class QueueManager:
                 subprocess.call(f'mv {key} {self.sample_dir}/{SAMPLE_SUBDIR_TODO}', shell=True)
 
     def manager_run(self) -> None:
-        """ Main method of the class, it wraps the private methods to read the files and run the files."""
-        if self.verbose: print("Reading the input files ...")
+        """ Main method of the class, it wraps the private methods to read the files and run the files.
+        With distributed, the SAMPLE_SUBDIR_TODO/ directory is read again after every pass, so the manager
+        keeps running the models left, or added, while other managers are running, until none are left.
+        The parsed tables are then assembled by the last manager to finish. With parse_on_completion, a
+        manager with no model left to run also waits for the models claimed by the other managers, and
+        runs again the ones whose lease expired, so the tables are assembled even if a manager died.
+        """
+        while True:
+            if self.verbose: print("Reading the input files ...")
 
-        self._get_models()
+            self._get_models()
 
-        if self.verbose:
-            print(f"Found {self.N_models_to_run} models to run ")
+            if self.verbose:
+                print(f"Found {self.N_models_to_run} models to run ")
+
+            self._run()  # runs all created model.in files in multiple CPUs
+
+            if not self.distributed or self.N_batch:
+                break
+
+            if not self.N_models_to_run:
+                if not self.parse_on_completion:
+                    break
+                if self.verbose: print("Waiting for the models claimed by other managers ...")
+                if not self._wait_for_claims():
+                    break
+
+        if self.parse_on_completion:
+            if self.distributed:
+                self._parse_distributed()
+            else:
+                self._parse()
+
+    def _parse(self) -> None:
+        """ Private method called by the public method self.manager_run() when parse_on_completion is set.
+        Assembles the parsed tables of the sample from the result store filled by the workers (and the
+        previous parse, if any), parsing only the models missing from both, then removes the store.
+        """
+        if self.verbose: print("Assembling the parsed outputs ...")
+
+        parser = OutputParser(**self.parser_kwargs)
+        parser.parse(self.sample_dir, n_workers=self.N_CPUs, incremental=True, result_store=True)
+
+        store_path = pathlib.Path(self.sample_dir, RESULT_STORE_FILE)
+        if store_path.exists():
+            os.remove(store_path)
+
+    def _parse_distributed(self) -> None:
+        """ Private method called by the public method self.manager_run() with distributed and parse_on_completion.
+        The parsed tables are assembled (see self._parse()) only once no model is left to run or running,
+        by a single manager, the one that creates the PARSE_LOCK_DIR/ directory of the sample first. The
+        state of the SAMPLE_SUBDIR_DONE/ directory they were assembled from is then recorded in PARSE_DONE_FILE,
+        so the managers that finish later do not assemble them again, unless models finished meanwhile.
+        """
+        for subdir in [SAMPLE_SUBDIR_TODO, SAMPLE_SUBDIR_RUNNING]:
+            if any(pathlib.Path(self.sample_dir, subdir).iterdir()):
+                if self.verbose: print(f"Models left in {subdir}/, leaving the parse to the last manager")
+                return
 
-        self._run()  # runs all created model.in files in multiple CPUs
+        lock_dir = pathlib.Path(self.sample_dir, PARSE_LOCK_DIR)
+        try:
+            # creating a directory is atomic, also on a shared filesystem
+            lock_dir.mkdir()
+        except FileExistsError:
+            if self.verbose: print("Another manager is assembling the parsed outputs")
+            return
+
+        try:
+            # number of finished models, and time of the last move in or out of the directory
+            done_dir = pathlib.Path(self.sample_dir, SAMPLE_SUBDIR_DONE)
+            done_state = f'{len(os.listdir(done_dir))} {done_dir.stat().st_mtime_ns}\n'
+            done_file = pathlib.Path(self.sample_dir, PARSE_DONE_FILE)
+            if done_file.exists() and done_file.read_text() == done_state:
+                if self.verbose: print("The parsed outputs were already assembled by another manager")
+                return
+
+            self._parse()
+
+            pathlib.Path(f'{done_file}.tmp').write_text(done_state)
+            os.replace(f'{done_file}.tmp', done_file)
+        finally:
+            lock_dir.rmdir()
+
+
+class CloudyWatchdog:
+    """ Class used to follow the model.out file of a running Cloudy model, to stop runs that can only fail.
+
+    Every call to check() reads the part of model.out written since the previous call and looks for
+    the failure markers in patterns. Optionally, a run is also considered stalled when
+    model.out did not grow for stall_timeout seconds, e.g. when Cloudy is stuck in a zone.
+
+    :param str out_file: string path to the model.out file of the running model
+    :param float stall_timeout: float seconds without new output after which the run is stalled.
+                                Defaults to None (no stall detection)
+    :param list patterns: list of the markers of model.out that stop the run.
+                          Defaults to None (WATCHDOG_ABORT_PATTERNS)
+    """
+    def __init__(self, out_file: str, stall_timeout: float = None, patterns: list = None):
+
+        self.out_file = out_file
+        self.stall_timeout = stall_timeout
+        self.patterns = patterns or WATCHDOG_ABORT_PATTERNS
+
+        self.offset = 0                         # bytes of model.out already read
+        self.last_progress = time.monotonic()   # last time model.out grew
+        self.reason = None                      # why the run has to be stopped, None while it can go on
+
+        # keep the end of the last read, so a marker split between two reads is still found
+        self.overlap = max(len(pattern) for pattern in self.patterns) - 1
+        self.previous = ''
+
+    def check(self) -> bool:
+        """ Reads the new output of the model and checks if the run has to be stopped.
+
+        :return: True if the run has to be stopped, the reason is kept in self.reason
+        :rtype: bool
+        """
+        try:
+            with open(self.out_file, 'r', errors='replace') as f:
+                f.seek(self.offset)
+                new = f.read()
+                self.offset = f.tell()
+        except FileNotFoundError:
+            new = ''
+
+        if new:
+            self.last_progress = time.monotonic()
+            text = self.previous + new
+            self.previous = text[-self.overlap:]
+
+            for pattern in self.patterns:
+                if pattern in text:
+                    self.reason = pattern
+                    return True
+
+        elif self.stall_timeout and time.monotonic() - self.last_progress > self.stall_timeout:
+            self.reason = f'no output for {self.stall_timeout:.0f}s'
+            return True
+
+        return False
+
+    def record(self) -> None:
+        """ Appends the reason the run was stopped to model.out, so the parser finds the failure marker
+        (or none, for stalled runs which are then classified DNF) at the end of the file.
+        """
+        with open(self.out_file, 'a') as f:
+            f.write(f'\n pyNublado watchdog stopped the run: {self.reason}\n')
+
+
+def _wait_exit(pid: int) -> None:
+    """ Waits until the child process pid exits, without reaping it, so its exit status and resource
+    usage are left to os.wait4(). Used from a thread by QueueManager._run_model_async().
+
+    :param int pid: process id of the child process
+    """
+    try:
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+    except ChildProcessError:
+        # already reaped, e.g. killed on time out
+        pass
@@ -1,35 +1,117 @@
 import numpy as np
 import pandas as pd 
 import pathlib
-import os, re
+import os
+import shutil
 import warnings
 import hashlib
-import subprocess
+import itertools
+import functools
+import collections
+import multiprocessing
+import multiprocessing.pool
+import pickle
+import fcntl
 from tqdm import tqdm
 
-from common.settings import SAMPLE_SUBDIR_TODO, SAMPLE_SUBDIR_DONE, INPUT_PARAMETER_NAMES, EXIT_STATUSES
+from common.settings import SAMPLE_SUBDIR_TODO, SAMPLE_SUBDIR_DONE, INPUT_PARAMETER_NAMES, EXIT_STATUSES, \
+    CONT_CUBE_DIR, OPD_CUBE_DIR, PARSE_MANIFEST_FILE, RESULT_STORE_FILE, RUN_TIMEOUTS_FILE, COMPRESSED_SUFFIX
+from common.utils import utils_read_file_tail, utils_open_output, utils_output_exists, \
+    TAIL_CLEANUP_PATTERN, EXEC_TIME_PATTERN
+
+# np.trapz was renamed np.trapezoid in NumPy 2.0, older versions only have np.trapz
+_trapezoid = np.trapezoid if hasattr(np, "trapezoid") else np.trapz
 
 
 class OutputParser(object):
     """ Parser class used to parse all outputs from CLOUDY and save them into a dataframe
     for future use.
+
+    :param str cont_format: how the continuum of all models is saved. "pickle" (default) saves a dataframe
+                            of dataframes in cont.pkl, "cube" saves a dense memory-mappable array
+                            (see save_cont_cube()).
+    :param str cont_dtype: dtype of the continuum cube, e.g "float32" to halve its size. Defaults to "float64".
+    :param str output_format: how the tables (inputs, status, emis) are saved. "pickle" (default) saves whole
+                              dataframes, "npy" saves one .npy file per column so single columns can be read
+                              without loading the rest (see save_table()). With "npy" the continuum is always
+                              saved as a cube.
     """
-    def __init__(self):
-        pass
+    def __init__(self, cont_format: str = "pickle", cont_dtype: str = "float64", output_format: str = "pickle"):
+        if cont_format not in ["pickle", "cube"]:
+            raise ValueError(f"Unknown cont_format {cont_format}, expected 'pickle' or 'cube'.")
+        if output_format not in ["pickle", "npy"]:
+            raise ValueError(f"Unknown output_format {output_format}, expected 'pickle' or 'npy'.")
+
+        self.output_format = output_format
+        self.cont_format = "cube" if output_format == "npy" else cont_format
+        self.cont_dtype = np.dtype(cont_dtype)
+
+        # column names of the model.emis files, keyed by the raw header line. All the models in a sample
+        # share the same line list, so the header only needs to be tokenized once per sample
+        self._emis_header_cache = {}
+
+        # number of malformed (non-numeric) tokens found in each parsed model.emis file
+        self.emis_malformed_tokens = {}
+
+        # column names of the last parsed model.emis, model.cont and model.opd files
+        self.emis_columns = []
+        self.cont_columns = []
+        self.opd_columns = []
+
+        # status code of each parsed model, indexed by model index
+        self.status_codes = {}
 
-    def __call__(path: str):
-        self.parse(path)
+    def __call__(self, path: str, **kwargs):
+        self.parse(path, **kwargs)
 
-    def parse(self, path: str):
+    def parser_kwargs(self):
+        """
+        Keyword arguments to build a parser with the same settings, e.g. in the workers of a process pool.
+
+        :return kwargs: dictionary of the cont_format, cont_dtype and output_format of the parser
+        :rtype: dict
+        """
+        return {"cont_format": self.cont_format, "cont_dtype": str(self.cont_dtype), "output_format": self.output_format}
+
+    def parse(self, path: str, n_workers: int = 1, fused: bool = True, hash_mode: str = "fast",
+              incremental: bool = False, max_memory_mb: float = None, structure: bool = False,
+              result_store: bool = False):
         """
         Main method of the class, calls all other implemented
         parsing methods. Takes as input the path to the folder where all CLOUDY outputs
         are stored.
 
         :param str path: string path to the folder where the ran models are
+        :param int n_workers: number of processes used to parse the models. If larger than one, the model
+                              directories are split across a process pool (see parse_fused()). Defaults to 1.
+        :param bool fused: if True (default) each model directory is visited only once to parse the status,
+                           emission lines and continuum (see parse_fused()). If False, the done directory is
+                           walked once per parsing method. Always True when n_workers is larger than one.
+        :param str hash_mode: how the ids of the input parameters are computed, "fast" or "compat"
+                              (see hash_inputs()). Defaults to "fast".
+        :param bool incremental: if True, only the models that are new or changed since the last parse
+                                 (as recorded in the parse manifest) are parsed and merged into the existing
+                                 outputs. Implies fused. The manifest is only written by incremental and
+                                 result_store parses, other parses remove it. Defaults to False.
+        :param float max_memory_mb: if given, the models are parsed in streaming mode: results are written
+                                    to disk in blocks of at most max_memory_mb megabytes as they are parsed
+                                    (see parse_streaming()). Requires the "npy" output format and can not be
+                                    combined with incremental. Defaults to None (all results kept in memory).
+        :param bool structure: if True, also parse the overview, heating, cooling and optical depth files
+                               of the successful models (see parse_structure()). Defaults to False.
+        :param bool result_store: if True, the models already parsed by the QueueManager workers as they
+                                  finished (see parse_model_to_store()) are taken from the result store of the
+                                  sample instead of being parsed again. Implies fused. Defaults to False.
         :return: None
         :rtype: None
         """
+        if max_memory_mb and self.output_format != "npy":
+            raise ValueError("The streaming parse (max_memory_mb) requires output_format='npy', "
+                             "pickled tables can not be written in blocks.")
+        if max_memory_mb and (incremental or result_store):
+            raise ValueError("The streaming parse (max_memory_mb) can not be combined with incremental "
+                             "or result_store.")
+
         raw_path = path
         path = pathlib.Path(path).iterdir()
 
@@ -55,19 +137,55 @@ class OutputParser(object):
             if n_items > 0:
                 warnings.warn(f"{SAMPLE_SUBDIR_TODO} folder not empty. Found {n_items} not executed models.")
         
+        # manifest of the previous parse, only needed to parse incrementally
+        manifest = self.load_manifest(pathlib.Path(raw_path)) if incremental else None
+
+        # records of the models parsed by the QueueManager workers
+        stored = load_result_store(pathlib.Path(raw_path)) if result_store else None
+
         # load the input parameters as a dataframe (to be accessed by all parsing methods)
+        inputs_signature = None
         if sub_dirs["inputs"]:
-            inputs_df = self.parse_inputs(path=sub_dirs["inputs"])
+            inputs_signature = self.file_signature(sub_dirs["inputs"]) + (hash_mode,)
+
+            if manifest and manifest["inputs"] == inputs_signature:
+                inputs_df = self.load_inputs(path=sub_dirs["inputs"])
+            else:
+                # the ids may have changed, so all the models have to be parsed again
+                inputs_df = self.parse_inputs(path=sub_dirs["inputs"], hash_mode=hash_mode)
+                manifest = None
             N_models_in_sample = len(inputs_df)
         else:
             N_models_in_sample = 0          # Fallback. Value only used in tqdm progress bar, won't fail
 
+        # the signatures of the model directories, which take a stat() per output file, are
+        # only needed to tell the changed models apart in this or the next incremental parse
+        signatures = None
+
         # here we list the parsing methods to be executed
-        if sub_dirs[SAMPLE_SUBDIR_DONE]:
+        if sub_dirs[SAMPLE_SUBDIR_DONE] and max_memory_mb:
+            self.parse_streaming(path=sub_dirs[SAMPLE_SUBDIR_DONE], max_memory_mb=max_memory_mb,
+                                 n_workers=n_workers)
+
+        elif sub_dirs[SAMPLE_SUBDIR_DONE] and (fused or incremental or result_store or (n_workers and n_workers > 1)):
+            signatures = self.parse_fused(path=sub_dirs[SAMPLE_SUBDIR_DONE], n_workers=n_workers, manifest=manifest,
+                                          stored=stored, signatures=incremental or result_store)
+
+        elif sub_dirs[SAMPLE_SUBDIR_DONE]:
             self.parse_status(path=sub_dirs[SAMPLE_SUBDIR_DONE], N_models=N_models_in_sample)
             self.parse_emis(path=sub_dirs[SAMPLE_SUBDIR_DONE], N_models=N_models_in_sample)
             self.parse_cont(path=sub_dirs[SAMPLE_SUBDIR_DONE], N_models=N_models_in_sample)
 
+        if sub_dirs[SAMPLE_SUBDIR_DONE]:
+            if signatures is not None:
+                self.save_manifest(pathlib.Path(raw_path), inputs_signature, signatures)
+            else:
+                # the outputs were rewritten, a manifest of an earlier parse would no longer match them
+                pathlib.Path(raw_path, PARSE_MANIFEST_FILE).unlink(missing_ok=True)
+
+        if sub_dirs[SAMPLE_SUBDIR_DONE] and structure:
+            self.parse_structure(path=sub_dirs[SAMPLE_SUBDIR_DONE], n_workers=n_workers)
+
     def hash_list(self, inputs: list):
         """
         Given a list of elements produce a unique fixed-limit hash to be used as an id of
@@ -92,37 +210,157 @@ class OutputParser(object):
         # hash the concatenated hash
         return hashlib.md5(merged_hashes).hexdigest()
 
-    def parse_inputs(self, path: pathlib.PosixPath):
+    def hash_inputs(self, inputs: np.ndarray, hash_mode: str = "fast"):
+        """
+        Given the 2D array of input parameter combinations, produce the unique hash id of every row.
+        In "fast" mode the rows are converted in a single vectorized pass into fixed-width records of
+        little-endian float64 bytes, and each record is hashed once with MD5. The ids are stable across
+        platforms and do not depend on how floats are formatted as strings. In "compat" mode every row
+        is hashed with hash_list(), reproducing the ids of previously parsed samples.
+
+        :param numpy.ndarray inputs: 2D array of input parameter combinations (models x parameters)
+        :param str hash_mode: "fast" or "compat". Defaults to "fast".
+        :return hashes: unique hash id of each row
+        :rtype: list
+        """
+        if hash_mode == "compat":
+            return [self.hash_list(inputs_list) for inputs_list in tqdm(inputs)]
+
+        elif hash_mode != "fast":
+            raise ValueError(f"Unknown hash_mode {hash_mode}, expected 'fast' or 'compat'.")
+
+        # adding 0.0 turns -0.0 into 0.0, so equal values always have the same bytes
+        rows = np.ascontiguousarray(inputs, dtype="<f8") + 0.0
+        record_size = rows.itemsize * rows.shape[1]
+        records = memoryview(rows.tobytes())
+
+        return [hashlib.md5(records[start:start + record_size]).hexdigest()
+                for start in range(0, len(records), record_size)]
+
+    def parse_inputs(self, path: pathlib.PosixPath, hash_mode: str = "fast"):
         """
         Method that given the path to the .npy file containing
         the inputs loads it, converts it into a dataframe to be used in the other
         methods and computes the id column by hashing the inputs.
 
         :param pathlib.PosixPath path: path to the .npy file containing the input parameters combinations
+        :param str hash_mode: "fast" or "compat", see hash_inputs(). Defaults to "fast".
         :return inputs: input parameter combinations as a pandas Dataframe
         :rtype: pandas.DataFrame
         """
 
-        save_path = path.parent.joinpath("inputs.pkl")
+        save_path = path.parent.joinpath("inputs")
         
         inputs = np.load(path)
-        hashes_column = []
 
         print('Parser: Hashing input parameters')
-        for inputs_list in tqdm(inputs):
-            hashes_column.append(self.hash_list(inputs_list))
+        hashes_column = self.hash_inputs(inputs, hash_mode=hash_mode)
 
         column_names = INPUT_PARAMETER_NAMES
 
         inputs = pd.DataFrame(inputs, columns=column_names)
         inputs["id"] = hashes_column
 
-        # save the file in pickle format
-        inputs.to_pickle(save_path)
+        # save the file in the chosen output format
+        save_table(inputs, save_path, self.output_format)
+
+        self.inputs = inputs
+
+        # array of hash ids indexed by model index, for constant time lookups
+        self.ids = inputs["id"].to_numpy()
+        return inputs
+
+    def load_inputs(self, path: pathlib.PosixPath):
+        """
+        Method that given the path to the .npy file containing the inputs, loads the
+        dataframe of inputs and ids saved by a previous call to parse_inputs(), instead
+        of hashing the inputs again.
+
+        :param pathlib.PosixPath path: path to the .npy file containing the input parameters combinations
+        :return inputs: input parameter combinations as a pandas Dataframe
+        :rtype: pandas.DataFrame
+        """
+        inputs = load_table(path.parent.joinpath("inputs"))
 
         self.inputs = inputs
+        self.ids = inputs["id"].to_numpy()
         return inputs
 
+    def file_signature(self, path: pathlib.PosixPath):
+        """
+        Size and modification time of a file, used to tell whether it changed since the last parse.
+
+        :param pathlib.PosixPath path: path to the file
+        :return signature: (size, mtime in ns) of the file
+        :rtype: tuple
+        """
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def model_signature(self, path: pathlib.PosixPath):
+        """
+        Given the path to e.g "done/1234" directory, list the name, size and modification time
+        of the model.out, model.emis and model.cont files, or of their compressed versions, used to
+        tell whether the model changed since the last parse.
+
+        :param pathlib.PosixPath path: path to the e.g "done/1234" directory
+        :return signature: sorted tuple of (name, size, mtime in ns) of the files present
+        :rtype: tuple
+        """
+        signature = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                name = entry.name
+                if name.endswith(COMPRESSED_SUFFIX):
+                    name = name[:-len(COMPRESSED_SUFFIX)]
+                if name in ["model.out", "model.emis", "model.cont"]:
+                    stat = entry.stat()
+                    signature.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        return tuple(sorted(signature))
+
+    def load_manifest(self, path: pathlib.PosixPath):
+        """
+        Given the path to the sample directory, load the manifest written by the last parse.
+        The manifest is only returned if it was written with the same output format and
+        all the outputs it refers to still exist, otherwise None is returned.
+
+        :param pathlib.PosixPath path: path to the sample directory
+        :return manifest: dictionary with the signature of the inputs and of every parsed model, or None
+        :rtype: dict
+        """
+        manifest_path = path.joinpath(PARSE_MANIFEST_FILE)
+        if not manifest_path.exists():
+            return None
+
+        manifest = pd.read_pickle(manifest_path)
+        if (manifest["output_format"], manifest["cont_format"], manifest["cont_dtype"]) != \
+                (self.output_format, self.cont_format, str(self.cont_dtype)):
+            return None
+
+        cont_output = path.joinpath(CONT_CUBE_DIR, "models") if self.cont_format == "cube" \
+            else path.joinpath("cont")
+        for output in [path.joinpath("inputs"), path.joinpath("status"), path.joinpath("emis"), cont_output]:
+            if not table_exists(output):
+                return None
+
+        return manifest
+
+    def save_manifest(self, path: pathlib.PosixPath, inputs_signature: tuple, signatures: dict):
+        """
+        Given the path to the sample directory, save the manifest of the parse: the signature of
+        the inputs file and of every parsed model directory, see model_signature().
+
+        :param pathlib.PosixPath path: path to the sample directory
+        :param tuple inputs_signature: signature of the inputs file and hash mode used
+        :param dict signatures: signature of every parsed model, indexed by model index
+        """
+        manifest = {"inputs": inputs_signature,
+                    "output_format": self.output_format,
+                    "cont_format": self.cont_format,
+                    "cont_dtype": str(self.cont_dtype),
+                    "models": signatures}
+        pd.to_pickle(manifest, path.joinpath(PARSE_MANIFEST_FILE))
+
     def status_to_int(self, tail: str):
         """
         Method to map the different exit status of the ran models
@@ -163,8 +401,116 @@ class OutputParser(object):
         :return hash: string hash id of the model
         :rtype: str
         """
-        return self.inputs.iloc[index].id
+        return self.ids[index]
+
+    def indexes_to_hashes(self, indexes: list):
+        """
+        Given a list of int indexes, look for the hashes associated in the inputs
+        dataframe and return them, in a single vectorized lookup.
+
+        :param list indexes: indexes of the models
+        :return hashes: string hash ids of the models
+        :rtype: list
+        """
+        return list(self.ids[np.asarray(indexes, dtype=np.int64)])
         
+    def list_model_dirs(self, path: pathlib.PosixPath):
+        """
+        Given the path to the "done" directory, list all model directories
+        sorted by their model index, so that all outputs are ordered the same way
+        no matter the order in which the filesystem returns the entries. The directory is
+        enumerated with os.scandir(), which gets the entry types without a stat() per entry.
+
+        :param pathlib.PosixPath path: path to the "done" directory
+        :return model_dirs: list of (index, path) tuples sorted by index
+        :rtype: list
+        """
+        model_dirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.isdigit() and entry.is_dir():
+                    model_dirs.append((int(entry.name), pathlib.Path(entry.path)))
+        model_dirs.sort()
+        return model_dirs
+
+    def read_status(self, out_file: pathlib.PosixPath):
+        """
+        Given the path to a model.out file, look at its last lines
+        to extract how the model exited and its execution time.
+
+        :param pathlib.PosixPath out_file: path to the model.out file
+        :return (status_code, time): mapped status code and execution time in seconds (NaN if not present)
+        :rtype: tuple
+        """
+        # read the exit code phrase from the last lines in model.out file
+        try:
+            raw_line = utils_read_file_tail(out_file, n_lines=5)
+        except FileNotFoundError:
+            # model.out was not created, so it did not run DNR
+            return EXIT_STATUSES["DNR"], np.nan
+
+        line = TAIL_CLEANUP_PATTERN.sub('', raw_line)
+        status_code = self.status_to_int(line)
+
+        # save the execution time, if present in model.out file,
+        # it could not be present if the ran did not finish (DNF)
+        time = np.nan
+        match = EXEC_TIME_PATTERN.search(raw_line)
+        if match:
+            time = float(match.group(1))
+
+        return status_code, time
+
+    def save_status(self, path: pathlib.PosixPath, indexes: list, status_codes: list, times: list):
+        """
+        Build the dataframe of run statuses, save it next to the "done" directory
+        and keep it available for the other methods of the parser.
+
+        :param pathlib.PosixPath path: path to the "done" directory
+        :param list indexes: model indexes
+        :param list status_codes: mapped status code of each model
+        :param list times: execution time of each model
+        """
+        save_path = path.parent.joinpath("status")
+
+        # build the dataframe, by adding all columns
+        status_df = pd.DataFrame()
+        status_df["index"] = [str(index) for index in indexes]
+        status_df["status"] = np.asarray(status_codes, dtype=np.int64)
+        status_df["id"] = self.indexes_to_hashes(indexes)
+        status_df["time"] = np.asarray(times, dtype=np.float64)
+
+        # time out given to each model by the manager, if it used per-model time outs
+        timeouts = self.load_timeouts(path.parent)
+        if timeouts is not None:
+            status_df["timeout"] = np.array([timeouts.get(int(index), np.nan) for index in indexes], dtype=np.float64)
+
+        save_table(status_df, save_path, self.output_format)
+
+        # let the table of status codes available
+        # for other methods of the parser class, since we can only
+        # parse emissions, continuum, ... if the model is successful
+        self.status = status_df
+        del status_df
+
+        # status code indexed by model index, for constant time lookups
+        self.status_codes = dict(zip((int(index) for index in indexes), status_codes))
+
+    def load_timeouts(self, path: pathlib.PosixPath):
+        """
+        Given the path to the sample directory, load the time out the manager gave to each model,
+        when it ran them with per-model time outs (see QueueManager, adaptive_timeout).
+
+        :param pathlib.PosixPath path: path to the sample directory
+        :return timeouts: time out in seconds indexed by model index, None if not recorded
+        :rtype: dict
+        """
+        timeouts_path = pathlib.Path(path, RUN_TIMEOUTS_FILE)
+        # the manager creates it empty while it records the first time outs
+        if not timeouts_path.exists() or not timeouts_path.stat().st_size:
+            return None
+        return pd.read_pickle(timeouts_path)
+
     def parse_status(self, path: pathlib.PosixPath, N_models: int):
         """
         Given the path to the "done" directory
@@ -178,58 +524,84 @@ class OutputParser(object):
         :param pathlib.PosixPath path: path to the "done" directory
         :param int N_models: number of expected models in the sample
         """
-        save_path = path.parent.joinpath("status.pkl")
-
-        status_codes, indexes, hashes, times = [], [], [], []
+        status_codes, indexes, times = [], [], []
 
         print('Parser: Parsing run statuses')
 
-        for item in tqdm(path.iterdir(), total=N_models):
-            out_file = item.joinpath("model.out")
-            index = str(out_file.parent).split("/")[-1]
-            if out_file.exists():
-                
-                # read the exit code phrase from the last line in model.out file
-                raw_line = subprocess.check_output(['tail', '-5', out_file])
-                raw_line = bytes.decode(raw_line)
-                line = re.sub(r'[\n]|\[|\]', '', raw_line)
-                status_code = self.status_to_int(line)
-
-                # save the execution time, if present in model.out file,
-                # it could not be present if the ran did not finish (DNF)
-                if "ExecTime(s)" in raw_line:
-                    subline = raw_line.split()
-                    for idx, word in enumerate(subline):
-                        if word == "ExecTime(s)":
-                            break
-                    time = subline[idx+1]
-                    times.append(float(time))
-                else:
-                    times.append(None)
-
-            else:
-                # model.out was not created, so it did not run DNR
-                status_code = EXIT_STATUSES["DNR"]
-                times.append(None)
+        for index, item in tqdm(self.list_model_dirs(path), total=N_models):
+            status_code, time = self.read_status(item.joinpath("model.out"))
 
             indexes.append(index)
             status_codes.append(status_code)
-            hashes.append(self.index_to_hash(int(index)))
-        
-        # build the dataframe, by adding all columns
-        status_df = pd.DataFrame()
-        status_df["index"] = indexes
-        status_df["status"] = status_codes
-        status_df["id"] = hashes
-        status_df["time"] = times
-        status_df.to_pickle(save_path)
+            times.append(time)
+
+        self.save_status(path, indexes, status_codes, times)
+
+    def parse_emis_header(self, header: str):
+        """
+        Given the header line of a model.emis file, tokenize it into the list of column names.
+        The first column is the depth, the rest are the emission lines whose labels
+        (e.g "O  3 5006.84A") are glued together into a single name (e.g "O_3_5006.84A").
+        The result is cached, since all models in a sample share the same header.
+
+        :param str header: first line of the model.emis file
+        :return header_columns: list of column names
+        :rtype: list
+        """
+        if header in self._emis_header_cache:
+            return self._emis_header_cache[header]
+
+        # identify the columns (emission lines) to be the header
+        tokens = header.split()
+        header_columns = []
+        header_columns.append(tokens[0].replace("#", "")) # this is "#depth"
+
+        buffer = []
+        for item in tokens[1:]:
+            if len(buffer) == 0:
+                buffer.append(item)
+
+            elif "." in item:
+                buffer.append(item)
+                header_columns.append("_".join(buffer))
+                buffer = []
+
+            else:
+                buffer.append(item)
+
+        self._emis_header_cache[header] = header_columns
+        return header_columns
+
+    def read_emis_file(self, path: pathlib.PosixPath):
+        """
+        Given the path to a model.emis file, read the whole zone x line table
+        into a float array in a single pass. Tokens that can not be converted into
+        a float are set to NaN, their number is reported once per file with a warning
+        and stored in the emis_malformed_tokens attribute.
+
+        :param pathlib.PosixPath path: path to the model.emis file
+        :return (header_columns, values): list of column names and 2D float array (zones x columns)
+        :rtype: tuple
+        """
+        with utils_open_output(path) as f:
+            header_columns = self.parse_emis_header(f.readline())
+            table = pd.read_csv(f, sep=r"\s+", header=None, names=header_columns, index_col=False,
+                                float_precision="round_trip")
+
+        # columns with malformed tokens are not parsed as floats, coerce them
+        n_malformed = 0
+        for column in table.columns:
+            if not pd.api.types.is_float_dtype(table[column]):
+                values = pd.to_numeric(table[column], errors="coerce")
+                n_malformed += int((values.isna() & table[column].notna()).sum())
+                table[column] = values
+
+        self.emis_malformed_tokens[str(path)] = n_malformed
+        if n_malformed:
+            warnings.warn(f"Found {n_malformed} malformed tokens in {path}, they are set to NaN.")
+
+        return header_columns, table.to_numpy(dtype=np.float64)
 
-        # let the table of status codes available
-        # for other methods of the parser class, since we can only
-        # parse emissions, continuum, ... if the model is successful
-        self.status = status_df
-        del status_df
-    
     def parse_emis_file(self, path: pathlib.PosixPath):
         """
         Given the path to e.g "done/1234" directory
@@ -237,57 +609,52 @@ class OutputParser(object):
         file containing the emission lines and saves it into a dataframe. 
         finally it returns the deepest line in the model, corresponding
         to the outer-most zone (emergent emission). The method then saves
-        the extracted information in a pandas dataframe and serializes it with pickle.
+        the extracted information in a pandas dataframe and serializes it with pickle
+        (emis.pkl), or with the "npy" output format as a column-major 2D array (emis.npy)
+        with the same columns as the emission table of the sample.
 
         :param pathlib.PosixPath path: path to the e.g "done/1234" directory
         """
 
-        save_path = path.parent.joinpath("emis.pkl")
-        with open(path, "r") as f:
-            lines = f.readlines()
-
-            # identify the columns (emission lines) to be the header
-            header = lines[0].split()
-            header_columns = []
-            header_columns.append(header[0].replace("#", "")) # this is "#depth"
-
-            buffer = []
-            for idx, item in enumerate(header[1:]):
-                if len(buffer) == 0:
-                    buffer.append(item)
-                
-                elif "." in item:
-                    buffer.append(item)
-                    header_columns.append("_".join(buffer))
-                    buffer = []
-                    
-                else:
-                    buffer.append(item)
-            
-            # initialize the dictionary with empty lists
-            emis_dict = {}
-            for key in header_columns:
-                emis_dict[key] = []
-            
-            # fill in the dictionary
-            for line in lines[1:]:
-                splitted_line = line.split()
-                for idx, elem in enumerate(splitted_line):
-                    try:
-                        emis_dict[header_columns[idx]].append(float(elem))
-                    except:
-                        print(elem)
-                        pass
-            # convert the dictionary into a pandas dataframe
-            emis_df = pd.DataFrame().from_dict(emis_dict)
-            emis_df.to_pickle(save_path)
-
-            # return the outer-most emission line results
-            emis_max_depth = emis_df[emis_df["depth"] == emis_df["depth"].max()]
-            
-            # free memory
-            del emis_dict, emis_df
-            return emis_max_depth
+        header_columns, values = self.read_emis_file(path)
+
+        # convert the table into a pandas dataframe
+        emis_df = pd.DataFrame(values, columns=header_columns)
+        self.emis_columns = header_columns
+        if self.output_format == "npy":
+            np.save(path.parent.joinpath("emis.npy"), np.asfortranarray(values))
+        else:
+            emis_df.to_pickle(path.parent.joinpath("emis.pkl"))
+
+        # return the outer-most emission line results
+        emis_max_depth = emis_df[emis_df["depth"] == emis_df["depth"].max()]
+
+        # free memory
+        del values, emis_df
+        return emis_max_depth
+
+    def save_emis(self, path: pathlib.PosixPath, columns: list, indexes: list, rows: list):
+        """
+        Build the dataframe containing the outer-most zone (emergent emission) of all models
+        and save it next to the "done" directory.
+
+        :param pathlib.PosixPath path: path to the "done" directory
+        :param list columns: names of the columns of the model.emis files
+        :param list indexes: model indexes
+        :param list rows: 2D arrays with the outer-most zone(s) of each model
+        """
+        save_path = path.parent.joinpath("emis")
+
+        if rows:
+            emis_dataframe = pd.DataFrame(np.concatenate(rows), columns=columns)
+            indexes = np.repeat(indexes, [len(row) for row in rows])
+        else:
+            emis_dataframe = pd.DataFrame()
+
+        emis_dataframe["index"] = [str(index) for index in indexes]
+        emis_dataframe["id"] = self.indexes_to_hashes(indexes)
+        save_table(emis_dataframe, save_path, self.output_format)
+        del emis_dataframe
 
     def parse_emis(self, path: pathlib.PosixPath, N_models: int):
         """
@@ -301,31 +668,21 @@ class OutputParser(object):
         :param pathlib.PosixPath path: path to the e.g "done" directory
         :param int N_models: number of expected models in the sample
         """
-
-        save_path = path.parent.joinpath("emis.pkl")
-
-        emis_df, indexes, hashes, status = [], [], [], []
+        rows, indexes = [], []
 
         print('Parser: Parsing emission line data')
 
-        for item in tqdm(path.iterdir(), total=N_models):
+        for index, item in tqdm(self.list_model_dirs(path), total=N_models):
             emis_file = item.joinpath("model.emis")
-            index = str(emis_file.parent).split("/")[-1]
 
             # check if status_code of index model is "OK"
-            exit_code = self.status[self.status["index"] == index].status.values[0]
-            if (emis_file.exists()) and (exit_code == 0):
-                df = self.parse_emis_file(emis_file)
-                emis_df.append(df)
-                    
+            exit_code = self.status_codes.get(index, EXIT_STATUSES["DNR"])
+            if utils_output_exists(emis_file) and (exit_code == 0):
+                rows.append(self.parse_emis_file(emis_file).to_numpy())
                 indexes.append(index)
-                hashes.append(self.index_to_hash(int(index)))
-            
-        emis_dataframe = pd.concat(emis_df)
-        emis_dataframe["index"] = indexes
-        emis_dataframe["id"] = hashes
-        emis_dataframe.to_pickle(save_path)
-        del emis_dataframe, emis_df, indexes, hashes
+
+        self.save_emis(path, self.emis_columns, indexes, rows)
+        del rows, indexes
     
     def parse_cont_file(self, path: pathlib.PosixPath):
         """
@@ -333,20 +690,121 @@ class OutputParser(object):
         where a finished model is saved, this method parses the model.cont
         file containing the continuum (incident, reflected, transmitted, ...)
         and saves it into a dataframe. The method then saves the extracted information
-        in a pandas dataframe and serializes it with pickle.
+        in a pandas dataframe and serializes it with pickle (cont.pkl), or with the "npy" output
+        format as a column-major 2D array (cont.npy) with the photon energy followed by the
+        components of the continuum cube.
 
         :param pathlib.PosixPath path: path to the e.g "done/1234" directory
         """
-        save_path = path.parent.joinpath("cont.pkl")
-        cont_dataframe = pd.read_csv(path, sep="\t")
+        with utils_open_output(path) as f:
+            cont_dataframe = pd.read_csv(f, sep="\t")
         cont_dataframe.rename(columns={"#Cont  nu": "photon_energy",
                                        "trans": "transmitted",
                                        "reflc": "reflected"},
                               inplace=True)
         cont_dataframe.drop(columns=['reflin', 'outlin', 'lineID', 'cont', 'nLine'], inplace=True)
-        cont_dataframe.to_pickle(save_path)
+        if self.output_format == "npy":
+            np.save(path.parent.joinpath("cont.npy"), np.asfortranarray(cont_dataframe.to_numpy()))
+        else:
+            cont_dataframe.to_pickle(path.parent.joinpath("cont.pkl"))
+        self.cont_columns = list(cont_dataframe.columns)
         return cont_dataframe
-    
+
+    def save_cont(self, path: pathlib.PosixPath, columns: list, indexes: list, conts: list,
+                  previous_rows: dict = None):
+        """
+        Build the dataframe containing the continuum of all models
+        and serialize it with pickle next to the "done" directory.
+
+        :param pathlib.PosixPath path: path to the "done" directory
+        :param list columns: names of the columns of the continuum
+        :param list indexes: model indexes
+        :param list conts: 2D arrays (frequency x column) with the continuum of each model
+        :param dict previous_rows: only used by the "cube" format, see save_cont_cube()
+        """
+        if self.cont_format == "cube":
+            self.save_cont_cube(path, columns, indexes, conts, previous_rows=previous_rows)
+            return
+
+        save_path = path.parent.joinpath("cont.pkl")
+
+        # arrays coming back from worker processes are cast again so that the serialized
+        # output is identical to the one of a serial run
+        cont_dataframe = pd.DataFrame()
+        cont_dataframe["continuum"] = [pd.DataFrame(np.asarray(cont, dtype=np.float64), columns=columns)
+                                       for cont in conts]
+        cont_dataframe["index"] = [str(index) for index in indexes]
+        cont_dataframe["id"] = self.indexes_to_hashes(indexes)
+
+        cont_dataframe.to_pickle(save_path)
+        del cont_dataframe
+
+    def save_cont_cube(self, path: pathlib.PosixPath, columns: list, indexes: list, conts: list,
+                       previous_rows: dict = None):
+        """
+        Save the continuum of all models as a single dense array of shape
+        (models x photon energy x components) with one shared photon energy axis, since all models
+        share the same frequency grid. The arrays are saved in the CONT_CUBE_DIR directory next to the
+        "done" directory as .npy files, so they can be memory-mapped and sliced without loading
+        everything (see load_cont_cube()):
+            - continuum.npy: the cube, with dtype cont_dtype
+            - photon_energy.npy: the shared photon energy axis
+            - components.npy: names of the components (incident, transmitted, ...)
+            - models: table with the index and id of the model in each row of the cube (see save_table())
+
+        :param pathlib.PosixPath path: path to the "done" directory
+        :param list columns: names of the columns of the continuum
+        :param list indexes: model indexes
+        :param list conts: 2D arrays (frequency x column) with the continuum of each model
+        :param dict previous_rows: used by incremental parses. Maps the index of the models whose continuum
+                                   is None in conts to their row in the existing cube, which is copied over.
+        """
+        save_dir = path.parent.joinpath(CONT_CUBE_DIR)
+        save_dir.mkdir(exist_ok=True)
+
+        previous_cube = None
+        if previous_rows:
+            previous_cube, photon_energy, components, _ = load_cont_cube(path.parent)
+        else:
+            first_cont = next((cont for cont in conts if cont is not None), None)
+            photon_energy = np.empty(0) if first_cont is None else first_cont[:, columns.index("photon_energy")]
+            components = [column for column in columns if column != "photon_energy"]
+
+        if columns:
+            energy_column = columns.index("photon_energy")
+            component_columns = [columns.index(component) for component in components]
+
+        # the cube is written next to the existing one, which may still be read from, and then replaced
+        cube_path = save_dir.joinpath("continuum.npy")
+        tmp_path = save_dir.joinpath("continuum.tmp.npy")
+        shape = (len(conts), len(photon_energy), len(components))
+
+        if conts:
+            cube = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=self.cont_dtype, shape=shape)
+            for i, cont in enumerate(conts):
+                if cont is None:
+                    cube[i] = previous_cube[previous_rows[indexes[i]]]
+                    continue
+
+                if len(cont) != len(photon_energy) or not np.array_equal(cont[:, energy_column], photon_energy):
+                    raise ValueError(f"The continuum of model {indexes[i]} does not share the photon energy "
+                                     f"grid of the other models.")
+                cube[i] = cont[:, component_columns]
+            cube.flush()
+            del cube, previous_cube
+        else:
+            np.save(tmp_path, np.empty(shape, dtype=self.cont_dtype))
+
+        os.replace(tmp_path, cube_path)
+
+        np.save(save_dir.joinpath("photon_energy.npy"), np.asarray(photon_energy, dtype=np.float64))
+        np.save(save_dir.joinpath("components.npy"), np.array(components, dtype=str))
+
+        models = pd.DataFrame()
+        models["index"] = [str(index) for index in indexes]
+        models["id"] = self.indexes_to_hashes(indexes)
+        save_table(models, save_dir.joinpath("models"), self.output_format)
+
     def parse_cont(self, path:pathlib.PosixPath, N_models: int):
         """
         Given the path to "done" directory
@@ -358,29 +816,886 @@ class OutputParser(object):
         :param pathlib.PosixPath path: path to the e.g "done" directory
         :param int N_models: number of expected models in the sample
         """
-        save_path = path.parent.joinpath("cont.pkl")
-
-        cont_df, indexes, hashes, status = [], [], [], []
+        conts, indexes = [], []
 
         print('Parser: Parsing continuum data')
 
-        for item in tqdm(path.iterdir(), total=N_models):
+        for index, item in tqdm(self.list_model_dirs(path), total=N_models):
             cont_file = item.joinpath("model.cont")
-            index = str(cont_file.parent).split("/")[-1]
 
             # check if status_code of index model is "OK"
-            exit_code = self.status[self.status["index"] == index].status.values[0]
-            if (cont_file.exists()) and (exit_code == 0):
-                cont_dataframe = self.parse_cont_file(cont_file)
-
-                cont_df.append(cont_dataframe)
+            exit_code = self.status_codes.get(index, EXIT_STATUSES["DNR"])
+            if utils_output_exists(cont_file) and (exit_code == 0):
+                conts.append(self.parse_cont_file(cont_file).to_numpy())
                 indexes.append(index)
-                hashes.append(self.index_to_hash(int(index)))
-            
-        cont_dataframe = pd.DataFrame()
-        cont_dataframe["continuum"] = cont_df
-        cont_dataframe["index"] = indexes
-        cont_dataframe["id"] = hashes
 
-        cont_dataframe.to_pickle(save_path)
-        del cont_dataframe, cont_df, indexes, hashes
+        self.save_cont(path, self.cont_columns, indexes, conts)
+        del conts, indexes
+
+    def parse_model(self, path: pathlib.PosixPath):
+        """
+        Given the path to e.g "done/1234" directory, parse the run status
+        and, if the model was successful, the emission lines and the continuum of the model.
+        The results are returned as compact arrays rather than dataframes.
+
+        :param pathlib.PosixPath path: path to the e.g "done/1234" directory
+        :return (status_code, time, emis, cont): status code, execution time, outer-most zone(s) of the
+                 emission lines and continuum of the model. The last two are None if not available.
+        :rtype: tuple
+        """
+        # a single read of the model directory tells which output files are present
+        files = set(os.listdir(path))
+        emis, cont = None, None
+
+        if utils_output_exists(path.joinpath("model.out"), files):
+            status_code, time = self.read_status(path.joinpath("model.out"))
+        else:
+            status_code, time = EXIT_STATUSES["DNR"], np.nan
+
+        if status_code == EXIT_STATUSES["Success"]:
+            if utils_output_exists(path.joinpath("model.emis"), files):
+                emis = self.parse_emis_file(path.joinpath("model.emis")).to_numpy()
+
+            if utils_output_exists(path.joinpath("model.cont"), files):
+                cont = self.parse_cont_file(path.joinpath("model.cont")).to_numpy()
+
+        return status_code, time, emis, cont
+
+    def parse_model_to_store(self, path: pathlib.PosixPath, index: int):
+        """
+        Parse a single model of the "done" directory with parse_model() and append the record to the
+        result store of the sample, so parse(result_store=True) does not need to read its output files
+        again. Meant to be called by the QueueManager workers right after a model has finished.
+
+        :param pathlib.PosixPath path: path to the sample directory
+        :param int index: index of the model
+        """
+        model_dir = pathlib.Path(path, SAMPLE_SUBDIR_DONE, str(index))
+        entry = {"index": index,
+                 "record": self.parse_model(model_dir),
+                 "signature": self.model_signature(model_dir),
+                 "emis_columns": self.emis_columns,
+                 "cont_columns": self.cont_columns}
+        append_result_store(path, entry)
+
+    def load_records(self, path: pathlib.PosixPath, indexes: set):
+        """
+        Given the path to "done" directory, read the outputs of a previous parse back into
+        records, as returned by parse_model(), for the models in indexes. Used to merge the
+        models that did not change into the outputs of an incremental parse. With the "cube"
+        continuum format, the continuum of the records is None and the row of each model in
+        the existing cube is returned instead.
+
+        :param pathlib.PosixPath path: path to the "done" directory
+        :param set indexes: indexes of the models to read
+        :return (records, cube_rows): list of (index, status_code, time, emis, cont) tuples sorted by index,
+                 and the row of each model in the existing continuum cube (empty if not used)
+        :rtype: tuple
+        """
+        records = {}
+        status_df = load_table(path.parent.joinpath("status"))
+        for index, status_code, time in zip(status_df["index"], status_df["status"], status_df["time"]):
+            if int(index) in indexes:
+                records[int(index)] = [int(index), status_code, time, None, None]
+
+        # outputs are sorted by index, so the rows of each model are contiguous
+        emis_df = load_table(path.parent.joinpath("emis"))
+        emis_columns = [column for column in emis_df.columns if column not in ["index", "id"]]
+        self.emis_columns = self.emis_columns or emis_columns
+        emis_values = emis_df[emis_columns].to_numpy()
+        emis_indexes, starts, counts = np.unique(emis_df["index"].astype(int).to_numpy(),
+                                                 return_index=True, return_counts=True)
+        for index, start, count in zip(emis_indexes, starts, counts):
+            if index in records:
+                records[index][3] = emis_values[start:start + count]
+
+        cube_rows = {}
+        if self.cont_format == "cube":
+            models = load_table(path.parent.joinpath(CONT_CUBE_DIR, "models"), columns=["index"])
+            for row, index in enumerate(models["index"]):
+                if int(index) in records:
+                    cube_rows[int(index)] = row
+        else:
+            cont_df = pd.read_pickle(path.parent.joinpath("cont.pkl"))
+            for cont, index in zip(cont_df["continuum"], cont_df["index"]):
+                if int(index) in records:
+                    self.cont_columns = self.cont_columns or list(cont.columns)
+                    records[int(index)][4] = cont.to_numpy()
+
+        return [tuple(records[index]) for index in sorted(records)], cube_rows
+
+    def iter_records(self, model_dirs: list, n_workers: int = 1, chunk_size: int = None):
+        """
+        Parse the given model directories with parse_model() and yield the records in the same order.
+        If n_workers is larger than one, the model directories are split into contiguous chunks
+        parsed by a pool of n_workers processes, which return compact arrays. At most 2 * n_workers
+        chunks are submitted to the pool and not consumed yet, so the parsed records do not pile up
+        in memory when the consumer (e.g. parse_streaming()) is slower than the workers.
+
+        :param list model_dirs: list of (index, path) tuples of the models to parse
+        :param int n_workers: number of processes to use. Defaults to 1 (no process pool)
+        :param int chunk_size: number of models per chunk sent to the pool. Defaults to a quarter
+                               of the models of each worker
+        :return: generator of (index, status_code, time, emis, cont) tuples
+        :rtype: generator
+        """
+        if n_workers and n_workers > 1:
+            # contiguous chunks of models, several per worker to balance the load
+            if not chunk_size:
+                chunk_size = max(1, len(model_dirs) // (4 * n_workers))
+            chunks = [model_dirs[i:i+chunk_size] for i in range(0, len(model_dirs), chunk_size)]
+
+            print(f'Parser: Parsing {len(model_dirs)} models using {n_workers} processes')
+
+            worker = functools.partial(_parse_models_chunk, parser_kwargs=self.parser_kwargs())
+            with multiprocessing.Pool(processes=n_workers) as pool:
+                # the chunks are consumed in the order they are submitted, so the merge is deterministic
+                results = _imap_bounded(pool, worker, chunks, max_pending=2 * n_workers)
+                for chunk_records, emis_columns, cont_columns, malformed in tqdm(results, total=len(chunks)):
+                    self.emis_columns = emis_columns or self.emis_columns
+                    self.cont_columns = cont_columns or self.cont_columns
+                    self.emis_malformed_tokens.update(malformed)
+                    yield from chunk_records
+        else:
+            print(f'Parser: Parsing {len(model_dirs)} models')
+
+            for index, item in tqdm(model_dirs):
+                yield (index,) + self.parse_model(item)
+
+    def parse_fused(self, path: pathlib.PosixPath, n_workers: int = 1, manifest: dict = None,
+                    stored: dict = None, signatures: bool = False):
+        """
+        Given the path to "done" directory, walk it once and visit each model directory
+        a single time to parse the status, emission lines and continuum of the model, then
+        save the three tables. If n_workers is larger than one, the model directories are
+        split across a pool of n_workers processes. The workers return compact arrays which
+        are merged ordered by model index, so the outputs are the same as the ones of a serial run.
+        If the manifest of a previous parse is given, only the models that are new or whose
+        output files changed are parsed, and the rest are read back from the existing outputs.
+        Likewise, the models found unchanged in the result store written by the QueueManager workers
+        are not parsed again.
+
+        :param pathlib.PosixPath path: path to the "done" directory
+        :param int n_workers: number of processes to use. Defaults to 1 (no process pool)
+        :param dict manifest: manifest of the previous parse, see load_manifest(). Defaults to None (parse all)
+        :param dict stored: entries of the result store, see load_result_store(). Defaults to None
+        :param bool signatures: if True, return the signature of every model directory, e.g. to save the
+                                manifest of the parse. Always True with manifest or stored. Defaults to False
+        :return signatures: signature of every model directory, indexed by model index (see model_signature()),
+                            None if not computed
+        :rtype: dict
+        """
+        model_dirs = self.list_model_dirs(path)
+        if signatures or manifest or stored:
+            signatures = {index: self.model_signature(item) for index, item in model_dirs}
+        else:
+            signatures = None
+        records, cube_rows = [], {}
+
+        if manifest:
+            model_dirs = [(index, item) for index, item in model_dirs
+                          if manifest["models"].get(index) != signatures[index]]
+            unchanged = set(signatures) - set(index for index, _ in model_dirs)
+            records, cube_rows = self.load_records(path, unchanged)
+
+            print(f'Parser: {len(unchanged)} models unchanged since the last parse')
+
+        if stored:
+            for index in [index for index, _ in model_dirs
+                          if index in stored and stored[index]["signature"] == signatures[index]]:
+                self.emis_columns = stored[index]["emis_columns"] or self.emis_columns
+                self.cont_columns = stored[index]["cont_columns"] or self.cont_columns
+                records.append((index,) + stored[index]["record"])
+            model_dirs = [(index, item) for index, item in model_dirs
+                          if index not in stored or stored[index]["signature"] != signatures[index]]
+
+            print(f'Parser: {len(records)} models taken from the result store or the last parse')
+
+        records.extend(self.iter_records(model_dirs, n_workers=n_workers))
+
+        records.sort(key=lambda record: record[0])
+        self.save_status(path,
+                         [record[0] for record in records],
+                         [record[1] for record in records],
+                         [record[2] for record in records])
+
+        emis = [(record[0], record[3]) for record in records if record[3] is not None]
+        self.save_emis(path, self.emis_columns, [index for index, _ in emis], [rows for _, rows in emis])
+
+        cont = [(record[0], record[4]) for record in records if record[4] is not None or record[0] in cube_rows]
+        self.save_cont(path, self.cont_columns, [index for index, _ in cont], [values for _, values in cont],
+                       previous_rows=cube_rows)
+
+        return signatures
+
+
+    def parse_streaming(self, path: pathlib.PosixPath, max_memory_mb: float, n_workers: int = 1):
+        """
+        Given the path to "done" directory, parse all models like parse_fused() but write the results
+        to disk in blocks as the models are parsed, instead of keeping them in memory until the end.
+        Parsed records are buffered until they take max_memory_mb megabytes, then appended to the
+        status and emis tables ("npy" output format) and to the continuum cube, so the memory used
+        does not grow with the number of models. The outputs are the same as the ones of parse_fused(),
+        but the status table is not kept in memory (status and status_codes attributes).
+
+        :param pathlib.PosixPath path: path to the "done" directory
+        :param float max_memory_mb: size in megabytes of the parsed records kept in memory
+        :param int n_workers: number of processes to use. Defaults to 1 (no process pool)
+        """
+        model_dirs = self.list_model_dirs(path)
+
+        # fixed width of the string columns, known in advance for all blocks
+        index_dtype = f"<U{len(str(model_dirs[-1][0])) if model_dirs else 1}"
+        id_dtype = f"<U{max((len(model_id) for model_id in self.ids), default=1)}"
+
+        timeouts = self.load_timeouts(path.parent)
+        status_columns = ["index", "status", "id", "time"] + (["timeout"] if timeouts is not None else [])
+        status_writer = NpyTableWriter(path.parent.joinpath("status"), status_columns,
+                                       [index_dtype, np.int64, id_dtype, np.float64, np.float64][:len(status_columns)])
+        cube_dir = path.parent.joinpath(CONT_CUBE_DIR)
+        cube_dir.mkdir(exist_ok=True)
+        models_writer = NpyTableWriter(cube_dir.joinpath("models"), ["index", "id"], [index_dtype, id_dtype])
+
+        # created when the first successful model gives the columns of the emission lines and continuum
+        emis_writer, cube_writer, photon_energy = None, None, None
+
+        buffer, buffer_size = [], 0
+        max_buffer_size = max_memory_mb * 2**20
+
+        # small chunks, so that few parsed models are waiting in the process pool
+        records = self.iter_records(model_dirs, n_workers=n_workers, chunk_size=8)
+        for record in itertools.chain(records, [None]):
+            if record is not None:
+                buffer.append(record)
+                buffer_size += sum(array.nbytes for array in record[3:] if array is not None)
+                if buffer_size < max_buffer_size:
+                    continue
+
+            indexes = np.array([record[0] for record in buffer], dtype=np.int64)
+            status_block = {"index": indexes.astype(index_dtype),
+                            "status": np.array([record[1] for record in buffer], dtype=np.int64),
+                            "id": np.asarray(self.indexes_to_hashes(indexes), dtype=id_dtype),
+                            "time": np.array([record[2] for record in buffer], dtype=np.float64)}
+            if timeouts is not None:
+                status_block["timeout"] = np.array([timeouts.get(index, np.nan) for index in indexes],
+                                                   dtype=np.float64)
+            status_writer.append(status_block)
+
+            emis = [record for record in buffer if record[3] is not None]
+            if emis and emis_writer is None:
+                emis_writer = NpyTableWriter(path.parent.joinpath("emis"), self.emis_columns + ["index", "id"],
+                                             [np.float64] * len(self.emis_columns) + [index_dtype, id_dtype])
+            if emis:
+                rows = np.concatenate([record[3] for record in emis])
+                emis_indexes = np.repeat([record[0] for record in emis], [len(record[3]) for record in emis])
+                table = {column: rows[:, i] for i, column in enumerate(self.emis_columns)}
+                table["index"] = emis_indexes.astype(index_dtype)
+                table["id"] = np.asarray(self.indexes_to_hashes(emis_indexes), dtype=id_dtype)
+                emis_writer.append(table)
+
+            cont = [record for record in buffer if record[4] is not None]
+            if cont and cube_writer is None:
+                energy_column = self.cont_columns.index("photon_energy")
+                component_columns = [i for i in range(len(self.cont_columns)) if i != energy_column]
+                photon_energy = cont[0][4][:, energy_column]
+                cube_writer = NpyAppender(cube_dir.joinpath("continuum.tmp.npy"), self.cont_dtype,
+                                          (len(photon_energy), len(component_columns)))
+            for record in cont:
+                if len(record[4]) != len(photon_energy) or \
+                        not np.array_equal(record[4][:, energy_column], photon_energy):
+                    raise ValueError(f"The continuum of model {record[0]} does not share the photon energy "
+                                     f"grid of the other models.")
+                cube_writer.append(record[4][None, :, component_columns])
+            if cont:
+                cont_indexes = np.array([record[0] for record in cont], dtype=np.int64)
+                models_writer.append({"index": cont_indexes.astype(index_dtype),
+                                      "id": np.asarray(self.indexes_to_hashes(cont_indexes), dtype=id_dtype)})
+
+            buffer, buffer_size = [], 0
+
+        status_writer.close()
+        models_writer.close()
+
+        if emis_writer is None:
+            # no successful model, the table only has the index and id columns
+            emis_writer = NpyTableWriter(path.parent.joinpath("emis"), ["index", "id"], [index_dtype, id_dtype])
+        emis_writer.close()
+
+        if cube_writer is None:
+            photon_energy = np.empty(0)
+            np.save(cube_dir.joinpath("continuum.tmp.npy"), np.empty((0, 0, 0), dtype=self.cont_dtype))
+            components = []
+        else:
+            cube_writer.close()
+            components = [column for column in self.cont_columns if column != "photon_energy"]
+        os.replace(cube_dir.joinpath("continuum.tmp.npy"), cube_dir.joinpath("continuum.npy"))
+
+        np.save(cube_dir.joinpath("photon_energy.npy"), np.asarray(photon_energy, dtype=np.float64))
+        np.save(cube_dir.joinpath("components.npy"), np.array(components, dtype=str))
+
+
+    def read_ovr_file(self, path: pathlib.PosixPath):
+        """
+        Given the path to a model.ovr file, read the overview of the model (temperature,
+        densities and ionization structure of every zone) into a float array in a single pass.
+
+        :param pathlib.PosixPath path: path to the model.ovr file
+        :return (columns, values): list of column names and 2D float array (zones x columns)
+        :rtype: tuple
+        """
+        with utils_open_output(path) as f:
+            table = pd.read_csv(f, sep="\t", float_precision="round_trip")
+        table.rename(columns={"#depth": "depth"}, inplace=True)
+        return list(table.columns), table.to_numpy(dtype=np.float64)
+
+    def read_agents_file(self, path: pathlib.PosixPath):
+        """
+        Given the path to a model.heat or model.cool file, read the depth, temperature,
+        total heating and total cooling of every zone, and the labels and fractions of the
+        main heating (or cooling) agents of every zone. Continuation lines are skipped.
+
+        :param pathlib.PosixPath path: path to the model.heat or model.cool file
+        :return (values, agents): 2D float array (zones x [depth, temperature, heating, cooling])
+                 and list with the (label, fraction) pairs of every zone
+        :rtype: tuple
+        """
+        with utils_open_output(path) as f:
+            f.readline()
+            # zones start with the depth, continuation lines start with spaces
+            zones = [line.rstrip("\n").split("\t") for line in f if line[:1].isdigit()]
+
+        values = np.array([fields[:4] for fields in zones], dtype=np.float64).reshape(-1, 4)
+        agents = [[(fields[i].strip(), float(fields[i+1])) for i in range(4, len(fields) - 1, 2)]
+                  for fields in zones]
+
+        return values, agents
+
+    def summarize_agents(self, values: np.ndarray, agents: list, total_column: int):
+        """
+        Summarize the heating (or cooling) of a model: value at the last zone, integral over
+        the depth, and the agent contributing the largest fraction of the integrated value.
+
+        :param numpy.ndarray values: 2D float array as returned by read_agents_file()
+        :param list agents: list of (label, fraction) pairs of every zone as returned by read_agents_file()
+        :param int total_column: column of values to summarize, 2 for heating and 3 for cooling
+        :return (summary, main_agent): float array [temperature, last value, integrated value,
+                 fraction of the main agent] and label of the main agent
+        :rtype: tuple
+        """
+        if len(values) == 0:
+            return np.full(4, np.nan), ""
+
+        depth, total = values[:, 0], values[:, total_column]
+        widths = np.gradient(depth) if len(depth) > 1 else np.ones(1)
+        integrated = np.sum(total * widths)
+
+        contributions = {}
+        for zone_agents, zone_total in zip(agents, total * widths):
+            for label, fraction in zone_agents:
+                contributions[label] = contributions.get(label, 0.) + fraction * zone_total
+        main_agent = max(contributions, key=contributions.get) if contributions else ""
+        main_fraction = contributions[main_agent] / integrated if contributions and integrated else np.nan
+
+        return np.array([values[-1, 1], total[-1], integrated, main_fraction]), main_agent
+
+    def summarize_ovr(self, columns: list, values: np.ndarray):
+        """
+        Summarize the overview of a model: number of zones, total depth, and for every column
+        its value at the last zone and its mean weighted by depth.
+
+        :param list columns: names of the columns as returned by read_ovr_file()
+        :param numpy.ndarray values: 2D float array as returned by read_ovr_file()
+        :return (summary_columns, summary): names and values of the summary
+        :rtype: tuple
+        """
+        depth = values[:, 0]
+        profile = values[:, 1:]
+
+        if len(depth) > 1:
+            mean = _trapezoid(profile, depth, axis=0) / (depth[-1] - depth[0])
+        else:
+            mean = profile[-1] if len(profile) else np.full(len(columns) - 1, np.nan)
+        last = profile[-1] if len(profile) else np.full(len(columns) - 1, np.nan)
+
+        summary_columns = ["n_zones", "depth"] + [f"{column}_last" for column in columns[1:]] + \
+                          [f"{column}_mean" for column in columns[1:]]
+        summary = np.concatenate([[len(depth), depth[-1] if len(depth) else np.nan], last, mean])
+
+        return summary_columns, summary
+
+    def read_opd_file(self, path: pathlib.PosixPath):
+        """
+        Given the path to a model.opd file, read the total, absorption and scattering
+        optical depths at every photon energy into a float array.
+
+        :param pathlib.PosixPath path: path to the model.opd file
+        :return (columns, values): list of column names and 2D float array (photon energy x columns)
+        :rtype: tuple
+        """
+        with utils_open_output(path) as f:
+            table = pd.read_csv(f, sep="\t", float_precision="round_trip")
+        table.rename(columns={"#energy/Ryd": "photon_energy"}, inplace=True)
+        return list(table.columns), table.to_numpy(dtype=np.float64)
+
+    def parse_structure_model(self, path: pathlib.PosixPath):
+        """
+        Given the path to e.g "done/1234" directory of a successful model, parse the
+        overview, heating, cooling and optical depth files that are present into compact arrays.
+
+        :param pathlib.PosixPath path: path to the e.g "done/1234" directory
+        :return structure: dictionary with the "ovr" summary ((columns, values) tuple), the "heat" and "cool"
+                           summaries ((values, label) tuples) and the "opd" (columns, values) tuple, for the files present
+        :rtype: dict
+        """
+        files = set(os.listdir(path))
+        structure = {}
+
+        if utils_output_exists(path.joinpath("model.ovr"), files):
+            structure["ovr"] = self.summarize_ovr(*self.read_ovr_file(path.joinpath("model.ovr")))
+
+        if utils_output_exists(path.joinpath("model.heat"), files):
+            structure["heat"] = self.summarize_agents(*self.read_agents_file(path.joinpath("model.heat")), 2)
+
+        if utils_output_exists(path.joinpath("model.cool"), files):
+            structure["cool"] = self.summarize_agents(*self.read_agents_file(path.joinpath("model.cool")), 3)
+
+        if utils_output_exists(path.joinpath("model.opd"), files):
+            structure["opd"] = self.read_opd_file(path.joinpath("model.opd"))
+
+        return structure
+
+    def iter_structure(self, model_dirs: list, n_workers: int = 1):
+        """
+        Parse the overview, heating, cooling and optical depth files of the given models, see
+        parse_structure_model(). With several workers, small chunks of models are parsed by a process
+        pool, with at most a few chunks parsed ahead of the consumer (see _imap_bounded()).
+
+        :param list model_dirs: list of (index, path) tuples of the models to parse
+        :param int n_workers: number of processes to use. Defaults to 1 (no process pool)
+        :return: generator of (index, structure) tuples, in the order of model_dirs
+        :rtype: generator
+        """
+        if n_workers and n_workers > 1:
+            chunk_size = max(1, min(len(model_dirs) // (4 * n_workers), 8))
+            chunks = [model_dirs[i:i+chunk_size] for i in range(0, len(model_dirs), chunk_size)]
+
+            worker = functools.partial(_parse_structure_chunk, parser_kwargs=self.parser_kwargs())
+            with multiprocessing.Pool(processes=n_workers) as pool:
+                for chunk in _imap_bounded(pool, worker, chunks, max_pending=2 * n_workers):
+                    yield from chunk
+        else:
+            for index, item in model_dirs:
+                yield index, self.parse_structure_model(item)
+
+    def parse_structure(self, path: pathlib.PosixPath, n_workers: int = 1):
+        """
+        Given the path to "done" directory, parse the overview (.ovr), heating (.heat), cooling (.cool)
+        and optical depth (.opd) files of all successful models, and save them next to the "done" directory:
+            - ovr: table with the number of zones, total depth and, for every overview column
+              (temperature, densities, ionization fractions, ...), its last zone value and depth-weighted mean
+            - heat, cool: tables with the temperature, last zone and depth-integrated total heating (cooling),
+              and the agent contributing most to the integrated heating (cooling) and its fraction
+            - OPD_CUBE_DIR: dense array of the optical depths (models x photon energy x [total, absorp, scat]),
+              written as it is parsed, with the same layout as the continuum cube (see load_opd_cube())
+        The successful models are taken from the status table of the sample.
+
+        :param pathlib.PosixPath path: path to the "done" directory
+        :param int n_workers: number of processes to use. Defaults to 1 (no process pool)
+        """
+        status_df = load_table(path.parent.joinpath("status"), columns=["index", "status"])
+        successful = set(status_df["index"][status_df["status"] == EXIT_STATUSES["Success"]].astype(int))
+        model_dirs = [(index, item) for index, item in self.list_model_dirs(path) if index in successful]
+
+        print('Parser: Parsing overview, heating, cooling and optical depth data')
+
+        ovr, heat, cool, opd_indexes = [], [], [], []
+        ovr_columns = []
+        opd_dir = path.parent.joinpath(OPD_CUBE_DIR)
+        opd_dir.mkdir(exist_ok=True)
+        opd_tmp_path = opd_dir.joinpath("optical_depth.tmp.npy")
+        opd_writer, photon_energy = None, np.empty(0)
+
+        results = self.iter_structure(model_dirs, n_workers=n_workers)
+        try:
+            for index, structure in tqdm(results, total=len(model_dirs)):
+                if "ovr" in structure:
+                    ovr_columns, values = structure["ovr"]
+                    ovr.append((index, values))
+                if "heat" in structure:
+                    heat.append((index,) + structure["heat"])
+                if "cool" in structure:
+                    cool.append((index,) + structure["cool"])
+
+                if "opd" in structure:
+                    self.opd_columns, values = structure["opd"]
+                    if opd_writer is None:
+                        photon_energy = values[:, 0]
+                        opd_writer = NpyAppender(opd_tmp_path, self.cont_dtype,
+                                                 (len(photon_energy), values.shape[1] - 1))
+                    if len(values) != len(photon_energy) or not np.array_equal(values[:, 0], photon_energy):
+                        raise ValueError(f"The optical depth of model {index} does not share the photon energy "
+                                         f"grid of the other models.")
+                    opd_writer.append(values[None, :, 1:])
+                    opd_indexes.append(index)
+
+            # optical depth cube
+            if opd_writer is None:
+                np.save(opd_tmp_path, np.empty((0, 0, 0), dtype=self.cont_dtype))
+                components = []
+            else:
+                opd_writer.close()
+                components = self.opd_columns[1:]
+            os.replace(opd_tmp_path, opd_dir.joinpath("optical_depth.npy"))
+        finally:
+            # stop the process pool, and remove the partial cube if the parse failed
+            results.close()
+            if opd_tmp_path.exists():
+                if opd_writer is not None:
+                    opd_writer.file.close()
+                opd_tmp_path.unlink()
+
+        # summary tables
+        ovr_df = pd.DataFrame(np.array([values for _, values in ovr]).reshape(len(ovr), len(ovr_columns)),
+                              columns=ovr_columns)
+        ovr_df["index"] = [str(index) for index, _ in ovr]
+        ovr_df["id"] = self.indexes_to_hashes([index for index, _ in ovr])
+        save_table(ovr_df, path.parent.joinpath("ovr"), self.output_format)
+
+        for name, agents in [("heat", heat), ("cool", cool)]:
+            total = "heating" if name == "heat" else "cooling"
+            agents_df = pd.DataFrame(np.array([values for _, values, _ in agents]).reshape(-1, 4),
+                                     columns=["temperature_last", f"{total}_last", f"{total}_integrated",
+                                              "main_agent_fraction"])
+            agents_df["main_agent"] = [label for _, _, label in agents]
+            agents_df["index"] = [str(index) for index, _, _ in agents]
+            agents_df["id"] = self.indexes_to_hashes([index for index, _, _ in agents])
+            save_table(agents_df, path.parent.joinpath(name), self.output_format)
+
+        np.save(opd_dir.joinpath("photon_energy.npy"), np.asarray(photon_energy, dtype=np.float64))
+        np.save(opd_dir.joinpath("components.npy"), np.array(components, dtype=str))
+
+        models = pd.DataFrame()
+        models["index"] = [str(index) for index in opd_indexes]
+        models["id"] = self.indexes_to_hashes(opd_indexes)
+        save_table(models, opd_dir.joinpath("models"), self.output_format)
+
+
+def _imap_bounded(pool: multiprocessing.pool.Pool, func, iterable, max_pending: int):
+    """
+    Like pool.imap(), but with at most max_pending tasks submitted to the pool and not consumed yet.
+    pool.imap() submits all the tasks at once and keeps their results until they are consumed, so
+    a slow consumer lets the results of the whole iterable pile up in memory.
+
+    :param multiprocessing.pool.Pool pool: process pool
+    :param func: function applied to every item
+    :param iterable: items
+    :param int max_pending: maximum number of tasks submitted and not consumed yet
+    :return: generator of the results, in the order of the items
+    :rtype: generator
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
+
+
+def _parse_models_chunk(model_dirs: list, parser_kwargs: dict = None):
+    """
+    Worker of the process pool used by OutputParser.parse_fused(). Parses a chunk
+    of model directories and returns the results as compact arrays.
+
+    :param list model_dirs: list of (index, path) tuples of the models to parse
+    :param dict parser_kwargs: settings of the parser, see OutputParser.parser_kwargs()
+    :return (records, emis_columns, cont_columns, malformed): list of (index, status_code, time, emis, cont)
+             tuples, column names of the emission lines and continuum, and malformed tokens per model.emis file
+    :rtype: tuple
+    """
+    parser = OutputParser(**(parser_kwargs or {}))
+
+    records = []
+    for index, path in model_dirs:
+        records.append((index,) + parser.parse_model(path))
+
+    return records, parser.emis_columns, parser.cont_columns, parser.emis_malformed_tokens
+
+
+def append_result_store(path: pathlib.PosixPath, entry: dict):
+    """
+    Append an entry to the result store of a sample, a stream of pickled entries in a single file.
+    The file is locked during the write, so several processes can append to it at the same time.
+
+    :param pathlib.PosixPath path: path to the sample directory
+    :param dict entry: entry to append, see OutputParser.parse_model_to_store()
+    """
+    data = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+
+    with open(pathlib.Path(path, RESULT_STORE_FILE), "ab") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.write(data)
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_result_store(path: pathlib.PosixPath):
+    """
+    Load the entries of the result store of a sample. An entry cut short (e.g. by a crash during
+    the write) ends the store, and later entries of the same model replace earlier ones.
+
+    :param pathlib.PosixPath path: path to the sample directory
+    :return stored: entries indexed by model index, empty if there is no store
+    :rtype: dict
+    """
+    stored = {}
+    store_path = pathlib.Path(path, RESULT_STORE_FILE)
+    if not store_path.exists():
+        return stored
+
+    with open(store_path, "rb") as f:
+        while True:
+            try:
+                entry = pickle.load(f)
+            except (EOFError, pickle.UnpicklingError):
+                break
+            stored[entry["index"]] = entry
+
+    return stored
+
+
+def _parse_structure_chunk(model_dirs: list, parser_kwargs: dict = None):
+    """
+    Worker of the process pool used by OutputParser.iter_structure(). Parses the overview,
+    heating, cooling and optical depth files of a chunk of model directories.
+
+    :param list model_dirs: list of (index, path) tuples of the models to parse
+    :param dict parser_kwargs: settings of the parser, see OutputParser.parser_kwargs()
+    :return records: list of (index, structure) tuples, see OutputParser.parse_structure_model()
+    :rtype: list
+    """
+    parser = OutputParser(**(parser_kwargs or {}))
+    return [(index, parser.parse_structure_model(path)) for index, path in model_dirs]
+
+
+def load_cont_cube(path: str, mmap_mode: str = "r"):
+    """
+    Load the continuum cube saved by OutputParser(cont_format="cube") from a sample directory.
+    By default the cube is memory-mapped, so slicing it only reads the requested models from disk.
+
+    :param str path: path to the sample directory, e.g "sample_N100/"
+    :param str mmap_mode: memory-map mode passed to numpy.load(), None loads the whole cube in memory
+    :return (continuum, photon_energy, components, models): cube of shape (models x photon energy x components),
+             photon energy axis, names of the components and dataframe with the index and id of each model
+    :rtype: tuple
+    """
+    return _load_cube(pathlib.Path(path).joinpath(CONT_CUBE_DIR), "continuum.npy", mmap_mode)
+
+
+def load_opd_cube(path: str, mmap_mode: str = "r"):
+    """
+    Load the optical depth cube saved by OutputParser.parse_structure() from a sample directory.
+    By default the cube is memory-mapped, so slicing it only reads the requested models from disk.
+
+    :param str path: path to the sample directory, e.g "sample_N100/"
+    :param str mmap_mode: memory-map mode passed to numpy.load(), None loads the whole cube in memory
+    :return (optical_depth, photon_energy, components, models): cube of shape (models x photon energy x
+             components), photon energy axis, names of the components and dataframe with the index and id of each model
+    :rtype: tuple
+    """
+    return _load_cube(pathlib.Path(path).joinpath(OPD_CUBE_DIR), "optical_depth.npy", mmap_mode)
+
+
+def _load_cube(cube_dir: pathlib.PosixPath, cube_file: str, mmap_mode: str):
+    values = np.load(cube_dir.joinpath(cube_file), mmap_mode=mmap_mode)
+    photon_energy = np.load(cube_dir.joinpath("photon_energy.npy"))
+    components = np.load(cube_dir.joinpath("components.npy")).tolist()
+    models = load_table(cube_dir.joinpath("models"))
+
+    return values, photon_energy, components, models
+
+
+def save_table(table: pd.DataFrame, path: pathlib.PosixPath, output_format: str = "pickle"):
+    """
+    Save a table of parsed results. With the "pickle" format the dataframe is serialized
+    as a whole into path + ".pkl". With the "npy" format the table is saved column by column
+    in the path directory: one .npy file per column, named after its position, and columns.npy
+    with the names of the columns. String columns are saved as fixed-width unicode arrays, so
+    no column needs pickle to be read and numeric columns can be memory-mapped (see load_table()).
+
+    :param pandas.DataFrame table: table to save
+    :param pathlib.PosixPath path: path of the table without extension, e.g "sample_N100/status"
+    :param str output_format: "pickle" or "npy". Defaults to "pickle".
+    """
+    path = pathlib.Path(path)
+    pickle_path = path.parent.joinpath(path.name + ".pkl")
+
+    if output_format == "pickle":
+        table.to_pickle(pickle_path)
+
+        # remove the table saved in the other format, so it is not read instead
+        if path.joinpath("columns.npy").exists():
+            shutil.rmtree(path)
+        return
+
+    # write the columns next to the existing table, then replace it
+    tmp_dir = path.parent.joinpath(path.name + ".tmp")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir()
+
+    for position, column in enumerate(table.columns):
+        values = table[column].to_numpy()
+        if not np.issubdtype(values.dtype, np.number):
+            values = values.astype(str)
+        np.save(tmp_dir.joinpath(f"{position}.npy"), values)
+    np.save(tmp_dir.joinpath("columns.npy"), np.array(list(table.columns), dtype=str))
+
+    if path.exists():
+        shutil.rmtree(path)
+    os.replace(tmp_dir, path)
+
+    if pickle_path.exists():
+        os.remove(pickle_path)
+
+
+def table_exists(path: pathlib.PosixPath):
+    """
+    Check if a table saved with save_table() exists, in any of the output formats.
+
+    :param pathlib.PosixPath path: path of the table without extension, e.g "sample_N100/status"
+    :return: True if the table exists
+    :rtype: bool
+    """
+    path = pathlib.Path(path)
+    return path.joinpath("columns.npy").exists() or path.parent.joinpath(path.name + ".pkl").exists()
+
+
+def load_table(path: pathlib.PosixPath, columns: list = None, mmap_mode: str = None):
+    """
+    Load a table saved with save_table(), in any of the output formats. With the "npy" format
+    only the requested columns are read from disk.
+
+    :param pathlib.PosixPath path: path of the table without extension, e.g "sample_N100/emis"
+    :param list columns: names of the columns to load. Defaults to None (all columns)
+    :param str mmap_mode: memory-map mode passed to numpy.load() for the "npy" format. Defaults to None
+    :return table: the loaded table
+    :rtype: pandas.DataFrame
+    """
+    path = pathlib.Path(path)
+
+    if not path.joinpath("columns.npy").exists():
+        table = pd.read_pickle(path.parent.joinpath(path.name + ".pkl"))
+        return table if columns is None else table[columns]
+
+    all_columns = np.load(path.joinpath("columns.npy")).tolist()
+    if columns is None:
+        columns = all_columns
+
+    table = {}
+    for column in columns:
+        if column not in all_columns:
+            raise KeyError(f"Column {column} not found in table {path}.")
+        table[column] = np.load(path.joinpath(f"{all_columns.index(column)}.npy"), mmap_mode=mmap_mode)
+
+    return pd.DataFrame(table, columns=columns)
+
+
+class NpyAppender(object):
+    """ Writes a .npy file one block of rows at a time, so arrays larger than the memory can be saved.
+    The header is written with a fixed size and rewritten with the final shape when the file is closed.
+
+    :param pathlib.PosixPath path: path of the .npy file to write
+    :param str dtype: dtype of the array
+    :param tuple row_shape: shape of each row of the array. Defaults to () (1D array)
+    """
+    HEADER_SIZE = 128
+
+    def __init__(self, path: pathlib.PosixPath, dtype: str, row_shape: tuple = ()):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.n_rows = 0
+
+        self.file = open(path, "wb")
+        self._write_header()
+
+    def _write_header(self):
+        header = {"descr": np.lib.format.dtype_to_descr(self.dtype),
+                  "fortran_order": False,
+                  "shape": (self.n_rows,) + self.row_shape}
+        header = repr(header).encode("latin1")
+
+        # magic string (6 bytes), version (2 bytes), header length (2 bytes), header padded with spaces + newline
+        header_length = self.HEADER_SIZE - 10
+        assert len(header) < header_length, f"Header of {self.path} does not fit in {self.HEADER_SIZE} bytes."
+        header = header.ljust(header_length - 1) + b"\n"
+
+        self.file.seek(0)
+        self.file.write(np.lib.format.magic(1, 0) + header_length.to_bytes(2, "little") + header)
+        self.file.seek(0, os.SEEK_END)
+
+    def append(self, rows: np.ndarray):
+        """
+        Append a block of rows at the end of the file.
+
+        :param numpy.ndarray rows: array of shape (n, *row_shape)
+        """
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        assert rows.shape[1:] == self.row_shape, f"Rows of shape {rows.shape[1:]} can not be appended to {self.path}."
+
+        self.file.write(rows.tobytes())
+        self.n_rows += len(rows)
+
+    def close(self):
+        """ Write the final shape of the array in the header and close the file. """
+        self._write_header()
+        self.file.close()
+
+
+class NpyTableWriter(object):
+    """ Writes a table with the "npy" layout of save_table() in blocks of rows, so tables larger
+    than the memory can be saved. The columns are written into a temporary directory which replaces
+    the table when the writer is closed.
+
+    :param pathlib.PosixPath path: path of the table without extension, e.g "sample_N100/status"
+    :param list columns: names of the columns
+    :param list dtypes: dtype of each column, string columns need a fixed width (e.g "<U32")
+    """
+    def __init__(self, path: pathlib.PosixPath, columns: list, dtypes: list):
+        self.path = pathlib.Path(path)
+        self.columns = list(columns)
+
+        self.tmp_dir = self.path.parent.joinpath(self.path.name + ".tmp")
+        if self.tmp_dir.exists():
+            shutil.rmtree(self.tmp_dir)
+        self.tmp_dir.mkdir()
+
+        self.appenders = [NpyAppender(self.tmp_dir.joinpath(f"{position}.npy"), dtype)
+                          for position, dtype in enumerate(dtypes)]
+
+    def append(self, table: dict):
+        """
+        Append a block of rows to the table.
+
+        :param dict table: 1D arrays of the same length, one per column, indexed by column name
+        """
+        for column, appender in zip(self.columns, self.appenders):
+            appender.append(table[column])
+
+    def close(self):
+        """ Finish the files of all columns and replace the table. """
+        for appender in self.appenders:
+            appender.close()
+        np.save(self.tmp_dir.joinpath("columns.npy"), np.array(self.columns, dtype=str))
+
+        if self.path.exists():
+            shutil.rmtree(self.path)
+        os.replace(self.tmp_dir, self.path)
+
+        pickle_path = self.path.parent.joinpath(self.path.name + ".pkl")
+        if pickle_path.exists():
+            os.remove(pickle_path)
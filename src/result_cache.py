@@ -0,0 +1,222 @@
+import os
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import pathlib
+import contextlib
+
+from common.settings import CLOUDY_IN_FILE, RUN_CLAIM_FILE, RESULT_CACHE_SIZE_FILE
+
+
+class ResultCache(object):
+    """
+    Content-addressed cache of the outputs of successful Cloudy runs, shared by all samples, so a model whose
+    model.in is identical to one that already ran is not run again, e.g. when a sample is regenerated with the
+    same RANDOM_SEED or when the grids of two campaigns overlap.
+
+    The key of a model is the SHA-256 hash of its normalized model.in, which contains the line list and the
+    BPASS model file (see CloudyInput), and of the Cloudy executable (path, size and modification time, so a
+    new Cloudy build invalidates the cache). Every result is a directory <key[:2]>/<key>/ with the output files
+    of the model. Files are hard linked, or copied across filesystems, into and out of the cache.
+
+    The modification time of a result is updated on every hit, and the least recently used results are evicted
+    when the cache grows beyond max_size_gb. The total size of the results is kept up to date in the
+    RESULT_CACHE_SIZE_FILE of the cache, so the cache is only scanned when it is created and when results are evicted.
+
+    :param str path: path to the cache directory
+    :param float max_size_gb: maximum size of the cache in GB
+    :param list cloudy_cmd: Cloudy executable and its options, see QueueManager
+    """
+
+    def __init__(self, path: str, max_size_gb: float, cloudy_cmd: list):
+        self.path = pathlib.Path(os.path.expanduser(path))
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size_gb * 1024 ** 3
+
+        executable = shutil.which(cloudy_cmd[0]) or cloudy_cmd[0]
+        try:
+            stat = os.stat(executable)
+            signature = (os.path.realpath(executable), stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            signature = (executable,)
+        self.cloudy_signature = repr((signature, cloudy_cmd[1:])).encode()
+
+        # record the size of the results, if not done yet
+        with self._lock_size() as f:
+            self._write_size(f, self._read_size(f))
+
+    def key(self, in_file: str):
+        """
+        Key of a model: hash of its normalized model.in and of the Cloudy executable. The lines of model.in are
+        stripped, and blank and comment lines are dropped, so formatting changes do not invalidate the cache.
+
+        :param str in_file: path to the model.in file
+        :return key: hexadecimal digest
+        :rtype: str
+        """
+        digest = hashlib.sha256(self.cloudy_signature)
+
+        with open(in_file, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith(("#", "//", "%")):
+                    digest.update(line.encode() + b"\n")
+
+        return digest.hexdigest()
+
+    def _entry(self, key: str):
+        """
+        Directory of the result of a key.
+        """
+        return self.path.joinpath(key[:2], key)
+
+    def fetch(self, key: str, model_dir: str):
+        """
+        Link the cached outputs of a model into its directory.
+
+        :param str key: key of the model, see key()
+        :param str model_dir: path of the model directory
+        :return: True on a hit, False if the model is not in the cache
+        :rtype: bool
+        """
+        entry = self._entry(key)
+        linked = []
+        try:
+            for item in entry.iterdir():
+                target = os.path.join(model_dir, item.name)
+                self._link(item, target)
+                linked.append(target)
+            os.utime(entry)
+        except FileNotFoundError:
+            # not cached, or evicted meanwhile
+            for target in linked:
+                os.remove(target)
+            return False
+
+        return True
+
+    def store(self, key: str, model_dir: str):
+        """
+        Add the outputs of a successful model to the cache, then evict the least recently used results if the
+        cache is too large (see evict()). The result is assembled in a temporary directory and renamed into place,
+        so the samples sharing the cache never see a partial result.
+
+        :param str key: key of the model, see key()
+        :param str model_dir: path of the model directory
+        """
+        entry = self._entry(key)
+        if entry.exists():
+            return
+
+        entry.parent.mkdir(exist_ok=True)
+        tmp_entry = pathlib.Path(tempfile.mkdtemp(prefix=f"{key}.tmp.", dir=entry.parent))
+
+        size = 0
+        for item in pathlib.Path(model_dir).iterdir():
+            if item.name not in [CLOUDY_IN_FILE, RUN_CLAIM_FILE]:
+                self._link(item, tmp_entry.joinpath(item.name))
+                size += item.stat().st_size
+
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # cached meanwhile by another worker
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+
+        with self._lock_size() as f:
+            total = self._read_size(f) + size
+            if total > self.max_size:
+                total = self._evict()
+            self._write_size(f, total)
+
+    def evict(self, low_water: float = 0.9):
+        """
+        Remove the least recently used results until the cache is within low_water times max_size_gb, so it is
+        not scanned again by the next results stored, and record the size of the remaining results.
+
+        :param float low_water: fraction of max_size_gb the cache is brought back to. Defaults to 0.9
+        :return total: size of the remaining results in bytes
+        :rtype: int
+        """
+        with self._lock_size() as f:
+            total = self._evict(low_water)
+            self._write_size(f, total)
+        return total
+
+    def _evict(self, low_water: float = 0.9):
+        """
+        Remove the least recently used results, see evict(). The RESULT_CACHE_SIZE_FILE must be locked.
+        """
+        entries = self._scan()
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, entry in sorted(entries):
+            if total <= low_water * self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+        return total
+
+    def _scan(self):
+        """
+        List the results of the cache.
+
+        :return entries: list of (modification time, size in bytes, directory) tuples
+        :rtype: list
+        """
+        entries = []
+        for entry in self.path.glob("*/*"):
+            if ".tmp." in entry.name:
+                continue
+            try:
+                size = sum(item.stat().st_size for item in entry.iterdir())
+                entries.append((entry.stat().st_mtime, size, entry))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    @contextlib.contextmanager
+    def _lock_size(self):
+        """
+        Lock the RESULT_CACHE_SIZE_FILE of the cache, shared by all the workers and samples using it, and
+        yield it, open for reading and writing.
+        """
+        with open(self.path.joinpath(RESULT_CACHE_SIZE_FILE), "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                yield f
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_size(self, f):
+        """
+        Total size of the results recorded in the locked RESULT_CACHE_SIZE_FILE, the results are scanned if it
+        is not recorded yet.
+        """
+        try:
+            return int(f.read())
+        except ValueError:
+            return sum(size for _, size, _ in self._scan())
+
+    @staticmethod
+    def _write_size(f, total):
+        """
+        Record the total size of the results in the locked RESULT_CACHE_SIZE_FILE.
+        """
+        f.seek(0)
+        f.truncate()
+        f.write(f"{total}\n")
+
+    @staticmethod
+    def _link(source, target):
+        try:
+            os.link(source, target)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            # different filesystems, or hard links not supported
+            shutil.copy2(source, target)
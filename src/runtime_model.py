@@ -0,0 +1,181 @@
+import numpy as np
+
+from common.settings import EXIT_STATUSES, INPUT_PARAMETER_NAMES
+from common.utils import utils_get_parameter_file
+from src.parser import load_table, table_exists
+from user_settings import CLOUDY_RUN_TIMEOUT
+
+
+class RuntimePredictor(object):
+    """
+    Cheap model of the Cloudy run time of a model as a function of its input parameters, fit on
+    the execution times (ExecTime) recorded in the status tables of previously parsed samples.
+    The logarithm of the run time is fit by least squares with a quadratic polynomial of the
+    standardized input parameters (no cross terms), so fitting and predicting take milliseconds.
+
+    Models that did not finish in time (DNF) only tell that their run time is longer than their time
+    out (the per-model time out recorded in the status table, or CLOUDY_RUN_TIMEOUT): they are fit as
+    censored run times, so the predictor still learns which regions of the parameter space run long,
+    but they are left out of the spread of the run times used by predict_quantile().
+
+    :param float ridge: regularization of the least squares fit. Defaults to 1e-3.
+    :param int neighbours: number of past finished models, nearest in input parameters, from which
+                           predict_quantile() takes the spread of the run times. Defaults to 50.
+    """
+
+    def __init__(self, ridge: float = 1e-3, neighbours: int = 50):
+        self.ridge = ridge
+        self.neighbours = neighbours
+        self.coefficients = None
+
+    def load_history(self, sample_dirs: list):
+        """
+        Collect the input parameters and run times of the models of previously parsed samples.
+        Samples without a status table or a parameter file are skipped.
+
+        :param list sample_dirs: paths of the sample directories, e.g ["sample_N100/", "sample_N1000/"]
+        :return (parameters, times, finished): 2D array of input parameters, array of run times in seconds
+                                               and boolean array, False for the models that did not finish
+                                               in time, whose run time is their time out
+        :rtype: tuple
+        """
+        parameters, times, finished = [], [], []
+
+        for sample_dir in sample_dirs:
+            parameter_file = utils_get_parameter_file(sample_dir)
+            if parameter_file is None or not table_exists(f"{sample_dir}/status"):
+                continue
+
+            try:
+                # samples run with per-model time outs record them in the status table
+                status_df = load_table(f"{sample_dir}/status", columns=["index", "status", "time", "timeout"])
+                timeout = status_df["timeout"].to_numpy(dtype=np.float64, copy=True)
+                timeout[np.isnan(timeout)] = CLOUDY_RUN_TIMEOUT
+            except KeyError:
+                status_df = load_table(f"{sample_dir}/status", columns=["index", "status", "time"])
+                timeout = np.full(len(status_df), CLOUDY_RUN_TIMEOUT, dtype=np.float64)
+
+            time = status_df["time"].to_numpy(dtype=np.float64, copy=True)
+            dnf = status_df["status"].to_numpy() == EXIT_STATUSES["DNF"]
+            time[dnf] = timeout[dnf]
+
+            valid = np.isfinite(time) & (time > 0)
+            parameters.append(np.load(parameter_file)[status_df["index"].astype(int).to_numpy()[valid]])
+            times.append(time[valid])
+            finished.append(~dnf[valid])
+
+        if not parameters:
+            return np.empty((0, len(INPUT_PARAMETER_NAMES))), np.empty(0), np.empty(0, dtype=bool)
+
+        return np.concatenate(parameters), np.concatenate(times), np.concatenate(finished)
+
+    def features(self, parameters: np.ndarray):
+        """
+        Polynomial features of the input parameters: constant, standardized parameters and their squares.
+
+        :param numpy.ndarray parameters: 2D array of input parameters (models x parameters)
+        :return features: 2D array (models x features)
+        :rtype: numpy.ndarray
+        """
+        scaled = (np.asarray(parameters, dtype=np.float64) - self.mean) / self.std
+        return np.hstack([np.ones((len(scaled), 1)), scaled, np.square(scaled)])
+
+    def fit(self, parameters: np.ndarray, times: np.ndarray, finished: np.ndarray = None, max_iterations: int = 50):
+        """
+        Fit the predictor on the run times of past models. The run times of the models that did not
+        finish are censored: they are replaced by their expected value given that they are longer
+        than the time out, estimated from the residuals of the finished models (Buckley-James), and
+        the fit is repeated until these estimates settle.
+
+        :param numpy.ndarray parameters: 2D array of input parameters (models x parameters)
+        :param numpy.ndarray times: run times of the models in seconds
+        :param numpy.ndarray finished: boolean array, False for the models that did not finish in time,
+                                       whose run time is their time out. Defaults to None (all finished)
+        :param int max_iterations: maximum number of fits with censored run times. Defaults to 50.
+        :return: the fitted predictor
+        :rtype: RuntimePredictor
+        """
+        parameters = np.asarray(parameters, dtype=np.float64)
+        finished = np.ones(len(parameters), dtype=bool) if finished is None else np.asarray(finished, dtype=bool)
+        n_features = 2 * len(INPUT_PARAMETER_NAMES) + 1
+        if finished.sum() < n_features:
+            raise ValueError(f"At least {n_features} past run times of finished models are needed to fit "
+                             f"the run time predictor, got {finished.sum()}.")
+
+        self.mean = parameters.mean(axis=0)
+        self.std = parameters.std(axis=0)
+        self.std[self.std == 0] = 1.
+
+        X = self.features(parameters)
+        gram = X.T @ X + self.ridge * np.eye(X.shape[1])
+        lower = np.log(times)
+        y = lower.copy()
+
+        for _ in range(max_iterations):
+            self.coefficients = np.linalg.solve(gram, X.T @ y)
+            fitted = X @ self.coefficients
+
+            # mean of the residuals of the finished models above each of them
+            residuals = np.sort(y[finished] - fitted[finished])
+            tail_means = np.cumsum(residuals[::-1])[::-1] / np.arange(len(residuals), 0, -1)
+            above = np.searchsorted(residuals, lower[~finished] - fitted[~finished], side="right")
+            censored = lower[~finished].copy()
+            longer = above < len(residuals)
+            censored[longer] = np.maximum(fitted[~finished][longer] + tail_means[above[longer]], censored[longer])
+
+            if np.allclose(censored, y[~finished]):
+                break
+            y[~finished] = censored
+
+        # spread of the finished run times around the prediction, in log space
+        self.residuals = lower[finished] - X[finished] @ self.coefficients
+        self.finished_parameters = (parameters[finished] - self.mean) / self.std
+        return self
+
+    def fit_history(self, sample_dirs: list):
+        """
+        Fit the predictor on the run times of previously parsed samples, see load_history().
+
+        :param list sample_dirs: paths of the sample directories
+        :return: the fitted predictor
+        :rtype: RuntimePredictor
+        """
+        return self.fit(*self.load_history(sample_dirs))
+
+    def predict(self, parameters: np.ndarray):
+        """
+        Predict the run time of models.
+
+        :param numpy.ndarray parameters: 2D array of input parameters (models x parameters)
+        :return times: predicted run times in seconds
+        :rtype: numpy.ndarray
+        """
+        if self.coefficients is None:
+            raise ValueError("The run time predictor has not been fit.")
+        return np.exp(self.features(parameters) @ self.coefficients)
+
+    def predict_quantile(self, parameters: np.ndarray, quantile: float = 0.99, chunk_size: int = 256):
+        """
+        Predict the run time within which the given fraction of models like these finish, from the
+        distribution of the residuals of the fit of the past finished models nearest to each model in
+        (standardized) input parameters, e.g. to set per-model time outs.
+
+        :param numpy.ndarray parameters: 2D array of input parameters (models x parameters)
+        :param float quantile: fraction of the models that finish within the returned time. Defaults to 0.99.
+        :param int chunk_size: number of models whose nearest past models are searched at once. Defaults to 256.
+        :return times: run times in seconds
+        :rtype: numpy.ndarray
+        """
+        predicted = self.predict(parameters)
+        scaled = (np.asarray(parameters, dtype=np.float64) - self.mean) / self.std
+        n_neighbours = min(self.neighbours, len(self.residuals))
+        past_norms = np.square(self.finished_parameters).sum(axis=1)
+
+        spread = np.empty(len(scaled))
+        for start in range(0, len(scaled), chunk_size):
+            chunk = scaled[start:start + chunk_size]
+            distances = np.square(chunk).sum(axis=1)[:, None] - 2 * chunk @ self.finished_parameters.T + past_norms
+            nearest = np.argpartition(distances, n_neighbours - 1, axis=1)[:, :n_neighbours]
+            spread[start:start + chunk_size] = np.quantile(self.residuals[nearest], quantile, axis=1)
+
+        return predicted * np.exp(spread)
@@ -8,6 +8,15 @@ CLOUDY_PATH = '~/c17.03/source/cloudy.exe'
 # time out for individual cloudy runs in seconds
 CLOUDY_RUN_TIMEOUT = 7200
 
+# lower bound of the per-model time outs predicted from previous runs, in seconds
+CLOUDY_MIN_RUN_TIMEOUT = 60
+
+# directory of the cache of model outputs shared by all samples, used with QueueManager(result_cache=True)
+RESULT_CACHE_DIR = '~/.cache/pyNublado/results'
+
+# maximum size of the result cache in GB, the least recently used results are evicted beyond it
+RESULT_CACHE_MAX_GB = 100
+
 # The stellar atmospheres model (BPASS in our case)
 STELLAR_MODEL_DIR = 'binaries'
 STELLAR_MODEL_MOD_FILE = 'bpass_v2p2.1_imf_chab300_burst_binary.mod'
@@ -0,0 +1,129 @@
+import pathlib
+import shutil
+
+import numpy as np
+import pytest
+
+import sys
+# relative to this file, so the tests also run from the repository root
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.joinpath("src")))
+
+from src.common.settings import SAMPLE_SUBDIR_TODO, SAMPLE_SUBDIR_DONE, INPUT_PARAMETER_NAMES
+
+# outputs of a Cloudy model shipped with the repository, copied in every successful model of the test samples
+OUT_MODELS_DIR = pathlib.Path(__file__).resolve().parent.parent.joinpath("examples", "out_models")
+
+N_MODELS = 10
+
+OK_TAIL = " Cloudy ends: 908 zones, 3 iterations, 2 warnings, 1 caution. (single thread) ExecTime(s) 326.50\n" \
+          " [Stop in cdMain at ../maincl.cpp:126, Cloudy exited OK]\n"
+
+
+def write_successful_model(model_dir):
+    """ Write the example outputs in a model directory, with a model.out file of a model that exited OK.
+    """
+    for item in OUT_MODELS_DIR.glob("foo.*"):
+        shutil.copy(item, model_dir.joinpath("model" + item.suffix))
+    model_dir.joinpath("model.out").write_text("output\n" * 2000 + OK_TAIL)
+
+
+def write_parameters(sample, n_models):
+    """ Write the input parameters file of a sample of n_models models.
+    """
+    rng = np.random.default_rng(0)
+    np.save(sample.joinpath(f"parameters_N{n_models}.npy"), rng.random((n_models, len(INPUT_PARAMETER_NAMES))))
+
+
+@pytest.fixture
+def sample_dir(tmp_path):
+    """ Sample directory of N_MODELS run models, built from the example outputs: most models exited OK,
+    some aborted and some have no model.out file, so every parsing path is exercised without Cloudy.
+    """
+    sample = tmp_path.joinpath(f"sample_N{N_MODELS}")
+    sample.joinpath(SAMPLE_SUBDIR_TODO).mkdir(parents=True)
+    sample.joinpath(SAMPLE_SUBDIR_DONE).mkdir()
+    write_parameters(sample, N_MODELS)
+
+    for i in range(N_MODELS):
+        model_dir = sample.joinpath(SAMPLE_SUBDIR_DONE, str(i))
+        model_dir.mkdir()
+        model_dir.joinpath("model.in").write_text("title model\n")
+
+        if i % 5 == 2:
+            model_dir.joinpath("model.out").write_text("output\n" * 100 + " PROBLEM ABORT\n")
+        elif i % 5 != 3:
+            write_successful_model(model_dir)
+
+    return sample
+
+
+def copy_sample(sample_dir, name):
+    """ Copy of a sample directory, next to it, to parse the same models with other settings.
+    """
+    return pathlib.Path(shutil.copytree(sample_dir, sample_dir.parent.joinpath(name, sample_dir.name)))
+
+
+# fake Cloudy executable: the title line of model.in tells it how the run goes, e.g. "title sleep 5"
+FAKE_CLOUDY = """#!/bin/sh
+read -r title behaviour argument < model.in
+echo "$PWD" >> "{runs_log}"
+case "$behaviour" in
+    abort)
+        printf 'output\\n PROBLEM ABORT\\n' > model.out
+        exit 0;;
+    hang)
+        printf 'output\\n PROBLEM ABORT\\n' > model.out
+        exec sleep 30;;
+    crash)
+        printf 'output\\n' > model.out
+        kill -9 $$;;
+    sleep)
+        printf 'output\\n' > model.out
+        sleep "$argument";;
+    warn)
+        printf 'output\\n did not converge\\n' > model.out
+        sleep "${{argument:-0}}";;
+esac
+for output in "{out_models_dir}"/foo.*; do
+    cp "$output" "model.${{output##*.}}"
+done
+cat "{ok_out}" >> model.out
+"""
+
+
+def write_todo_sample(root, behaviours):
+    """ Sample directory with one model to run in todo/ per behaviour of the fake Cloudy, see FAKE_CLOUDY.
+    """
+    sample = pathlib.Path(root).joinpath(f"sample_N{len(behaviours)}")
+    sample.joinpath(SAMPLE_SUBDIR_TODO).mkdir(parents=True)
+    sample.joinpath(SAMPLE_SUBDIR_DONE).mkdir()
+    write_parameters(sample, len(behaviours))
+
+    for i, behaviour in enumerate(behaviours):
+        model_dir = sample.joinpath(SAMPLE_SUBDIR_TODO, str(i))
+        model_dir.mkdir()
+        model_dir.joinpath("model.in").write_text(f"title {behaviour}\n")
+
+    return sample
+
+
+@pytest.fixture
+def fake_cloudy(tmp_path, monkeypatch):
+    """ Make the QueueManager run the fake Cloudy executable, see FAKE_CLOUDY.
+
+    :return runs_log: path of the file where every run of the fake Cloudy appends its directory
+    """
+    cloudy_dir = tmp_path.joinpath("cloudy")
+    cloudy_dir.mkdir()
+    runs_log = cloudy_dir.joinpath("runs.log")
+    runs_log.touch()
+    ok_out = cloudy_dir.joinpath("ok.out")
+    ok_out.write_text("output\n" * 2000 + OK_TAIL)
+
+    executable = cloudy_dir.joinpath("cloudy.exe")
+    executable.write_text(FAKE_CLOUDY.format(runs_log=runs_log, out_models_dir=OUT_MODELS_DIR, ok_out=ok_out))
+    executable.chmod(0o755)
+
+    monkeypatch.setattr("src.manager.CLOUDY_PATH", str(executable))
+    return runs_log
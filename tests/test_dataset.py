@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from conftest import N_MODELS
+from src.common.settings import DATASET_CACHE_DIR, SAMPLE_SUBDIR_DONE
+from src.parser import OutputParser, load_table, load_cont_cube
+from src.dataset import SampleDataset
+
+# models written by the sample_dir fixture with outputs of a model that exited OK
+SUCCESSFUL = [i for i in range(N_MODELS) if i % 5 not in [2, 3]]
+
+
+@pytest.fixture
+def parsed_sample(sample_dir):
+    OutputParser(cont_format="cube").parse(sample_dir)
+    return sample_dir
+
+
+def test_dataset_serves_the_successful_models(parsed_sample):
+    dataset = SampleDataset(parsed_sample)
+    assert len(dataset) == len(SUCCESSFUL)
+
+    batch = dataset[:]
+    assert batch["index"].tolist() == SUCCESSFUL
+
+    parameters = np.load(parsed_sample.joinpath(f"parameters_N{N_MODELS}.npy"))
+    np.testing.assert_allclose(batch["parameters"], parameters[SUCCESSFUL].astype(np.float32))
+
+    emis_df = load_table(parsed_sample.joinpath("emis")).drop_duplicates(subset="index")
+    emis_df = emis_df.set_index(emis_df["index"].astype(int))
+    np.testing.assert_allclose(batch["emis"], emis_df.loc[SUCCESSFUL, dataset.emis_columns].to_numpy(np.float32))
+
+    continuum, _, _, models = load_cont_cube(parsed_sample, mmap_mode=None)
+    rows = [models["index"].astype(int).tolist().index(index) for index in SUCCESSFUL]
+    np.testing.assert_allclose(batch["cont"], continuum[rows].astype(np.float32))
+
+
+def test_dataset_cache_follows_the_parsed_tables(parsed_sample):
+    SampleDataset(parsed_sample)
+    meta_file = parsed_sample.joinpath(DATASET_CACHE_DIR, "meta.pkl")
+    built = meta_file.stat().st_mtime_ns
+
+    # reused as long as the tables do not change
+    SampleDataset(parsed_sample)
+    assert meta_file.stat().st_mtime_ns == built
+
+    # rebuilt after a new parse, here with one successful model less
+    parsed_sample.joinpath(SAMPLE_SUBDIR_DONE, "0", "model.out").write_text("output\n PROBLEM ABORT\n")
+    OutputParser(cont_format="cube").parse(parsed_sample)
+    dataset = SampleDataset(parsed_sample)
+    assert meta_file.stat().st_mtime_ns != built
+    assert dataset.indexes.tolist() == SUCCESSFUL[1:]
+
+
+def test_dataset_batches_cover_every_model_once(parsed_sample):
+    dataset = SampleDataset(parsed_sample)
+
+    batches = list(dataset.iter_batches(batch_size=4, seed=0, normalize=True))
+    assert [len(batch["index"]) for batch in batches] == [4, len(SUCCESSFUL) - 4]
+    assert sorted(np.concatenate([batch["index"] for batch in batches]).tolist()) == SUCCESSFUL
+
+
+def test_dataset_without_cube(sample_dir):
+    OutputParser().parse(sample_dir)
+
+    with pytest.raises(ValueError):
+        SampleDataset(sample_dir, cont=True)
+    assert "cont" not in SampleDataset(sample_dir)[:2]
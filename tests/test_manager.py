@@ -0,0 +1,412 @@
+import os
+import time
+import sqlite3
+import subprocess
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import OK_TAIL, OUT_MODELS_DIR, write_todo_sample, copy_sample
+from src.common.settings import SAMPLE_SUBDIR_TODO, SAMPLE_SUBDIR_DONE, RESULT_STORE_FILE, RUN_LEDGER_FILE, \
+    EXIT_STATUSES, INPUT_PARAMETER_NAMES, RUN_TIMEOUTS_FILE, RUN_JOURNAL_FILE, \
+    SAMPLE_SUBDIR_RUNNING, RUN_CLAIM_FILE, PARSE_LOCK_DIR, PARSE_DONE_FILE
+from src.parser import OutputParser, load_table, save_table
+from src.manager import QueueManager, CloudyWatchdog, LEDGER_COLUMNS
+from src.journal import RunJournal
+from src.user_settings import CLOUDY_RUN_TIMEOUT, CLOUDY_MIN_RUN_TIMEOUT
+
+
+def run_manager(sample, N_CPUs=3, **kwargs):
+    queue = QueueManager(str(sample), N_CPUs=N_CPUs, verbose=False, **kwargs)
+    queue.manager_run()
+    return queue
+
+
+def read_ledger(sample):
+    return pd.read_csv(sample.joinpath(RUN_LEDGER_FILE)).set_index("index").sort_index()
+
+
+def history_parameters(n_models):
+    return np.random.default_rng(1).random((n_models, len(INPUT_PARAMETER_NAMES)))
+
+
+def write_history(root, parameters, times, status=None, timeout=None):
+    """ Parsed sample of past models: input parameters, run times and optionally status and time outs.
+    """
+    sample = root.joinpath(f"history_N{len(times)}")
+    sample.mkdir()
+    np.save(sample.joinpath(f"parameters_N{len(times)}.npy"), parameters)
+
+    status_df = pd.DataFrame({"index": [str(i) for i in range(len(times))],
+                              "status": status if status is not None else [EXIT_STATUSES["Success"]] * len(times),
+                              "time": times})
+    if timeout is not None:
+        status_df["timeout"] = timeout
+    save_table(status_df, sample.joinpath("status"))
+    return sample
+
+
+def test_parse_on_completion_matches_a_separate_parse(tmp_path, fake_cloudy):
+    sample = write_todo_sample(tmp_path, ["ok", "abort", "ok", "ok", "abort", "ok"])
+
+    run_manager(sample, parse_on_completion=True)
+    assert len(fake_cloudy.read_text().splitlines()) == 6
+
+    assert sorted(os.listdir(sample.joinpath(SAMPLE_SUBDIR_DONE))) == [str(i) for i in range(6)]
+    assert not os.listdir(sample.joinpath(SAMPLE_SUBDIR_TODO))
+    assert not sample.joinpath(RESULT_STORE_FILE).exists()
+
+    separate = copy_sample(sample, "separate")
+    OutputParser().parse(separate)
+    for table in ["inputs", "status", "emis"]:
+        pd.testing.assert_frame_equal(load_table(sample.joinpath(table)), load_table(separate.joinpath(table)))
+
+    status = load_table(sample.joinpath("status")).set_index("index")["status"]
+    assert status[["0", "2", "3", "5"]].tolist() == [EXIT_STATUSES["Success"]] * 4
+    assert status[["1", "4"]].tolist() == [EXIT_STATUSES["Abort"]] * 2
+
+
+def test_thread_executor_runs_in_awkward_paths_without_chdir(tmp_path, fake_cloudy):
+    root = tmp_path.joinpath("it's a \"sample\" dir; $HOME")
+    root.mkdir()
+    sample = write_todo_sample(root, ["ok", "abort", "ok", "ok"])
+    cwd = os.getcwd()
+
+    run_manager(sample, executor="thread")
+
+    assert os.getcwd() == cwd
+    # every model ran in its own directory, whatever the shell would make of the path
+    assert sorted(fake_cloudy.read_text().splitlines()) == \
+        [str(sample.joinpath(SAMPLE_SUBDIR_TODO, str(i))) for i in range(4)]
+    assert sorted(os.listdir(sample.joinpath(SAMPLE_SUBDIR_DONE))) == ["0", "1", "2", "3"]
+    assert sample.joinpath(SAMPLE_SUBDIR_DONE, "0", "model.out").read_text().endswith("Cloudy exited OK]\n")
+
+
+def test_asyncio_executor_waits_for_exits_and_kills_on_time_out(tmp_path, fake_cloudy, monkeypatch):
+    monkeypatch.setattr("src.manager.CLOUDY_RUN_TIMEOUT", 2)
+    sample = write_todo_sample(tmp_path, ["sleep 1", "ok", "crash", "hang", "abort"])
+
+    # count the wake ups of the event loop for each model
+    wake_ups = {}
+    supervise = QueueManager._supervise
+
+    def counting_supervise(self, process, model_dir, *args, **kwargs):
+        for delay in supervise(self, process, model_dir, *args, **kwargs):
+            wake_ups[model_dir] = wake_ups.get(model_dir, 0) + 1
+            yield delay
+
+    monkeypatch.setattr(QueueManager, "_supervise", counting_supervise)
+
+    start = time.monotonic()
+    run_manager(sample, N_CPUs=5, executor="asyncio")
+    assert time.monotonic() - start < 10
+
+    ledger = read_ledger(sample)
+    assert ledger["exit_code"].tolist() == [0, 0, -9, -9, 0]
+    assert ledger["timed_out"].tolist() == [False, False, False, True, False]
+    assert 2 <= ledger.loc[3, "wall"] < 5
+    assert 1 <= ledger.loc[0, "wall"] < 2
+    assert sorted(os.listdir(sample.joinpath(SAMPLE_SUBDIR_DONE))) == ["0", "1", "2", "3", "4"]
+
+    # the exit of the processes wakes the event loop, it does not poll them
+    assert wake_ups.get("0", 0) <= 1 and wake_ups.get("3", 0) <= 2
+
+
+def test_models_run_longest_predicted_first(tmp_path, fake_cloudy):
+    parameters = history_parameters(40)
+    history = write_history(tmp_path, parameters, 10 * np.exp(3 * parameters[:, 0]))
+    sample = write_todo_sample(tmp_path, ["ok"] * 6)
+
+    # a single worker runs the models in the order of the queue
+    run_manager(sample, N_CPUs=1, runtime_history=[str(history)])
+
+    parameters = np.load(sample.joinpath("parameters_N6.npy"))
+    expected = [str(sample.joinpath(SAMPLE_SUBDIR_TODO, str(i))) for i in np.argsort(-parameters[:, 0])]
+    assert fake_cloudy.read_text().splitlines() == expected
+
+
+def test_watchdog_stops_failed_runs_early(tmp_path, fake_cloudy, monkeypatch):
+    monkeypatch.setattr("src.manager.WATCHDOG_INTERVAL", 0.1)
+    sample = write_todo_sample(tmp_path, ["hang", "warn 1", "ok"])
+
+    start = time.monotonic()
+    run_manager(sample, watchdog=True, parse_on_completion=True)
+    # the hung model would sleep for 30s
+    assert time.monotonic() - start < 10
+
+    ledger = read_ledger(sample)
+    assert ledger["watchdog"].fillna("").tolist() == ["ABORT", "", ""]
+    assert ledger["exit_code"].tolist() == [-9, 0, 0]
+
+    # without watchdog_strict, a model that did not converge in a zone goes on and ends well
+    status = load_table(sample.joinpath("status")).set_index("index")["status"]
+    assert status.tolist() == [EXIT_STATUSES["Abort"], EXIT_STATUSES["Success"], EXIT_STATUSES["Success"]]
+
+
+def test_strict_watchdog_stops_models_that_do_not_converge(tmp_path, fake_cloudy, monkeypatch):
+    monkeypatch.setattr("src.manager.WATCHDOG_INTERVAL", 0.1)
+    sample = write_todo_sample(tmp_path, ["warn 5", "ok"])
+
+    run_manager(sample, watchdog=True, watchdog_strict=True)
+
+    assert read_ledger(sample)["watchdog"].fillna("").tolist() == ["did not converge", ""]
+    assert "watchdog stopped the run" in sample.joinpath(SAMPLE_SUBDIR_DONE, "0", "model.out").read_text()
+
+
+def test_watchdog_finds_markers_split_between_reads(tmp_path):
+    out_file = tmp_path.joinpath("model.out")
+    watchdog = CloudyWatchdog(str(out_file))
+
+    out_file.write_text("output\n PROBLEM AB")
+    assert not watchdog.check()
+    with open(out_file, "a") as f:
+        f.write("ORT\n")
+    assert watchdog.check()
+    assert watchdog.reason == "ABORT"
+
+
+def test_watchdog_detects_stalled_runs(tmp_path):
+    out_file = tmp_path.joinpath("model.out")
+    out_file.write_text("output\n")
+    watchdog = CloudyWatchdog(str(out_file), stall_timeout=0.2)
+
+    assert not watchdog.check()
+    time.sleep(0.3)
+    assert watchdog.check()
+    assert watchdog.reason.startswith("no output")
+
+    # a stalled run is not an abort, the parser classifies it from the rest of model.out
+    watchdog.record()
+    assert "ABORT" not in out_file.read_text()
+
+
+def test_adaptive_timeouts_ignore_the_models_that_did_not_finish(tmp_path, fake_cloudy):
+    # the longest past models did not finish within CLOUDY_RUN_TIMEOUT
+    parameters = history_parameters(200)
+    run_times = 10 * np.exp(3 * parameters[:, 0])
+    dnf = parameters[:, 0] > 0.9
+    status = np.where(dnf, EXIT_STATUSES["DNF"], EXIT_STATUSES["Success"])
+    history = write_history(tmp_path, parameters, np.where(dnf, np.nan, run_times), status=status)
+    sample = write_todo_sample(tmp_path, ["ok"] * 6)
+
+    queue = run_manager(sample, runtime_history=[str(history)], adaptive_timeout=True)
+
+    timeouts = pd.read_pickle(sample.joinpath(RUN_TIMEOUTS_FILE))
+    assert sorted(timeouts) == list(range(6))
+    assert all(timeout < CLOUDY_RUN_TIMEOUT for timeout in timeouts.values())
+
+    # away from the models that did not finish, the time outs stay close to the run times
+    new_parameters = np.load(sample.joinpath("parameters_N6.npy"))
+    for index, timeout in timeouts.items():
+        if new_parameters[index, 0] < 0.8:
+            assert timeout < 3 * max(10 * np.exp(3 * new_parameters[index, 0]), CLOUDY_MIN_RUN_TIMEOUT)
+    assert queue.timeouts == {str(index): timeout for index, timeout in timeouts.items()}
+    assert not list(sample.glob("*.lock"))
+
+
+def test_no_timeouts_file_without_adaptive_timeouts(tmp_path, fake_cloudy):
+    sample = write_todo_sample(tmp_path, ["ok", "ok"])
+
+    run_manager(sample)
+    QueueManager(str(sample), verbose=False).requeue_dnf()
+
+    assert sorted(os.listdir(sample)) == sorted([SAMPLE_SUBDIR_TODO, SAMPLE_SUBDIR_DONE, "parameters_N2.npy",
+                                                 RUN_LEDGER_FILE])
+
+
+def test_ledger_records_the_resources_of_every_model(tmp_path, fake_cloudy):
+    sample = write_todo_sample(tmp_path, ["sleep 1", "crash", "abort"])
+
+    # the workers are forked from this process, the memory of this array must not count for Cloudy
+    ballast = np.ones(400 * 2**20 // 8)
+    run_manager(sample, executor="process")
+    del ballast
+
+    ledger = pd.read_csv(sample.joinpath(RUN_LEDGER_FILE))
+    assert list(ledger.columns) == LEDGER_COLUMNS
+    ledger = ledger.set_index("index").sort_index()
+
+    assert ledger["exit_code"].tolist() == [0, -9, 0]
+    assert not ledger["timed_out"].any()
+    assert 1 <= ledger.loc[0, "wall"] < 5
+    assert (ledger[["wait", "spawn", "user", "sys", "move"]] >= 0).all().all()
+    assert ledger.loc[0, "max_rss_mb"] < 100
+
+
+def test_journal_records_the_state_of_every_model(tmp_path, fake_cloudy):
+    sample = write_todo_sample(tmp_path, ["ok", "abort", "ok"])
+
+    run_manager(sample, journal=True)
+
+    journal = RunJournal(sample.joinpath(RUN_JOURNAL_FILE))
+    assert journal.counts() == {"queued": 0, "running": 0, "done": 2, "failed": 1}
+    assert journal.models("failed") == [1]
+
+
+def test_journal_only_recovers_the_dead_runs_of_this_host(tmp_path, fake_cloudy):
+    sample = write_todo_sample(tmp_path, ["ok"] * 5)
+    journal = RunJournal(sample.joinpath(RUN_JOURNAL_FILE))
+    journal.add(range(5))
+
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    # 0: Cloudy of this host died, 1: still running here, 2: running on another host,
+    # 3: died after its directory was moved to done/, 4: still queued
+    journal.start(0, dead.pid)
+    journal.start(1, os.getpid())
+    journal.start(2, dead.pid)
+    journal.start(3, dead.pid)
+    with sqlite3.connect(sample.joinpath(RUN_JOURNAL_FILE)) as connection:
+        connection.execute("UPDATE models SET host='another-host' WHERE model=2")
+    sample.joinpath(SAMPLE_SUBDIR_TODO, "0", "model.out").write_text("partial output\n")
+    done_dir = sample.joinpath(SAMPLE_SUBDIR_TODO, "3").rename(sample.joinpath(SAMPLE_SUBDIR_DONE, "3"))
+    done_dir.joinpath("model.out").write_text("output\n" + OK_TAIL)
+
+    run_manager(sample, journal=True)
+
+    assert sorted(fake_cloudy.read_text().splitlines()) == \
+        [str(sample.joinpath(SAMPLE_SUBDIR_TODO, model)) for model in ["0", "4"]]
+    assert journal.models("done") == [0, 3, 4]
+    assert [model for model, _, _ in journal.running()] == [1, 2]
+    assert sorted(os.listdir(sample.joinpath(SAMPLE_SUBDIR_TODO))) == ["1", "2"]
+
+
+def count_parses(monkeypatch):
+    parses = []
+    parse = QueueManager._parse
+
+    def counting_parse(self):
+        parses.append(self)
+        parse(self)
+
+    monkeypatch.setattr(QueueManager, "_parse", counting_parse)
+    return parses
+
+
+def test_distributed_managers_run_every_model_once_and_parse_once(tmp_path, fake_cloudy, monkeypatch):
+    monkeypatch.setattr("src.manager.CLAIM_POLL_INTERVAL", 0.1)
+    parses = count_parses(monkeypatch)
+    sample = write_todo_sample(tmp_path, ["sleep 0.2"] * 8)
+
+    errors = []
+
+    def manager():
+        try:
+            run_manager(sample, N_CPUs=2, executor="thread", distributed=True, parse_on_completion=True)
+        except Exception as e:
+            errors.append(e)
+
+    managers = [threading.Thread(target=manager) for _ in range(2)]
+    for thread in managers:
+        thread.start()
+    for thread in managers:
+        thread.join()
+    assert not errors
+
+    runs = fake_cloudy.read_text().splitlines()
+    assert sorted(runs) == sorted(str(sample.joinpath(SAMPLE_SUBDIR_RUNNING, str(i))) for i in range(8))
+    assert len(load_table(sample.joinpath("status"))) == 8
+    assert len(parses) == 1
+
+    # a manager that finishes later finds the tables up to date
+    run_manager(sample, distributed=True, parse_on_completion=True)
+    assert len(parses) == 1
+    assert sample.joinpath(PARSE_DONE_FILE).exists()
+    assert not sample.joinpath(PARSE_LOCK_DIR).exists()
+
+
+def test_distributed_manager_runs_the_models_of_expired_leases(tmp_path, fake_cloudy, monkeypatch):
+    monkeypatch.setattr("src.manager.CLAIM_POLL_INTERVAL", 0.1)
+    monkeypatch.setattr("src.manager.CLAIM_LEASE_TIMEOUT", 1)
+    sample = write_todo_sample(tmp_path, ["ok", "ok"])
+
+    # model 1 was just claimed by a manager of another host, which then died
+    sample.joinpath(SAMPLE_SUBDIR_RUNNING).mkdir()
+    claimed = sample.joinpath(SAMPLE_SUBDIR_TODO, "1").rename(sample.joinpath(SAMPLE_SUBDIR_RUNNING, "1"))
+    claimed.joinpath(RUN_CLAIM_FILE).write_text("another-host 12345\n")
+    claimed.joinpath("model.out").write_text("partial output\n")
+
+    start = time.monotonic()
+    run_manager(sample, distributed=True, parse_on_completion=True)
+    assert time.monotonic() - start < 10
+
+    assert fake_cloudy.read_text().splitlines() == [str(sample.joinpath(SAMPLE_SUBDIR_RUNNING, model))
+                                                    for model in ["0", "1"]]
+    assert not os.listdir(sample.joinpath(SAMPLE_SUBDIR_RUNNING))
+    status = load_table(sample.joinpath("status")).set_index("index")["status"]
+    assert status.tolist() == [EXIT_STATUSES["Success"]] * 2
+
+
+@pytest.mark.parametrize("with_history", [False, True])
+def test_shards_are_disjoint_and_cover_the_sample(tmp_path, fake_cloudy, with_history):
+    parameters = history_parameters(40)
+    runtime_history = [str(write_history(tmp_path, parameters, 10 * np.exp(3 * parameters[:, 0])))] \
+        if with_history else None
+    sample = write_todo_sample(tmp_path, ["ok"] * 9)
+
+    # the jobs of the array start one after the other, each sees the models left by the others
+    shards = []
+    for shard_index in range(3):
+        runs_before = len(fake_cloudy.read_text().splitlines())
+        run_manager(sample, shard_index=shard_index, shard_count=3, runtime_history=runtime_history)
+        shards.append(set(fake_cloudy.read_text().splitlines()[runs_before:]))
+
+    assert set.union(*shards) == {str(sample.joinpath(SAMPLE_SUBDIR_TODO, str(i))) for i in range(9)}
+    assert sum(len(shard) for shard in shards) == 9
+    assert all(shards)
+
+
+def test_result_cache_skips_identical_models(tmp_path, fake_cloudy, monkeypatch):
+    monkeypatch.setattr("src.manager.RESULT_CACHE_DIR", str(tmp_path.joinpath("cache")))
+    first = write_todo_sample(tmp_path.joinpath("first"), ["ok 0", "abort", "ok 2"])
+    second = write_todo_sample(tmp_path.joinpath("second"), ["ok 0", "abort", "ok 2"])
+
+    run_manager(first, result_cache=True)
+    run_manager(second, result_cache=True, parse_on_completion=True)
+
+    # the failed model is not cached, it runs again
+    assert len(fake_cloudy.read_text().splitlines()) == 4
+    assert read_ledger(second)["cached"].tolist() == [True, False, True]
+    status = load_table(second.joinpath("status")).set_index("index")["status"]
+    assert status.tolist() == [EXIT_STATUSES["Success"], EXIT_STATUSES["Abort"], EXIT_STATUSES["Success"]]
+
+
+def test_scratch_runs_are_copied_back(tmp_path, fake_cloudy):
+    scratch = tmp_path.joinpath("scratch")
+    scratch.mkdir()
+    sample = write_todo_sample(tmp_path, ["ok", "abort", "crash"])
+
+    run_manager(sample, scratch_dir=str(scratch), parse_on_completion=True)
+
+    # Cloudy ran on the scratch directory, which is left empty
+    assert all(run.startswith(str(scratch)) for run in fake_cloudy.read_text().splitlines())
+    assert not os.listdir(scratch)
+
+    separate = copy_sample(sample, "separate")
+    OutputParser().parse(separate)
+    for table in ["status", "emis"]:
+        pd.testing.assert_frame_equal(load_table(sample.joinpath(table)), load_table(separate.joinpath(table)))
+    outputs = [item for item in os.listdir(sample.joinpath(SAMPLE_SUBDIR_DONE, "0")) if item.startswith("model.")]
+    assert sorted(outputs) == sorted(["model.in", "model.out"] + [f"model{item.suffix}"
+                                                                  for item in OUT_MODELS_DIR.glob("foo.*")])
+    assert read_ledger(sample)["copy_back"].notna().all()
+
+
+def test_compressed_outputs_parse_like_uncompressed_ones(tmp_path, fake_cloudy):
+    compressed = write_todo_sample(tmp_path.joinpath("compressed"), ["ok", "abort", "ok 2", "crash"])
+    plain = write_todo_sample(tmp_path.joinpath("plain"), ["ok", "abort", "ok 2", "crash"])
+
+    run_manager(compressed, compress=True)
+    run_manager(plain)
+
+    outputs = os.listdir(compressed.joinpath(SAMPLE_SUBDIR_DONE, "0"))
+    assert "model.in" in outputs and all(item.endswith(".gz") for item in outputs if item != "model.in")
+
+    OutputParser().parse(compressed, n_workers=2, structure=True)
+    OutputParser().parse(plain, n_workers=2, structure=True)
+    for table in ["status", "emis", "ovr", "heat", "cool"]:
+        pd.testing.assert_frame_equal(load_table(compressed.joinpath(table)), load_table(plain.joinpath(table)))
+    pd.testing.assert_frame_equal(pd.read_pickle(compressed.joinpath("cont.pkl")),
+                                  pd.read_pickle(plain.joinpath("cont.pkl")))
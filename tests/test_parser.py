@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import N_MODELS, copy_sample, write_successful_model
+from src.common.settings import SAMPLE_SUBDIR_DONE, PARSE_MANIFEST_FILE, OPD_CUBE_DIR
+from src.parser import OutputParser, load_table, load_cont_cube, load_opd_cube
+
+
+def assert_tables_equal(sample_a, sample_b, tables=("inputs", "status", "emis")):
+    for table in tables:
+        pd.testing.assert_frame_equal(load_table(sample_a.joinpath(table)), load_table(sample_b.joinpath(table)))
+
+
+def test_pool_parse_matches_serial_parse(sample_dir):
+    pool_dir = copy_sample(sample_dir, "pool")
+
+    OutputParser().parse(sample_dir, n_workers=1)
+    OutputParser().parse(pool_dir, n_workers=3)
+
+    for table in ["inputs.pkl", "status.pkl", "emis.pkl", "cont.pkl"]:
+        assert sample_dir.joinpath(table).read_bytes() == pool_dir.joinpath(table).read_bytes(), \
+            f"{table} of the pool parse differs from the serial parse."
+
+
+def test_compat_ids_match_hash_list(sample_dir):
+    parser = OutputParser()
+    parser.parse(sample_dir, hash_mode="compat")
+
+    parameters = np.load(sample_dir.joinpath(f"parameters_N{N_MODELS}.npy"))
+    ids = load_table(sample_dir.joinpath("inputs"))["id"].tolist()
+
+    assert ids == [parser.hash_list(row) for row in parameters]
+
+
+def test_fast_ids_are_unique_and_stable(sample_dir):
+    parameters = np.load(sample_dir.joinpath(f"parameters_N{N_MODELS}.npy"))
+    ids = OutputParser().hash_inputs(parameters)
+
+    assert len(set(ids)) == N_MODELS
+    # -0.0 and 0.0 are the same input parameter
+    assert OutputParser().hash_inputs(np.zeros((1, 3))) == OutputParser().hash_inputs(-np.zeros((1, 3)))
+    assert OutputParser().hash_inputs(parameters[::-1]) == ids[::-1]
+
+
+def test_incremental_parse_matches_full_parse(sample_dir):
+    OutputParser().parse(sample_dir, incremental=True)
+
+    # one model fails on a second run, another one that had no output now exited OK
+    sample_dir.joinpath(SAMPLE_SUBDIR_DONE, "1", "model.out").write_text("output\n" * 10 + " PROBLEM ABORT\n")
+    write_successful_model(sample_dir.joinpath(SAMPLE_SUBDIR_DONE, "3"))
+
+    full_dir = copy_sample(sample_dir, "full")
+    OutputParser().parse(sample_dir, incremental=True)
+    OutputParser().parse(full_dir)
+
+    assert_tables_equal(sample_dir, full_dir)
+    pd.testing.assert_frame_equal(pd.read_pickle(sample_dir.joinpath("cont.pkl")),
+                                  pd.read_pickle(full_dir.joinpath("cont.pkl")))
+
+
+def test_manifest_is_only_kept_by_incremental_parses(sample_dir):
+    OutputParser().parse(sample_dir, incremental=True)
+    assert sample_dir.joinpath(PARSE_MANIFEST_FILE).exists()
+
+    # a full parse rewrites the tables, the manifest would no longer describe them
+    OutputParser().parse(sample_dir)
+    assert not sample_dir.joinpath(PARSE_MANIFEST_FILE).exists()
+
+
+def test_npy_tables_match_pickle_tables(sample_dir):
+    npy_dir = copy_sample(sample_dir, "npy")
+
+    OutputParser().parse(sample_dir, n_workers=3)
+    OutputParser(output_format="npy").parse(npy_dir, n_workers=3)
+
+    assert npy_dir.joinpath("status", "columns.npy").exists()
+    assert_tables_equal(sample_dir, npy_dir)
+
+
+def test_npy_table_column_projection(sample_dir):
+    OutputParser(output_format="npy").parse(sample_dir)
+
+    status_df = load_table(sample_dir.joinpath("status"))
+    projected = load_table(sample_dir.joinpath("status"), columns=["index", "status"])
+
+    assert list(projected.columns) == ["index", "status"]
+    pd.testing.assert_frame_equal(projected, status_df[["index", "status"]])
+
+
+def test_streaming_parse_matches_in_memory_parse(sample_dir):
+    streaming_dir = copy_sample(sample_dir, "streaming")
+
+    OutputParser(output_format="npy").parse(sample_dir)
+    # blocks much smaller than the outputs of a model, so the tables are written in several blocks
+    OutputParser(output_format="npy").parse(streaming_dir, max_memory_mb=0.1, n_workers=3)
+
+    assert_tables_equal(sample_dir, streaming_dir)
+
+    continuum, photon_energy, components, models = load_cont_cube(sample_dir, mmap_mode=None)
+    streaming_continuum, streaming_energy, streaming_components, streaming_models = \
+        load_cont_cube(streaming_dir, mmap_mode=None)
+    np.testing.assert_array_equal(continuum, streaming_continuum)
+    np.testing.assert_array_equal(photon_energy, streaming_energy)
+    assert list(components) == list(streaming_components)
+    pd.testing.assert_frame_equal(models, streaming_models)
+
+
+def test_streaming_parse_needs_npy_tables(sample_dir):
+    with pytest.raises(ValueError):
+        OutputParser().parse(sample_dir, max_memory_mb=0.1)
+
+
+def test_pool_structure_parse_matches_serial_parse(sample_dir):
+    pool_dir = copy_sample(sample_dir, "pool")
+
+    OutputParser().parse(sample_dir, structure=True)
+    OutputParser().parse(pool_dir, n_workers=3, structure=True)
+
+    assert_tables_equal(sample_dir, pool_dir, tables=("ovr", "heat", "cool"))
+    assert len(load_table(sample_dir.joinpath("ovr"))) == 6
+
+    optical_depth, photon_energy, components, models = load_opd_cube(sample_dir, mmap_mode=None)
+    pool_optical_depth, _, _, pool_models = load_opd_cube(pool_dir, mmap_mode=None)
+    assert optical_depth.shape == (6, len(photon_energy), len(components))
+    np.testing.assert_array_equal(optical_depth, pool_optical_depth)
+    pd.testing.assert_frame_equal(models, pool_models)
+
+
+def test_structure_parse_cleans_up_on_error(sample_dir):
+    OutputParser().parse(sample_dir)
+
+    # the optical depth of one model on a shorter photon energy grid than the others
+    opd_file = sample_dir.joinpath(SAMPLE_SUBDIR_DONE, "5", "model.opd")
+    opd_file.write_text("".join(opd_file.read_text().splitlines(keepends=True)[:-10]))
+
+    with pytest.raises(ValueError):
+        OutputParser().parse_structure(sample_dir.joinpath(SAMPLE_SUBDIR_DONE), n_workers=3)
+
+    assert not sample_dir.joinpath(OPD_CUBE_DIR, "optical_depth.tmp.npy").exists()
@@ -0,0 +1,79 @@
+import os
+
+from src.common.settings import RESULT_CACHE_SIZE_FILE
+from src.result_cache import ResultCache
+
+
+def write_model(model_dir, title, size):
+    model_dir.mkdir(parents=True)
+    model_dir.joinpath("model.in").write_text(f"title {title}\n")
+    model_dir.joinpath("model.out").write_bytes(b"x" * size)
+    return model_dir
+
+
+def recorded_size(cache):
+    return int(cache.path.joinpath(RESULT_CACHE_SIZE_FILE).read_text())
+
+
+def test_store_and_fetch(tmp_path):
+    cache = ResultCache(tmp_path.joinpath("cache"), 1, ["cloudy.exe"])
+    model_dir = write_model(tmp_path.joinpath("0"), "model", 100)
+    key = cache.key(model_dir.joinpath("model.in"))
+
+    cache.store(key, model_dir)
+
+    # comments and blank lines do not change the key
+    other_dir = write_model(tmp_path.joinpath("1"), "model", 10)
+    other_dir.joinpath("model.in").write_text("# a comment\n\n  title model\n")
+    fetched_dir = tmp_path.joinpath("fetched")
+    fetched_dir.mkdir()
+    assert cache.fetch(cache.key(other_dir.joinpath("model.in")), fetched_dir)
+    assert fetched_dir.joinpath("model.out").read_bytes() == b"x" * 100
+    assert not fetched_dir.joinpath("model.in").exists()
+    assert recorded_size(cache) == 100
+
+
+def test_store_keeps_a_running_size_and_evicts_the_least_recently_used(tmp_path, monkeypatch):
+    cache = ResultCache(tmp_path.joinpath("cache"), 3500 / 1024 ** 3, ["cloudy.exe"])
+
+    keys = []
+    for i in range(3):
+        model_dir = write_model(tmp_path.joinpath(str(i)), f"model {i}", 1000)
+        keys.append(cache.key(model_dir.joinpath("model.in")))
+        cache.store(keys[-1], model_dir)
+        os.utime(cache._entry(keys[-1]), (i, i))
+
+    # model 0 was used last, model 1 is the least recently used
+    os.utime(cache._entry(keys[0]), (10, 10))
+
+    scans = []
+    scan = ResultCache._scan
+    monkeypatch.setattr(ResultCache, "_scan", lambda self: scans.append(1) or scan(self))
+
+    model_dir = write_model(tmp_path.joinpath("3"), "model 3", 1000)
+    cache.store(cache.key(model_dir.joinpath("model.in")), model_dir)
+    # the cache went beyond its size: scanned once, brought back below 0.9 of its size
+    assert len(scans) == 1
+    assert not cache._entry(keys[1]).exists()
+    assert cache._entry(keys[0]).exists() and cache._entry(keys[2]).exists()
+    assert recorded_size(cache) == 3000
+
+    # within the size, no scan
+    model_dir = write_model(tmp_path.joinpath("4"), "model 4", 100)
+    cache.store(cache.key(model_dir.joinpath("model.in")), model_dir)
+    assert len(scans) == 1
+    assert recorded_size(cache) == 3100
+
+
+def test_size_is_recorded_for_an_existing_cache(tmp_path):
+    cache = ResultCache(tmp_path.joinpath("cache"), 1, ["cloudy.exe"])
+    model_dir = write_model(tmp_path.joinpath("0"), "model", 100)
+    cache.store(cache.key(model_dir.joinpath("model.in")), model_dir)
+
+    # e.g. a cache filled before the size was recorded
+    cache.path.joinpath(RESULT_CACHE_SIZE_FILE).unlink()
+    cache = ResultCache(cache.path, 1, ["cloudy.exe"])
+    assert recorded_size(cache) == 100
+
+    assert cache.evict(low_water=0) == 0
+    assert recorded_size(cache) == 0
@@ -0,0 +1,53 @@
+import gzip
+
+from src.common.settings import COMPRESSED_SUFFIX
+from src.common.utils import utils_compress_file, utils_open_output, utils_output_exists, utils_read_file_tail
+
+
+def test_compress_file_round_trip(tmp_path):
+    out_file = tmp_path.joinpath("model.out")
+    text = "".join(f"line {i}\n" for i in range(10000))
+    out_file.write_text(text)
+
+    utils_compress_file(out_file)
+
+    assert not out_file.exists()
+    assert gzip.decompress(tmp_path.joinpath("model.out" + COMPRESSED_SUFFIX).read_bytes()).decode() == text
+    with utils_open_output(out_file) as f:
+        assert f.read() == text
+
+
+def test_compressed_files_are_deterministic(tmp_path):
+    compressed = []
+    for name in ["a", "b"]:
+        out_file = tmp_path.joinpath(name, "model.out")
+        out_file.parent.mkdir()
+        out_file.write_text("output\n" * 100)
+        utils_compress_file(out_file)
+        compressed.append(out_file.parent.joinpath("model.out" + COMPRESSED_SUFFIX).read_bytes())
+
+    assert compressed[0] == compressed[1]
+
+
+def test_tail_of_compressed_file(tmp_path):
+    text = "".join(f"line {i}\n" for i in range(10000))
+    plain = tmp_path.joinpath("plain.out")
+    plain.write_text(text)
+    compressed = tmp_path.joinpath("compressed.out")
+    compressed.write_text(text)
+    utils_compress_file(compressed)
+
+    assert utils_read_file_tail(plain, 3) == "line 9997\nline 9998\nline 9999\n"
+    assert utils_read_file_tail(compressed, 3) == utils_read_file_tail(plain, 3)
+    assert utils_read_file_tail(plain, 3, block_size=4) == utils_read_file_tail(plain, 3)
+
+
+def test_output_exists(tmp_path):
+    tmp_path.joinpath("model.emis").write_text("emis\n")
+    tmp_path.joinpath("model.cont").write_text("cont\n")
+    utils_compress_file(tmp_path.joinpath("model.cont"))
+    files = {item.name for item in tmp_path.iterdir()}
+
+    for path, exists in [("model.emis", True), ("model.cont", True), ("model.opd", False)]:
+        assert utils_output_exists(tmp_path.joinpath(path)) == exists
+        assert utils_output_exists(tmp_path.joinpath(path), files=files) == exists